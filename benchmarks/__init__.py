@@ -0,0 +1,3 @@
+"""
+ชุด Benchmark ของ Pipeline: ตัวสร้างข้อมูลจำลอง /coins/markets, API Stub บนเครื่อง และตัววัด Throughput รายขั้นตอน
+"""
@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+from benchmarks.payloads import market_page
+
+
+class CoingeckoStub:
+    """
+    เซิร์ฟเวอร์ HTTP จำลอง CoinGecko API บนเครื่อง (Local) สำหรับวัดประสิทธิภาพขั้น Extract โดยไม่ต้องใช้ API จริง
+    รองรับ /api/v3/ping และ /api/v3/coins/markets (แบ่งหน้าด้วย page/per_page เหมือนของจริง)
+
+    Args:
+        total_coins (int): จำนวนเหรียญทั้งตลาด
+        latency_ms (float): เวลาหน่วงต่อคำขอ (จำลอง Network Round-trip)
+        throttle_every (int): ตอบ 429 ทุกๆ คำขอที่ N (0 = ปิด) เพื่อทดสอบเส้นทาง Retry/Backoff
+        retry_after (int): ค่า Header Retry-After ที่ส่งกลับพร้อม 429
+        seed (int): Seed ของข้อมูลจำลอง
+
+    ใช้งาน:
+        with CoingeckoStub(total_coins=10000, latency_ms=50) as stub:
+            client.base_url = stub.base_url
+    """
+
+    def __init__(self, total_coins: int, latency_ms: float = 0.0, throttle_every: int = 0, retry_after: int = 1,
+                 seed: int = 42, dirty_ratio: float = 0.05, host: str = '127.0.0.1', port: int = 0):
+        self.total_coins = total_coins
+        self.latency_ms = latency_ms
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.seed = seed
+        self.dirty_ratio = dirty_ratio
+        self.request_count = 0
+        self.throttled_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/api/v3'
+
+    def _next_request(self) -> bool:
+        """ นับคำขอและตัดสินว่าคำขอนี้ต้องโดน 429 หรือไม่ (คืนค่า True หากต้อง Throttle) """
+        with self._lock:
+            self.request_count += 1
+            throttled = bool(self.throttle_every) and self.request_count % self.throttle_every == 0
+            if throttled:
+                self.throttled_count += 1
+            return throttled
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                # ไม่พิมพ์ Access Log ทุกคำขอ (รบกวนผลการวัด)
+                pass
+
+            def _send_json(self, status: int, body, headers: dict = None):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if stub.latency_ms:
+                    time.sleep(stub.latency_ms / 1000.0)
+
+                url = urlparse(self.path)
+                if url.path.endswith('/ping'):
+                    self._send_json(200, {'gecko_says': '(V3) To the Moon!'})
+                    return
+                if not url.path.endswith('/coins/markets'):
+                    self._send_json(404, {'error': 'Not Found'})
+                    return
+                if stub._next_request():
+                    self._send_json(429, {'status': {'error_code': 429, 'error_message': 'Rate limit exceeded'}},
+                                    headers={'Retry-After': str(stub.retry_after)})
+                    return
+
+                query = parse_qs(url.query)
+                page = int(query.get('page', ['1'])[0])
+                per_page = int(query.get('per_page', ['100'])[0])
+                self._send_json(200, market_page(page, per_page, stub.total_coins, stub.seed, stub.dirty_ratio))
+
+        return Handler
+
+    def start(self) -> 'CoingeckoStub':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'CoingeckoStub':
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
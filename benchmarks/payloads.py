@@ -0,0 +1,109 @@
+import json
+import random
+import string
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Tuple
+
+# ชนิดของข้อมูลสกปรกที่พบจริงใน /coins/markets (ตรงกับกรณีใน test_transform_handles_dirty_data)
+DIRTY_KINDS = ('null_price', 'string_price', 'missing_keys', 'zero_price', 'zero_volume', 'null_market_cap')
+
+_BASE_TIME = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _coin_name(index: int, rng: random.Random) -> Tuple[str, str, str]:
+    symbol = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 5)))
+    name = f'{symbol.capitalize()} Coin {index}'
+    return f'{symbol}-coin-{index}', symbol, name
+
+
+def make_market_item(index: int, rng: random.Random, dirty_ratio: float = 0.05) -> Dict[str, Any]:
+    """
+    สร้างข้อมูลตลาดของเหรียญหนึ่งเหรียญในรูปแบบเดียวกับ CoinGecko /coins/markets
+    ราคาและมูลค่าตลาดลดหลั่นตามอันดับ (Power-law) เพื่อให้การกระจายของค่าใกล้เคียงข้อมูลจริง
+    """
+    coin_id, symbol, name = _coin_name(index, rng)
+    rank = index + 1
+    price = round(60000.0 / (rank ** 1.1) * rng.uniform(0.5, 1.5), 8)
+    circulating_supply = round(rng.uniform(1e6, 1e10), 2)
+    market_cap = round(price * circulating_supply, 2)
+    total_volume = round(market_cap * rng.uniform(0.001, 0.3), 2)
+    change_pct = rng.uniform(-15, 15)
+    updated = _BASE_TIME + timedelta(seconds=rng.randint(0, 86400))
+
+    item = {
+        'id': coin_id,
+        'symbol': symbol,
+        'name': name,
+        'image': f'https://assets.coingecko.com/coins/images/{rank}/large/{symbol}.png',
+        'current_price': price,
+        'market_cap': market_cap,
+        'market_cap_rank': rank,
+        'fully_diluted_valuation': round(market_cap * rng.uniform(1.0, 2.0), 2),
+        'total_volume': total_volume,
+        'high_24h': round(price * 1.05, 8),
+        'low_24h': round(price * 0.95, 8),
+        'price_change_24h': round(price * change_pct / 100, 8),
+        'price_change_percentage_24h': round(change_pct, 5),
+        'market_cap_change_24h': round(market_cap * change_pct / 100, 2),
+        'market_cap_change_percentage_24h': round(change_pct, 5),
+        'circulating_supply': circulating_supply,
+        'total_supply': round(circulating_supply * rng.uniform(1.0, 1.5), 2),
+        'max_supply': None,
+        'ath': round(price * rng.uniform(1.0, 10.0), 8),
+        'ath_change_percentage': round(rng.uniform(-99, 0), 5),
+        'ath_date': '2024-03-14T07:10:36.635Z',
+        'atl': round(price * rng.uniform(0.001, 1.0), 8),
+        'atl_change_percentage': round(rng.uniform(0, 1e5), 5),
+        'atl_date': '2013-07-06T00:00:00.000Z',
+        'roi': None,
+        'last_updated': updated.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+    }
+
+    if rng.random() < dirty_ratio:
+        kind = rng.choice(DIRTY_KINDS)
+        if kind == 'null_price':
+            item['current_price'] = None
+        elif kind == 'string_price':
+            item['current_price'] = str(price)
+        elif kind == 'missing_keys':
+            item = {'id': coin_id, 'symbol': symbol}
+        elif kind == 'zero_price':
+            item['current_price'] = 0
+        elif kind == 'zero_volume':
+            item['total_volume'] = 0
+        else:
+            item['market_cap'] = None
+    return item
+
+
+def market_page(page: int, per_page: int, total_coins: int, seed: int = 42,
+                dirty_ratio: float = 0.05) -> List[Dict[str, Any]]:
+    """
+    สร้างข้อมูลหนึ่งหน้า (เริ่มที่ 1) แบบ Deterministic: หน้าเดียวกันได้ข้อมูลเดิมเสมอโดยไม่ต้องสร้างทั้งตลาด
+    """
+    start = (page - 1) * per_page
+    end = min(start + per_page, total_coins)
+    if start >= end:
+        return []
+    rng = random.Random(f'{seed}:{page}:{per_page}')
+    return [make_market_item(index, rng, dirty_ratio) for index in range(start, end)]
+
+
+def iter_market_pages(total_coins: int, per_page: int = 250, seed: int = 42,
+                      dirty_ratio: float = 0.05) -> Iterator[List[Dict[str, Any]]]:
+    """ ทยอยสร้างข้อมูลทีละหน้า เพื่อให้ขนาด 1M เหรียญไม่ต้องอยู่ในหน่วยความจำพร้อมกันทั้งหมด """
+    for page in range(1, -(-total_coins // per_page) + 1):
+        yield market_page(page, per_page, total_coins, seed, dirty_ratio)
+
+
+def generate_market_payload(total_coins: int, seed: int = 42, dirty_ratio: float = 0.05) -> List[Dict[str, Any]]:
+    """ สร้างข้อมูลตลาดทั้งหมดเป็น List เดียว (รูปแบบเดียวกับผลลัพธ์ของ get_all_coin_markets) """
+    payload = []
+    for page in iter_market_pages(total_coins, seed=seed, dirty_ratio=dirty_ratio):
+        payload.extend(page)
+    return payload
+
+
+def to_staging_rows(payload: List[Dict[str, Any]]) -> List[Tuple[str]]:
+    """ แปลงเป็นรูปแบบแถวที่อ่านจาก stg_crypto_markets (raw_data,) สำหรับ transform_logic """
+    return [(json.dumps(item),) for item in payload]
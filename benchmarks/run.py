@@ -0,0 +1,224 @@
+"""
+ชุด Benchmark ของ Pipeline: วัด Throughput ของแต่ละขั้นตอนด้วยข้อมูลจำลองที่ทำซ้ำได้ และเทียบกับ Baseline ที่บันทึกไว้
+
+ใช้งาน:
+    python -m benchmarks.run --sizes 1000 10000 --save-baseline main
+    python -m benchmarks.run --sizes 1000 10000 --compare main        # Exit code 1 หากช้ากว่า Baseline เกินเกณฑ์
+    python -m benchmarks.run --only extract --latency-ms 50 --throttle-every 10
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+from benchmarks.api_stub import CoingeckoStub
+from benchmarks.payloads import generate_market_payload, to_staging_rows
+from src.extractors.coingecko import CoingeckoClient
+from src.extractors.rate_limiter import TokenBucket
+from src.loaders.sqlite_loader import SQLiteLoader
+from src.quality.data_quality import DataqualityValidator
+from src.transformers.crypto_transformer import CryptoTransformer
+from src.utils.database import get_database
+from src.utils.logger import logger
+
+BASELINE_DIR = Path(__file__).resolve().parent / 'baselines'
+
+DEFAULT_SIZES = (100, 1000, 10000)
+
+
+class Timer:
+    """ จับเวลาเฉพาะส่วนที่ต้องการวัด (ไม่รวมการเตรียมข้อมูล) """
+
+    def __init__(self):
+        self.seconds = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        return False
+
+
+@lru_cache(maxsize=4)
+def _payload(size: int) -> List[Dict[str, Any]]:
+    # สร้างข้อมูลจำลองครั้งเดียวต่อขนาด แล้วใช้ร่วมกันทุก Benchmark และทุกรอบ
+    return generate_market_payload(size)
+
+
+@lru_cache(maxsize=4)
+def _staging_rows(size: int) -> List[Tuple[str]]:
+    return to_staging_rows(_payload(size))
+
+
+@lru_cache(maxsize=4)
+def _clean_rows(size: int) -> List[Tuple]:
+    with tempfile.TemporaryDirectory() as workdir:
+        transformer = CryptoTransformer(db_path=os.path.join(workdir, 'clean.db'))
+        clean, _ = transformer.apply_rules(_staging_rows(size), batch_id='bench')
+        transformer.db.close()
+    return clean
+
+
+def bench_extract(size: int, workdir: str, timer: Timer, options: argparse.Namespace) -> int:
+    client = CoingeckoClient(rate_limiter=TokenBucket(rate_per_minute=10 ** 9, burst=10 ** 6))
+    client.cache = None
+    with CoingeckoStub(size, latency_ms=options.latency_ms, throttle_every=options.throttle_every) as stub:
+        client.base_url = stub.base_url
+        with timer:
+            return sum(len(page) for page in client.iter_market_pages())
+
+
+def bench_load_to_staging(size: int, workdir: str, timer: Timer, options: argparse.Namespace) -> int:
+    payload = _payload(size)
+    loader = SQLiteLoader(db_path=os.path.join(workdir, 'bench.db'))
+    with timer:
+        loader.load_to_staging(payload)
+    return len(payload)
+
+
+def bench_transform_logic(size: int, workdir: str, timer: Timer, options: argparse.Namespace) -> int:
+    rows = _staging_rows(size)
+    transformer = CryptoTransformer(db_path=os.path.join(workdir, 'bench.db'))
+    with timer:
+        transformer.transform_logic(rows, batch_id='bench')
+    return len(rows)
+
+
+def bench_validate_market_data(size: int, workdir: str, timer: Timer, options: argparse.Namespace) -> int:
+    data = _clean_rows(size)
+    validator = DataqualityValidator()
+    with timer:
+        validator.validate_market_data(data)
+    return len(data)
+
+
+def bench_save_to_core(size: int, workdir: str, timer: Timer, options: argparse.Namespace) -> int:
+    data = _clean_rows(size)
+    transformer = CryptoTransformer(db_path=os.path.join(workdir, 'bench.db'))
+    with timer:
+        transformer.save_to_core(data)
+    return len(data)
+
+
+BENCHMARKS: Dict[str, Callable[[int, str, Timer, argparse.Namespace], int]] = {
+    'extract': bench_extract,
+    'load_to_staging': bench_load_to_staging,
+    'transform_logic': bench_transform_logic,
+    'validate_market_data': bench_validate_market_data,
+    'save_to_core': bench_save_to_core,
+}
+
+
+def run_benchmark(name: str, size: int, options: argparse.Namespace) -> Dict[str, float]:
+    """
+    รัน Benchmark หนึ่งรายการซ้ำตามจำนวนรอบ โดยแต่ละรอบใช้ฐานข้อมูลและโฟลเดอร์ทำงานใหม่
+    (ไฟล์ข้างเคียงของ Pipeline เช่น data/metrics จะถูกเขียนลงโฟลเดอร์ชั่วคราว ไม่ปนกับโปรเจกต์)
+    """
+    timings = []
+    rows = 0
+    cwd = os.getcwd()
+    for _ in range(options.repeat):
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            try:
+                timer = Timer()
+                rows = BENCHMARKS[name](size, workdir, timer, options)
+                timings.append(timer.seconds)
+            finally:
+                os.chdir(cwd)
+                get_database(os.path.join(workdir, 'bench.db')).close()
+
+    median = statistics.median(timings)
+    return {
+        'rows': rows,
+        'median_seconds': median,
+        'min_seconds': min(timings),
+        'rows_per_second': rows / median if median else None,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    """ เทียบค่ามัธยฐานของเวลากับ Baseline และคืนรายการที่ช้าลงเกินเกณฑ์ที่ยอมรับได้ """
+    regressions = []
+    for name, sizes in current['results'].items():
+        for size, result in sizes.items():
+            reference = baseline.get('results', {}).get(name, {}).get(size)
+            if reference is None:
+                print(f'{name:<22} {size:>9}  (no baseline)')
+                continue
+            ratio = result['median_seconds'] / reference['median_seconds'] if reference['median_seconds'] else 1.0
+            flag = 'REGRESSION' if ratio > 1 + tolerance else ''
+            print(f'{name:<22} {size:>9}  {reference["median_seconds"]:.4f}s -> {result["median_seconds"]:.4f}s '
+                  f'({ratio:.2f}x) {flag}')
+            if flag:
+                regressions.append(f'{name}[{size}]')
+    return regressions
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Crypto ELT pipeline benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='Number of coins per benchmark (e.g. 100 1000 1000000)')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Injected latency of the API stub')
+    parser.add_argument('--throttle-every', type=int, default=0, help='Answer every Nth API request with 429')
+    parser.add_argument('--save-baseline', metavar='NAME', help='Save results to benchmarks/baselines/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='Compare results with benchmarks/baselines/NAME.json')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed slowdown before flagging (0.10 = 10%%)')
+    parser.add_argument('--output', help='Also write the results JSON to this path')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    # ลด Log ของ Pipeline ระหว่างวัดผล เพื่อไม่ให้ I/O ของ Log บิดเบือนผลลัพธ์
+    logger.setLevel(logging.WARNING)
+    # Backoff ของ 429 ใช้ค่า Retry-After ของ Stub (Client ทำตาม Header นี้อยู่แล้ว) แทน Exponential Backoff 4-10 วินาที
+
+    current = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'repeat': options.repeat,
+            'latency_ms': options.latency_ms,
+            'throttle_every': options.throttle_every,
+        },
+        'results': {},
+    }
+    for name in options.only or BENCHMARKS:
+        for size in options.sizes:
+            result = run_benchmark(name, size, options)
+            current['results'].setdefault(name, {})[str(size)] = result
+            print(f'{name:<22} {size:>9}  median {result["median_seconds"]:.4f}s  '
+                  f'{result["rows_per_second"] or 0:,.0f} rows/s')
+
+    if options.output:
+        Path(options.output).write_text(json.dumps(current, indent=2))
+    if options.save_baseline:
+        BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+        path = BASELINE_DIR / f'{options.save_baseline}.json'
+        path.write_text(json.dumps(current, indent=2))
+        print(f'Baseline saved to {path}')
+    if options.compare:
+        baseline = json.loads((BASELINE_DIR / f'{options.compare}.json').read_text())
+        regressions = compare(baseline, current, options.tolerance)
+        if regressions:
+            print(f'Regressions beyond {options.tolerance:.0%}: {", ".join(regressions)}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
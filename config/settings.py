@@ -1,5 +1,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
+import threading
 from pathlib import Path
+from typing import List, Optional
 
 # 1. Project Root Directory: กำหนดตำแหน่งหลักของโปรเจกต์ เพื่อให้เรียกใช้ Path ต่างๆ ได้แม่นยำไม่ว่าจะรันจากโฟลเดอร์ไหน
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -21,8 +23,99 @@ class Settings(BaseSettings):
     API_TIMEOUT: int = 30 
     RETRY_COUNT: int = 5
     LOG_LEVEL: str = 'INFO' 
+    # จำนวน Log สูงสุดต่อนาทีของข้อความแม่แบบเดียวกัน (ส่วนที่เกินจะถูกนับเป็น suppressed), 0 = ไม่จำกัด
+    LOG_RATE_LIMIT_PER_MINUTE: int = 100
     BATCH_SIZE: int = 100
 
+    # การดึงข้อมูลทั้งตลาดแบบหลายหน้าพร้อมกัน (Concurrent Pagination)
+    # CoinGecko รองรับ per_page สูงสุด 250 และแผน Demo จำกัดที่ประมาณ 30 คำขอต่อนาที
+    MARKET_PAGE_SIZE: int = 250
+    MAX_PAGES: Optional[int] = None   # None = ดึงจนกว่าจะหมดหน้า
+    MAX_WORKERS: int = 4
+    API_RATE_LIMIT_PER_MINUTE: int = 30
+    API_RATE_LIMIT_BURST: int = 5
+    # False = ดึงหน้าเดียวขนาด BATCH_SIZE (พฤติกรรมเดิม), True = ดึงทั้งตลาดตาม MARKET_PAGE_SIZE/MAX_PAGES
+    FULL_MARKET_EXTRACT: bool = False
+    # สกุลเงินอ้างอิงที่ดึงพร้อมกันในแต่ละรอบ (ทุกสกุลเงินอยู่ใน Batch เดียวกัน แยกกันด้วยคอลัมน์ vs_currency)
+    # ตั้งค่าผ่าน .env เป็น JSON เช่น VS_CURRENCIES='["usd", "eur"]'
+    VS_CURRENCIES: List[str] = ['usd', 'eur', 'thb', 'btc']
+
+    # DAG แบบแยกขั้นตอน (dags/elt_scheduler.py): จำนวน Shard ของการดึงข้อมูลที่รันขนานกันเป็น Task แยก
+    # และโฟลเดอร์พักข้อมูลดิบระหว่างขั้น extract กับ stage (ส่งเฉพาะ batch_id ผ่าน XCom)
+    EXTRACT_SHARDS: int = 4
+    LANDING_DIR: str = 'data/landing'
+
+    # จำนวนแถวต่อการเขียนหนึ่งครั้ง (executemany) ลง Staging: หน่วยความจำสูงสุดจะขึ้นกับค่านี้ ไม่ใช่ขนาด Batch
+    STAGING_CHUNK_SIZE: int = 500
+
+    # Backend ของ Staging / Fact Table เลือกจาก Scheme ของ DATABASE_URL ('sqlite:///...' หรือ 'postgresql://...')
+    # เมื่อใช้ PostgreSQL: ขนาด Connection Pool และไฟล์ SQLite ที่เก็บตารางสถานะ (Ledger / CDC / Rejects / Metrics)
+    POSTGRES_POOL_MIN: int = 1
+    POSTGRES_POOL_MAX: int = 8
+    STATE_DB_PATH: str = 'data/pipeline_state.db'
+
+    # การปรับแต่ง SQLite (ใช้โดย src/utils/database.py)
+    SQLITE_CACHE_SIZE_KB: int = 65536       # Page Cache ต่อ Connection (64 MB)
+    SQLITE_MMAP_SIZE_MB: int = 256          # Memory-mapped I/O สำหรับการอ่านแบบ Scan
+    SQLITE_BUSY_TIMEOUT_SECONDS: int = 30   # เวลารอเมื่อมี Writer อื่นถือ Lock อยู่
+
+    # เลือก Transform Engine: 'python' (ประมวลผลทีละแถวใน Python), 'columnar' (NumPy แบบทั้ง Batch)
+    # หรือ 'sql' (ประมวลผลใน SQLite ด้วย json_extract)
+    TRANSFORM_ENGINE: str = 'python'
+
+    # สัดส่วนแถวที่ละเมิดกฎ DQ ได้สูงสุดก่อนจะถือว่า Batch ไม่ผ่าน (0 = ต้องสะอาดทั้ง Batch)
+    DQ_FAILURE_THRESHOLD: float = 0.0
+
+    # จำนวนครั้งที่ Batch ล้มเหลวได้สูงสุด (เช่น ไม่ผ่าน DQ ซ้ำ) ก่อนถูกบันทึกเป็น 'rejected' และเลิก Retry, 0 = ไม่จำกัด
+    BATCH_MAX_ATTEMPTS: int = 3
+
+    # การตรวจจับค่าผิดปกติข้าม Batch ด้วยสถิติสะสมรายเหรียญ: 'warn' = แจ้งเตือนอย่างเดียว, 'fail' = หยุดการโหลด
+    ANOMALY_DETECTION_ENABLED: bool = True
+    ANOMALY_ACTION: str = 'warn'
+    ANOMALY_Z_THRESHOLD: float = 6.0
+    ANOMALY_PCT_THRESHOLD: float = 10.0     # เปลี่ยนแปลงเกิน 1000% จากค่าล่าสุด
+    ANOMALY_MIN_SAMPLES: int = 5            # จำนวนตัวอย่างขั้นต่ำก่อนใช้ z-score
+
+    # การวัดผลประสิทธิภาพรายขั้นตอน: บันทึกลงตาราง pipeline_metrics และ Export เป็น JSON / Prometheus Textfile
+    METRICS_ENABLED: bool = True
+    METRICS_EXPORT_DIR: str = 'data/metrics'
+    METRICS_TRACE_MEMORY: bool = False      # เปิด tracemalloc เพื่อวัดหน่วยความจำสูงสุดรายขั้นตอน (ช้าลง)
+
+    # การประมวลผล Staging ย้อนหลังแบบขนาน (python main.py reprocess): 0 = ใช้จำนวน CPU ทั้งหมด
+    REPROCESS_WORKERS: int = 0
+    REPROCESS_WRITE_ROWS: int = 50000
+
+    # การดึงข้อมูลย้อนหลัง (python main.py backfill): ขนาดช่วงเวลาต่อคำขอ (<= 90 วันได้ข้อมูลรายชั่วโมง),
+    # จำนวนคำขอที่ทำพร้อมกัน และจำนวนแถวขั้นต่ำต่อหนึ่ง Transaction ของการเขียน
+    BACKFILL_WINDOW_DAYS: int = 90
+    BACKFILL_WORKERS: int = 4
+    BACKFILL_WRITE_ROWS: int = 5000
+
+    # โหมด Daemon (python main.py daemon): ดึงข้อมูลทุก N วินาทีและส่งเฉพาะเหรียญที่เปลี่ยนเป็น Micro-batch
+    # จำนวน Micro-batch ที่รอเขียนได้สูงสุด หากเต็ม การเปลี่ยนแปลงถัดไปจะถูกรวมเข้ากับรอบต่อไป (Backpressure)
+    POLL_INTERVAL_SECONDS: int = 60
+    DAEMON_QUEUE_SIZE: int = 2
+
+    # สำเนา Parquet ของ Fact Table สำหรับงานวิเคราะห์ (ต้องติดตั้ง pyarrow) แบ่ง Partition รายวัน (และรายเหรียญหากเปิด)
+    PARQUET_MIRROR_ENABLED: bool = False
+    PARQUET_MIRROR_DIR: str = 'data/lake/fct_crypto_prices'
+    PARQUET_PARTITION_BY_COIN: bool = False
+    PARQUET_COMPRESSION: str = 'snappy'
+
+    # Retention ของ Staging (python main.py compact): Batch ที่เก่ากว่า N วันถูกย้ายไปเป็น Segment รายวันแบบบีบอัด
+    STAGING_RETENTION_DAYS: int = 30
+    STAGING_ARCHIVE_DIR: str = 'data/archive/staging'
+
+    # แคชผลลัพธ์ของ API ลงดิสก์ (ปิดไว้เป็นค่าเริ่มต้น) เพื่อให้การ Retry/รันซ้ำภายในช่วง TTL ไม่ต้องยิง API ใหม่
+    HTTP_CACHE_ENABLED: bool = False
+    HTTP_CACHE_PATH: str = 'data/cache/http_cache.db'
+    HTTP_CACHE_TTL_SECONDS: int = 3600
+    HTTP_CACHE_MAX_MB: int = 256
+
+    # Change Data Capture: บันทึกลง Staging / Fact Table เฉพาะเหรียญที่ข้อมูลเปลี่ยนจากเวอร์ชันล่าสุด
+    # เหรียญที่ไม่เปลี่ยนถูกบันทึกเป็นเพียงการอ้างอิงไปยัง Batch ที่เก็บเวอร์ชันนั้นไว้ (ดู src/loaders/change_tracker.py)
+    CDC_ENABLED: bool = False
+
     # 3. Pydantic Configuration: ตั้งค่าการอ่านไฟล์ .env
     model_config = SettingsConfigDict(
         # เชื่อมโยงกับไฟล์ .env ที่อยู่ส่วนกลางของโปรเจกต์
@@ -32,5 +125,43 @@ class Settings(BaseSettings):
         extra = 'ignore'  
     )
 
-# 4. Instantiate: สร้างตัวแปร settings เพื่อให้ไฟล์อื่นเรียกใช้งานได้ทันที (Singleton Pattern)
-settings = Settings()
\ No newline at end of file
+# 4. Lazy Singleton: สร้าง Settings (อ่าน .env / Environment) เมื่อถูกใช้งานครั้งแรกเท่านั้น
+# การ import โมดูลจึงไม่มี Side Effect (สำคัญสำหรับ Airflow Scheduler ที่ Parse ไฟล์ DAG ซ้ำตลอดเวลา)
+class LazySettings:
+    """
+    ตัวแทน (Proxy) ของ Settings: ส่งต่อการอ่าน/เขียน Attribute ไปยัง Instance จริงที่สร้างเมื่อจำเป็น
+    ไฟล์อื่นยังเรียกใช้ `from config.settings import settings` ได้เหมือนเดิม
+    """
+
+    def __init__(self):
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _load(self) -> Settings:
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    instance = Settings()
+                    object.__setattr__(self, '_instance', instance)
+        return instance
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+settings = LazySettings()
@@ -1,18 +1,20 @@
 from airflow import DAG
-from airflow.operators.python import PythonOperator
-from datetime import datetime, timedelta
+from airflow.decorators import task
+from datetime import timedelta
 import sys
 import pendulum # ใช้สำหรับจัดการเวลาไทย
 
 # บอก Airflow ว่าไฟล์ main.py อยู่ที่ไหน
 sys.path.append('/opt/airflow')
 
-from main import run_pipeline
+# หมายเหตุ: ทุก Task import โมดูลของ Pipeline ภายในฟังก์ชันเท่านั้น
+# Scheduler ที่ Parse ไฟล์นี้ซ้ำๆ จะไม่ต้องโหลด Settings, Logger, SQLite, requests ฯลฯ
+# และแต่ละ Task ส่งต่อกันผ่าน XCom เพียง batch_id (ข้อมูลจริงอยู่ในไฟล์ Landing / ตาราง Staging / ตารางพัก)
 
 # 1. ตั้งค่าเขตเวลาเป็นประเทศไทย
 local_tz = pendulum.timezone("Asia/Bangkok")
 
-# 2. กำหนดค่าเริ่มต้นของงาน (ตัวแปรที่หายไปก่อนหน้านี้)
+# 2. กำหนดค่าเริ่มต้นของงาน: Retry เป็นรายขั้นตอน ขั้นที่ล้มเหลวจะถูกรันใหม่เพียงขั้นเดียว
 default_args = {
     'owner': 'airflow',
     'depends_on_past': False,
@@ -23,17 +25,59 @@ default_args = {
     'retry_delay': timedelta(minutes=5),
 }
 
-# 3. สร้าง DAG
+# 3. สร้าง DAG แบบแยกขั้นตอน: plan -> extract (ขนานตาม Shard) -> stage -> transform -> validate -> load
 with DAG(
     'crypto_elt_auto_run',
     default_args=default_args,
     # รันตอน 05:00 และ 17:00 ของทุกวันตามเวลาไทย
     schedule_interval='0 5,17 * * *', 
     catchup=False,
+    max_active_runs=1,
     tags=['crypto', 'elt']
 ) as dag:
 
-    task_run_elt = PythonOperator(
-        task_id='run_main_elt_script',
-        python_callable=run_pipeline
-    )
\ No newline at end of file
+    @task
+    def plan_batch() -> str:
+        from src.pipeline.stages import new_batch_id
+        return new_batch_id()
+
+    @task
+    def plan_shards() -> list:
+        from src.pipeline.stages import plan_shards
+        return plan_shards()
+
+    # Dynamic Task Mapping: หนึ่ง Task ต่อหนึ่ง Shard (สกุลเงิน × ชุดหน้า) รันขนานกันบน LocalExecutor
+    @task(retries=3, retry_delay=timedelta(minutes=1))
+    def extract(batch_id: str, vs_currency: str, shard_index: int, shard_count: int) -> None:
+        from src.pipeline.stages import extract_shard
+        extract_shard(batch_id, shard_index=shard_index, shard_count=shard_count, vs_currency=vs_currency)
+
+    @task
+    def stage(batch_id: str) -> str:
+        from src.pipeline.stages import stage_batch
+        stage_batch(batch_id)
+        return batch_id
+
+    @task
+    def transform(batch_id: str) -> str:
+        from src.pipeline.stages import transform_batch
+        transform_batch(batch_id)
+        return batch_id
+
+    @task
+    def validate(batch_id: str) -> str:
+        from src.pipeline.stages import validate_batch
+        validate_batch(batch_id)
+        return batch_id
+
+    @task
+    def load(batch_id: str) -> str:
+        from src.pipeline.stages import load_batch
+        load_batch(batch_id)
+        return batch_id
+
+    batch_id = plan_batch()
+    extracted = extract.partial(batch_id=batch_id).expand_kwargs(plan_shards())
+    staged = stage(batch_id)
+    extracted >> staged
+    load(validate(transform(staged)))
@@ -1,8 +1,24 @@
+import argparse
+from datetime import datetime
 from src.extractors.coingecko import CoingeckoClient
 from src.loaders.sqlite_loader import SQLiteLoader
+from src.loaders.backends import get_backend
+from src.loaders.batch_ledger import BatchLedger
+from src.loaders.change_tracker import ChangeTracker
+from src.loaders.parquet_mirror import ParquetMirror
+from src.loaders.rollups import MarketRollups
+from src.loaders.staging_archive import StagingArchive
+from src.pipeline.backfill import HistoricalBackfill
+from src.pipeline.daemon import PollingDaemon
+from src.pipeline.stages import DataQualityError
 from src.transformers.crypto_transformer import CryptoTransformer
+from src.transformers.sql_transformer import SQLTransformEngine
+from src.transformers.reprocess import StagingReprocessor
 from src.quality.data_quality import DataqualityValidator
-from src.utils.logger import logger
+from src.quality.anomaly import AnomalyDetector
+from src.utils.logger import log_context, logger
+from src.utils.metrics import PipelineMetrics, track_stage
+from config.settings import settings
 
 def run_pipeline():
     """
@@ -11,40 +27,279 @@ def run_pipeline():
     """
     logger.info('--- Initiating Cryptocurrency ELT Pipeline ---')
 
-    # ขั้นตอนที่ 1: Extraction Phase (การดึงข้อมูลจากแหล่งต้นทาง)
-    # เรียกใช้งาน Client ที่มีระบบ Retry Logic (Tenacity) ในตัวเพื่อความเสถียร
+    if not settings.METRICS_ENABLED:
+        _run_pipeline_stages()
+        return
+
+    # เปิดการวัดผลรายขั้นตอน: ทุก Component ที่มี Hook จะบันทึกผลเข้า metrics โดยอัตโนมัติ
+    metrics = PipelineMetrics(trace_memory=settings.METRICS_TRACE_MEMORY)
+    try:
+        with metrics:
+            _run_pipeline_stages()
+    finally:
+        publish_metrics(metrics)
+
+def _run_pipeline_stages():
+    # ขั้นตอนที่ 1-2: Extract + Load แบบ Stream (การดึงข้อมูลจากแหล่งต้นทางและเก็บลง Staging / Data Lake)
+    # Client ทยอยส่งข้อมูลทีละหน้า (มีระบบ Retry รายหน้าและ Rate Limiter ในตัว) และ Loader เขียนลง Staging เป็นก้อนขนาดคงที่
+    # บันทึกข้อมูลดิบในรูปแบบ JSON เพื่อใช้สำหรับการตรวจสอบย้อนหลัง (Traceability)
+    # ทุกสกุลเงินใน settings.VS_CURRENCIES ถูกดึงพร้อมกันและบันทึกลง Batch เดียวกัน
     client = CoingeckoClient()
-    raw_data = client.get_coin_market()
+    if settings.FULL_MARKET_EXTRACT:
+        pages = client.iter_currency_pages(settings.VS_CURRENCIES, max_pages=settings.MAX_PAGES)
+    else:
+        pages = client.iter_currency_pages(settings.VS_CURRENCIES, per_page=settings.BATCH_SIZE, max_pages=1)
+
+    loader = SQLiteLoader()
+    try:
+        # เวลาของขั้น extract รวมช่วงที่ Loader เขียน Staging แบบ Stream ด้วย (เวลาเขียนล้วนๆ ดูได้จากขั้น stage)
+        with track_stage('extract') as extract_metrics:
+            current_batch_id, staged_count = loader.load_market_pages(pages)
+            extract_metrics.batch_id = current_batch_id
+            extract_metrics.rows_out = staged_count
+    except Exception:
+        # หากดึงข้อมูลไม่ได้ ให้หยุดการทำงานของ Pipeline ทันทีเพื่อความปลอดภัย (Staging ถูก Rollback แล้ว)
+        logger.error('Pipeline Aborted: Extraction or staging failed.')
+        return
+    finally:
+        extract_metrics.bytes_fetched = client.bytes_fetched
+        extract_metrics.retries = client.retry_count
 
-    if not raw_data:
-        # หากดึงข้อมูลไม่ได้ ให้หยุดการทำงานของ Pipeline ทันทีเพื่อความปลอดภัย
+    if not staged_count:
         logger.error('Pipeline Aborted: No data retrieved from API.')
         return
 
-    # ขั้นตอนที่ 2: Loading Phase (การเก็บข้อมูลลง Staging / Data Lake)
-    # บันทึกข้อมูลดิบในรูปแบบ JSON เพื่อใช้สำหรับการตรวจสอบย้อนหลัง (Traceability)
-    loader = SQLiteLoader()
-    current_batch_id = loader.load_to_staging(raw_data)
-
-    # ขั้นตอนที่ 3: Transformation Phase (การประมวลผลและคัดกรอง)
-    # ดึงข้อมูลจาก Staging ตาม Batch ล่าสุด และประยุกต์ใช้กฎทางธุรกิจ (Business Rules)
-    transformer = CryptoTransformer()
-    cleaned_data = transformer.get_cleaned_data(batch_id=current_batch_id)
-
-    # ขั้นตอนที่ 4: Data Quality Validation (การตรวจคุณภาพก่อนเข้าฐานข้อมูลจริง)
-    # ทำหน้าที่เป็น Gatekeeper ตรวจสอบความถูกต้องของข้อมูล (Data Integrity) เช่น ราคาต้อง > 0
-    dq = DataqualityValidator()
-    
-    # ตรวจสอบว่าข้อมูลใน Batch นี้ผ่านมาตรฐานคุณภาพหรือไม่
-    if dq.validate_market_data(cleaned_data):
+    # ขั้นตอนที่ 3-5: Transform -> DQ -> Load Core (ทำต่อจากข้อมูลใน Staging)
+    if process_batch(current_batch_id, ledger=loader.ledger):
+        logger.info('--- Pipeline Execution Completed Successfully ---')
+
+def publish_metrics(metrics: PipelineMetrics):
+    """
+    บันทึกตัวชี้วัดลงตาราง pipeline_metrics และ Export เป็น JSON / Prometheus Textfile
+    (ความล้มเหลวของการบันทึกตัวชี้วัดต้องไม่ทำให้ Pipeline ล้มเหลว)
+    """
+    if not metrics.stages:
+        return
+    try:
+        metrics.save()
+        metrics.export(settings.METRICS_EXPORT_DIR)
+        logger.info('Performance metrics recorded for %s stages (Run: %s).', len(metrics.stages), metrics.run_id)
+    except Exception as e:
+        logger.error('Failed to publish performance metrics: %s', e)
+
+def process_batch(batch_id: str, ledger: BatchLedger = None) -> bool:
+    """
+    ประมวลผล Batch ที่อยู่ใน Staging แล้ว: Transform -> DQ -> Load (Core) พร้อมบันทึกสถานะลง Ledger ทุกขั้น
+    ใช้ทั้งในการรันปกติและในโหมด Incremental เพื่อทำต่อจาก Batch ที่ค้างอยู่ โดยไม่ต้องดึงข้อมูลจาก API ใหม่
+    (ขั้น Transform เป็นแบบ Deterministic จึงคำนวณซ้ำจาก Staging ได้เสมอ)
+
+    Returns:
+        bool: True หาก Batch ถูกโหลดเข้า Core สำเร็จ
+    """
+    with log_context(batch_id=batch_id):
+        return _process_batch(batch_id, ledger or BatchLedger())
+
+def _process_batch_in_database(batch_id: str, ledger: BatchLedger) -> bool:
+    """ เส้นทางของ SQLTransformEngine: DQ Gate และ Anomaly Check ชุดเดียวกับ Engine แบบ Python ภายใน Transaction ของ SQL """
+    detector = AnomalyDetector() if settings.ANOMALY_DETECTION_ENABLED else None
+    loaded_rows = []
+
+    def validate(rows):
+        if not DataqualityValidator().validate_market_data(rows):
+            raise DataQualityError('Data Quality validation failed')
+        if detector is not None:
+            report = detector.check(rows, batch_id=batch_id)
+            if report.has_anomalies and settings.ANOMALY_ACTION == 'fail':
+                raise DataQualityError('Statistical anomaly check failed')
+        loaded_rows.extend(rows)
+
+    def finalize(conn):
+        if detector is not None:
+            detector.update(loaded_rows, batch_id=batch_id, conn=conn)
+        ledger.mark(batch_id, 'loaded', row_count=len(loaded_rows), conn=conn)
+
+    try:
+        SQLTransformEngine().run(batch_id=batch_id, validate=validate, on_commit=finalize)
+    except DataQualityError as e:
+        ledger.mark(batch_id, 'validated', status='failed', error=str(e))
+        logger.error('Pipeline Halted: %s. Ingestion cancelled.', e)
+        return False
+    return True
+
+def _process_batch(batch_id: str, ledger: BatchLedger) -> bool:
+    stage = 'transformed'
+
+    try:
+        # ขั้นตอนที่ 3-5 แบบ In-database: ประมวลผลกฎเดียวกันด้วย SQL ภายใน SQLite แล้วตรวจ DQ / Anomaly
+        # บนแถวที่ได้ก่อน Commit (ไม่ผ่าน = Rollback ทั้ง Batch)
+        # Backend อื่น (เช่น PostgreSQL) ใช้เส้นทาง Transform -> DQ -> Load ด้านล่างแทน
+        if settings.TRANSFORM_ENGINE == 'sql' and get_backend().name == 'sqlite':
+            stage = 'loaded'
+            return _process_batch_in_database(batch_id, ledger)
+
+        # ขั้นตอนที่ 3: Transformation Phase (การประมวลผลและคัดกรอง)
+        # ดึงข้อมูลจาก Staging ตาม Batch ล่าสุด และประยุกต์ใช้กฎทางธุรกิจ (Business Rules)
+        transformer = CryptoTransformer()
+        cleaned_data = transformer.get_cleaned_data(batch_id=batch_id)
+        ledger.mark(batch_id, 'transformed', row_count=len(cleaned_data))
+
+        # โหมด CDC: Batch ที่ไม่มีเหรียญใดเปลี่ยนเลยไม่มีอะไรต้องตรวจหรือโหลด (ทุกแถวถูกบันทึกเป็นการอ้างอิงแล้ว)
+        if not cleaned_data and ChangeTracker().is_unchanged_batch(batch_id):
+            logger.info('CDC: No changed coins in batch %s. Nothing to load.', batch_id)
+            ledger.mark(batch_id, 'loaded', row_count=0)
+            return True
+
+        # ขั้นตอนที่ 4: Data Quality Validation (การตรวจคุณภาพก่อนเข้าฐานข้อมูลจริง)
+        # ทำหน้าที่เป็น Gatekeeper ตรวจสอบความถูกต้องของข้อมูล (Data Integrity) เช่น ราคาต้อง > 0
+        stage = 'validated'
+        dq = DataqualityValidator()
+
+        # ตรวจสอบว่าข้อมูลใน Batch นี้ผ่านมาตรฐานคุณภาพหรือไม่
+        if not dq.validate_market_data(cleaned_data):
+            # หาก DQ ไม่ผ่าน: สั่งหยุดการทำงานเพื่อป้องกันข้อมูลที่ผิดพลาดหลุดเข้าสู่ระบบ Core
+            ledger.mark(batch_id, 'validated', status='failed', error='Data Quality validation failed')
+            logger.error('Pipeline Halted: Data Quality validation failed. Ingestion cancelled.')
+            return False
+
+        # ขั้นตอนที่ 4.1: ตรวจความผิดปกติเชิงสถิติเทียบกับสถิติสะสมรายเหรียญ (เช่น ราคากระโดด 1000 เท่า)
+        detector = AnomalyDetector() if settings.ANOMALY_DETECTION_ENABLED else None
+        if detector is not None:
+            anomalies = detector.check(cleaned_data, batch_id=batch_id)
+            if anomalies.has_anomalies and settings.ANOMALY_ACTION == 'fail':
+                ledger.mark(batch_id, 'validated', status='failed', error='Statistical anomaly check failed')
+                logger.error('Pipeline Halted: Statistical anomalies detected. Ingestion cancelled.')
+                return False
+        ledger.mark(batch_id, 'validated')
+        stage = 'loaded'
+
         # ขั้นตอนที่ 5: Final Load Phase (การนำข้อมูลเข้าสู่ Data Warehouse / Core Fact Table)
         # หากผ่านการตรวจ DQ ให้บันทึกข้อมูลที่ผ่านการขัดเกลาแล้วลงในตาราง Production
-        transformer.save_to_core(cleaned_data)
-        logger.info('--- Pipeline Execution Completed Successfully ---')
-    else:
-        # หาก DQ ไม่ผ่าน: สั่งหยุดการทำงานเพื่อป้องกันข้อมูลที่ผิดพลาดหลุดเข้าสู่ระบบ Core
-        logger.error('Pipeline Halted: Data Quality validation failed. Ingestion cancelled.')
+        # สถานะ 'loaded' และสถิติสะสมถูกบันทึกใน Transaction เดียวกับการ Upsert ลง Fact Table
+        # (CDC Fingerprint ขยับพร้อมกัน)
+        def finalize(conn):
+            if detector is not None:
+                detector.update(cleaned_data, batch_id=batch_id, conn=conn)
+            ledger.mark(batch_id, 'loaded', row_count=len(cleaned_data), conn=conn)
+
+        transformer.save_to_core(cleaned_data, on_commit=finalize)
+        return True
+
+    except Exception as e:
+        ledger.mark(batch_id, stage, status='failed', error=str(e))
+        logger.error('Pipeline Halted: Batch %s failed: %s', batch_id, e)
+        return False
+
+def run_incremental():
+    """
+    โหมด Incremental: ประมวลผลเฉพาะ Batch ใน Staging ที่ใหม่กว่า Watermark และทำต่อ Batch ที่ค้างอยู่กลางทาง
+    ใช้สำหรับไล่ตามข้อมูลหลังระบบล่ม โดยแตะเฉพาะข้อมูลใหม่เท่านั้น
+    """
+    logger.info('--- Initiating Incremental Catch-up ---')
+    ledger = BatchLedger()
+    pending = ledger.pending_batches()
+    succeeded = sum(1 for batch_id in pending if process_batch(batch_id, ledger=ledger))
+    logger.info('--- Incremental Catch-up Completed: %s/%s batches loaded ---', succeeded, len(pending))
+
+def reprocess_staging(workers: int = None, full_rebuild: bool = False, from_archive: bool = False):
+    """
+    ประมวลผลประวัติทั้งหมดใน Staging ใหม่แบบขนานหลาย Process เพื่อ Rebuild ตาราง fct_crypto_prices
+    (from_archive=True: ประมวลผล Batch ที่ถูกย้ายไปเก็บใน Segment ก่อน แล้วจึงประมวลผล Staging ที่เหลือ)
+    """
+    logger.info('--- Initiating Staging Reprocess ---')
+    reprocessor = StagingReprocessor(workers=workers)
+    reprocessor.run(full_rebuild=full_rebuild)
+    if from_archive:
+        reprocessor.run_archive()
+    logger.info('--- Staging Reprocess Completed ---')
+
+def compact_staging(retention_days: int = None):
+    """
+    ย้าย Batch ใน Staging ที่เก่ากว่าช่วง Retention ไปเก็บเป็น Segment รายวันแบบบีบอัด แล้วคืนพื้นที่ฐานข้อมูล
+    """
+    logger.info('--- Initiating Staging Compaction ---')
+    StagingArchive().compact(retention_days=retention_days)
+    logger.info('--- Staging Compaction Completed ---')
+
+def run_backfill(start: str, end: str, coin_ids: list = None, vs_currencies: list = None) -> dict:
+    """
+    โหมด Backfill: ดึงข้อมูลย้อนหลังช่วง [start, end) (YYYY-MM-DD) ลง fct_crypto_prices แบบขนานพร้อม Checkpoint
+    รันซ้ำด้วยช่วงวันที่เดิมเพื่อทำต่อจากงานที่ค้างหรือล้มเหลว
+    """
+    logger.info('--- Initiating Historical Backfill ---')
+    summary = HistoricalBackfill().run(
+        datetime.strptime(start, '%Y-%m-%d'), datetime.strptime(end, '%Y-%m-%d'),
+        coin_ids=coin_ids, vs_currencies=vs_currencies
+    )
+    logger.info('--- Historical Backfill Completed ---')
+    return summary
+
+def rebuild_rollups() -> int:
+    """
+    สร้างตารางสรุป (dim_coin_latest / agg_crypto_ohlc_*) ใหม่จาก Fact Table ทั้งหมด
+    ใช้ครั้งแรกหลังอัปเกรดฐานข้อมูลที่มีประวัติอยู่แล้ว หลังจากนั้นตารางสรุปอัปเดตเองทุกครั้งที่โหลด
+    """
+    logger.info('--- Rebuilding Rollup Tables ---')
+    total = MarketRollups().rebuild()
+    logger.info('--- Rollup Rebuild Completed ---')
+    return total
+
+def export_parquet(start: str = None, end: str = None) -> int:
+    """
+    สร้าง Partition รายวันของสำเนา Parquet ใหม่จาก Fact Table ในช่วง [start, end) (YYYY-MM-DD, ไม่ระบุ = ทุกวัน)
+    ใช้ครั้งแรกหลังเปิด PARQUET_MIRROR_ENABLED หรือหลัง Reprocess
+    """
+    logger.info('--- Exporting Parquet Mirror ---')
+    total = ParquetMirror().export_days(start, end)
+    logger.info('--- Parquet Export Completed ---')
+    return total
+
+def run_daemon(interval: float = None) -> dict:
+    """
+    โหมด Daemon: ดึงข้อมูลทุก interval วินาที (ค่าเริ่มต้น POLL_INTERVAL_SECONDS) และโหลดเฉพาะเหรียญที่เปลี่ยน
+    เป็น Micro-batch จนกว่าจะได้รับ SIGINT / SIGTERM
+    """
+    return PollingDaemon(interval=interval).run()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Cryptocurrency ELT Pipeline')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help='Run the end-to-end ELT pipeline (default)')
+    subparsers.add_parser('incremental', help='Process only staged batches after the last watermark')
+    reprocess = subparsers.add_parser('reprocess', help='Rebuild the fact table from staging in parallel')
+    reprocess.add_argument('--workers', type=int, default=None)
+    reprocess.add_argument('--full-rebuild', action='store_true')
+    reprocess.add_argument('--from-archive', action='store_true', help='Also reprocess archived staging segments')
+    compact = subparsers.add_parser('compact', help='Archive staging batches older than the retention window')
+    compact.add_argument('--retention-days', type=int, default=None)
+    backfill = subparsers.add_parser('backfill', help='Load historical prices from market_chart/range')
+    backfill.add_argument('--start', required=True, help='First day to load (YYYY-MM-DD)')
+    backfill.add_argument('--end', required=True, help='Day after the last day to load (YYYY-MM-DD)')
+    backfill.add_argument('--coins', nargs='+', default=None, help='Coin ids (default: current top BATCH_SIZE)')
+    backfill.add_argument('--currencies', nargs='+', default=None, help='Quote currencies (default: VS_CURRENCIES)')
+    subparsers.add_parser('rebuild-rollups', help='Recompute latest-price and OHLC tables from the fact table')
+    export = subparsers.add_parser('export-parquet', help='Rebuild Parquet mirror partitions from the fact table')
+    export.add_argument('--start', default=None, help='First day to export (YYYY-MM-DD)')
+    export.add_argument('--end', default=None, help='Day after the last day to export (YYYY-MM-DD)')
+    daemon = subparsers.add_parser('daemon', help='Poll continuously and load changed coins as micro-batches')
+    daemon.add_argument('--interval', type=float, default=None, help='Seconds between polls (default: POLL_INTERVAL_SECONDS)')
+    return parser.parse_args(argv)
 
 # จุดเริ่มต้นของการรันโปรแกรม
 if __name__ == '__main__':
-    run_pipeline()
\ No newline at end of file
+    args = parse_args()
+    if args.command == 'incremental':
+        run_incremental()
+    elif args.command == 'reprocess':
+        reprocess_staging(workers=args.workers, full_rebuild=args.full_rebuild, from_archive=args.from_archive)
+    elif args.command == 'compact':
+        compact_staging(retention_days=args.retention_days)
+    elif args.command == 'backfill':
+        run_backfill(args.start, args.end, coin_ids=args.coins, vs_currencies=args.currencies)
+    elif args.command == 'rebuild-rollups':
+        rebuild_rollups()
+    elif args.command == 'export-parquet':
+        export_parquet(args.start, args.end)
+    elif args.command == 'daemon':
+        run_daemon(interval=args.interval)
+    else:
+        run_pipeline()
\ No newline at end of file
@@ -1,16 +1,67 @@
+import queue
 import requests
-from typing import Dict, Any, List
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, List, Iterator, Optional, Tuple
+from tenacity import RetryCallState, retry, retry_if_exception, wait_exponential
+from tenacity.wait import wait_base
 from config.settings import settings
+from src.extractors.rate_limiter import TokenBucket
+from src.extractors.response_cache import ResponseCache
 from src.utils.logger import logger
 
+def _stop_after_configured_attempts(retry_state: RetryCallState) -> bool:
+    """ เงื่อนไขหยุด Retry ที่อ่าน settings.RETRY_COUNT ตอนเรียกใช้งาน (ไม่ใช่ตอน import โมดูล) """
+    return retry_state.attempt_number >= settings.RETRY_COUNT
+
+# เวลารอสูงสุดที่ยอมทำตาม Header Retry-After (กันไม่ให้ค่าที่ผิดปกติทำให้ Task ค้างนานเกินไป)
+_MAX_RETRY_AFTER_SECONDS = 120.0
+
+def _is_retryable(exc: BaseException) -> bool:
+    """
+    ลองใหม่เฉพาะปัญหาชั่วคราว: Network ขัดข้อง / Timeout, 429 (Rate Limit) และ 5xx (ฝั่งเซิร์ฟเวอร์)
+    4xx อื่น (เช่น 401 API Key ผิด, 404 ไม่พบเหรียญ) ลองใหม่ก็ไม่หาย จึงส่ง Error ออกไปทันที
+    """
+    if isinstance(exc, requests.exceptions.HTTPError):
+        status = exc.response.status_code if exc.response is not None else None
+        return status is not None and (status == 429 or status >= 500)
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+def _retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """ อ่าน Header Retry-After (จำนวนวินาที หรือ HTTP-date) จาก Response ที่ผิดพลาด (None หากไม่มีหรืออ่านไม่ได้) """
+    response = getattr(exc, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), _MAX_RETRY_AFTER_SECONDS)
+
+class _WaitRetryAfter(wait_base):
+    """ รอตาม Retry-After ที่เซิร์ฟเวอร์กำหนด หาก Response ไม่มี Header นี้จะใช้กลยุทธ์สำรอง (fallback) แทน """
+
+    def __init__(self, fallback: wait_base):
+        self.fallback = fallback
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        delay = _retry_after_seconds(retry_state.outcome.exception())
+        return delay if delay is not None else self.fallback(retry_state)
+
 class CoingeckoClient:
     """
     คลาสสำหรับเชื่อมต่อกับ CoinGecko API 
     ออกแบบมาให้มีระบบ Resilience (ความทนทาน) เพื่อรับมือกับปัญหา Network หรือ API Rate Limit
     """
     
-    def __init__(self):
+    def __init__(self, rate_limiter: TokenBucket = None, cache: ResponseCache = None):
         # กำหนดที่อยู่หลักของ API (Base URL)
         self.base_url = 'https://api.coingecko.com/api/v3'
         
@@ -20,46 +71,276 @@ class CoingeckoClient:
             'x-cg-demo-api-key': settings.COINGECKO_API_KEY   # ยืนยันตัวตนด้วย API Key จากไฟล์ settings
         }
 
-    # ระบบ Retry Logic: ถ้าดึงข้อมูลไม่สำเร็จ โปรแกรมจะพยายามใหม่เองอัตโนมัติ
-    @retry(
-        stop=stop_after_attempt(settings.RETRY_COUNT),               # หยุดพยายามเมื่อครบจำนวนครั้งที่ตั้งค่าไว้
-        wait=wait_exponential(multiplier=1, min=4, max=10),          # ใช้กลยุทธ์ Exponential Backoff เพื่อเลี่ยงการโดนแบน
-        retry=retry_if_exception_type(requests.exceptions.RequestException), # ลองใหม่เฉพาะเมื่อเกิดปัญหาที่ตัว Network
-        reraise=True                                                 # ส่ง Error ออกไปหากลองจนครบกำหนดแล้วยังพังอยู่
-    )
+        # Rate Limiter ที่ใช้ร่วมกันทุก Thread ของ Client นี้ (ส่งเข้ามาเองได้หากต้องการแชร์ข้าม Client)
+        self.rate_limiter = rate_limiter or TokenBucket(
+            settings.API_RATE_LIMIT_PER_MINUTE, settings.API_RATE_LIMIT_BURST
+        )
+
+        # Session แบบ Keep-alive: ใช้ Connection Pool ร่วมกันทุกคำขอ ไม่ต้องเปิด TCP+TLS ใหม่ทุกครั้ง
+        # ขนาด Pool เท่ากับจำนวน Worker ของทุกสกุลเงินที่ดึงพร้อมกัน เพื่อให้ทุก Thread มี Connection ของตัวเอง
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(settings.MAX_WORKERS, 1) * max(len(settings.VS_CURRENCIES), 1)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # แคชผลลัพธ์ลงดิสก์ (Optional): เปิดใช้ผ่าน settings หรือส่ง Instance เข้ามาเอง
+        if cache is None and settings.HTTP_CACHE_ENABLED:
+            cache = ResponseCache(
+                settings.HTTP_CACHE_PATH,
+                ttl_seconds=settings.HTTP_CACHE_TTL_SECONDS,
+                max_bytes=settings.HTTP_CACHE_MAX_MB * 1024 * 1024
+            )
+        self.cache = cache
+
+        # ตัวนับสำหรับการวัดผล (Instrumentation): ปริมาณข้อมูลที่ดึงมาและจำนวนครั้งที่ต้อง Retry
+        self.bytes_fetched = 0
+        self.retry_count = 0
+        self._counter_lock = threading.Lock()
+
+    def _record_retry(self):
+        with self._counter_lock:
+            self.retry_count += 1
+
+    def _get_json(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        """
+        ส่งคำขอ GET ผ่าน Session กลาง โดยตรวจแคชก่อน และรอ Token จาก Rate Limiter ก่อนยิงจริงทุกครั้ง
+        """
+        if self.cache is not None:
+            cached = self.cache.get(endpoint, params)
+            if cached is not None:
+                return cached
+
+        self.rate_limiter.acquire()
+        response = self.session.get(
+            endpoint,
+            params=params,
+            timeout=settings.API_TIMEOUT # กำหนดเวลา Timeout ป้องกันโปรแกรมค้าง
+        )
+
+        # ตรวจสอบ HTTP Status: ถ้าพังจะโดดไปที่ส่วน Exception ทันที
+        response.raise_for_status()
+        with self._counter_lock:
+            self.bytes_fetched += len(response.content)
+
+        if self.cache is not None:
+            self.cache.set(endpoint, params, response.text)
+        return response.json()
+
     def get_coin_market(self, vs_currency: str = 'usd') -> List[Dict[str, Any]]:
         """
-        ฟังก์ชันดึงข้อมูลราคาตลาด (Market Data) 
+        ฟังก์ชันดึงข้อมูลราคาตลาด (Market Data) หน้าแรก
+        ระบบ Retry อยู่ที่ _fetch_page (ไม่ดักจับ Exception) ส่วนฟังก์ชันนี้คืน [] เมื่อพยายามจนครบแล้วยังล้มเหลว
         """
         try:
             # แจ้งสถานะการเริ่มดึงข้อมูล 
-            logger.info(f'Initiating data extraction from CoinGecko (Currency: {vs_currency})...')
-
-            endpoint = f'{self.base_url}/coins/markets'
-            
-            # กำหนดเงื่อนไขการดึงข้อมูล (Query Parameters)
-            params = {
-                'vs_currency': vs_currency,
-                'order': 'market_cap_desc',      # เรียงลำดับตามมูลค่าตลาด
-                'per_page': settings.BATCH_SIZE, # จำนวนข้อมูลต่อหน้า (คุมปริมาณ Data)
-                'page': 1                        # หน้าที่ต้องการดึง
-            }
-
-            # ส่งคำขอ HTTP GET
-            response = requests.get(
-                endpoint,
-                headers=self.headers,
-                params=params,
-                timeout=settings.API_TIMEOUT # กำหนดเวลา Timeout ป้องกันโปรแกรมค้าง
-            )
+            logger.info('Initiating data extraction from CoinGecko (Currency: %s)...', vs_currency)
 
-            # ตรวจสอบ HTTP Status: ถ้าพังจะโดดไปที่ส่วน Exception ทันที
-            response.raise_for_status()
+            # เรียงลำดับตามมูลค่าตลาด และคุมปริมาณ Data ด้วยจำนวนข้อมูลต่อหน้า (มีแคชและ Rate Limiter ในตัว)
+            data = self._fetch_page(vs_currency, page=1, per_page=settings.BATCH_SIZE)
 
             logger.info('Successfully fetched market data from API.')
-            return response.json()
+            return data
 
         except Exception as e:
             # บันทึก Error หากกระบวนการดึงข้อมูลล้มเหลว
-            logger.error(f'Critical error in data extraction: {str(e)}')
-            return []
\ No newline at end of file
+            logger.error('Critical error in data extraction: %s', e)
+            return []
+
+    # Retry ระดับหน้า (Per-page Retry): หากหน้าใดโดน 429 / 5xx หรือ Network Error จะ Backoff เฉพาะหน้านั้น
+    # (รอตาม Header Retry-After หากเซิร์ฟเวอร์ส่งมา) ส่วนหน้าอื่นที่กำลังดึงอยู่ใน Thread Pool ยังทำงานต่อได้ตามปกติ
+    @retry(
+        stop=_stop_after_configured_attempts,
+        wait=_WaitRetryAfter(wait_exponential(multiplier=1, min=4, max=10)),
+        retry=retry_if_exception(_is_retryable),
+        before_sleep=lambda retry_state: retry_state.args[0]._record_retry(),
+        reraise=True
+    )
+    def _fetch_page(self, vs_currency: str, page: int, per_page: int) -> List[Dict[str, Any]]:
+        """
+        ดึงข้อมูลตลาดหนึ่งหน้า โดยไม่ดักจับ Exception เพื่อให้กลไก Retry ทำงานได้
+        """
+        params = {
+            'vs_currency': vs_currency,
+            'order': 'market_cap_desc',
+            'per_page': per_page,
+            'page': page
+        }
+        return self._get_json(f'{self.base_url}/coins/markets', params)
+
+    @retry(
+        stop=_stop_after_configured_attempts,
+        wait=_WaitRetryAfter(wait_exponential(multiplier=1, min=4, max=10)),
+        retry=retry_if_exception(_is_retryable),
+        before_sleep=lambda retry_state: retry_state.args[0]._record_retry(),
+        reraise=True
+    )
+    def get_market_chart_range(self, coin_id: str, vs_currency: str, start_ts: int, end_ts: int) -> Dict[str, Any]:
+        """
+        ดึงอนุกรมเวลาย้อนหลังของเหรียญหนึ่งเหรียญจาก /coins/{id}/market_chart/range (ใช้โดยโหมด Backfill)
+        ช่วงไม่เกิน 90 วันได้ข้อมูลรายชั่วโมง ช่วงที่ยาวกว่านั้นได้ข้อมูลรายวัน
+
+        Args:
+            start_ts / end_ts (int): ช่วงเวลาเป็น UNIX Timestamp (วินาที)
+
+        Returns:
+            Dict[str, Any]: {'prices': [[ms, value], ...], 'market_caps': [...], 'total_volumes': [...]}
+        """
+        params = {'vs_currency': vs_currency, 'from': start_ts, 'to': end_ts}
+        return self._get_json(f'{self.base_url}/coins/{coin_id}/market_chart/range', params)
+
+    def iter_market_pages(
+        self,
+        vs_currency: str = 'usd',
+        per_page: int = None,
+        max_pages: Optional[int] = None,
+        max_workers: int = None
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        ดึงข้อมูล /coins/markets ทีละหลายหน้าพร้อมกันด้วย Thread Pool และส่งคืนแบบ Stream (Generator)
+
+        ใช้หน้าต่างแบบเลื่อน (Sliding Window) ขนาดเท่ากับจำนวน Worker: หน้าจะถูกส่งออกตามลำดับเสมอ
+        และหยุดส่งคำขอหน้าถัดไปทันทีเมื่อพบหน้าที่มีข้อมูลไม่เต็ม (หมายถึงถึงหน้าสุดท้ายแล้ว)
+
+        Args:
+            vs_currency (str): สกุลเงินอ้างอิงของราคา
+            per_page (int, optional): จำนวนเหรียญต่อหน้า (ค่าเริ่มต้น settings.MARKET_PAGE_SIZE)
+            max_pages (int, optional): จำนวนหน้าสูงสุดที่จะดึง (None = ดึงจนหมด)
+            max_workers (int, optional): จำนวน Thread ที่ดึงพร้อมกัน
+
+        Raises:
+            requests.exceptions.RequestException: หากหน้าใดยังล้มเหลวหลัง Retry ครบแล้ว
+        """
+        per_page = per_page or settings.MARKET_PAGE_SIZE
+        max_pages = max_pages if max_pages is not None else settings.MAX_PAGES
+        max_workers = max_workers or settings.MAX_WORKERS
+        last_page = max_pages if max_pages else float('inf')
+
+        logger.info('Initiating paginated extraction from CoinGecko (Currency: %s, Workers: %s)...', vs_currency, max_workers)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {}
+            next_page = 1
+            current_page = 1
+
+            try:
+                while True:
+                    # เติมงานเข้า Pool ให้เต็มหน้าต่างเสมอ
+                    while len(futures) < max_workers and next_page <= last_page:
+                        futures[next_page] = pool.submit(self._fetch_page, vs_currency, next_page, per_page)
+                        next_page += 1
+
+                    if current_page > last_page or current_page not in futures:
+                        break
+
+                    items = futures.pop(current_page).result()
+                    if len(items) < per_page:
+                        # หน้านี้คือหน้าสุดท้าย: ไม่ต้องดึงหน้าที่อยู่หลังจากนี้
+                        last_page = current_page
+                    if items:
+                        yield items
+                    current_page += 1
+            finally:
+                # ยกเลิกหน้าที่ยังไม่เริ่มทำงาน (เช่น หน้าที่เกินหน้าสุดท้าย หรือผู้เรียกหยุดอ่าน Stream)
+                for future in futures.values():
+                    future.cancel()
+
+        logger.info('Paginated extraction finished after %s pages.', current_page - 1)
+
+    def iter_currency_pages(
+        self,
+        currencies: Iterable[str] = None,
+        per_page: int = None,
+        max_pages: Optional[int] = None
+    ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        ดึงข้อมูลตลาดของหลายสกุลเงินพร้อมกัน (หนึ่ง Thread ต่อสกุลเงิน แต่ละสกุลเงินใช้ iter_market_pages)
+        และส่งคืนแบบ Stream เป็นคู่ (สกุลเงิน, หน้าข้อมูล) ตามลำดับที่ดึงเสร็จ
+
+        หน้าข้อมูลถูกส่งผ่านคิวที่มีขนาดจำกัด หากผู้เรียกเขียนข้อมูลไม่ทัน Thread ที่ดึงข้อมูลจะรอ (Backpressure)
+        ทั้งหมดใช้ Rate Limiter ของ Client ร่วมกัน จึงไม่เกินโควตาของ API แม้จะดึงหลายสกุลเงินพร้อมกัน
+
+        Raises:
+            requests.exceptions.RequestException: หากหน้าใดของสกุลเงินใดยังล้มเหลวหลัง Retry ครบแล้ว
+        """
+        currencies = list(currencies or settings.VS_CURRENCIES)
+        if len(currencies) == 1:
+            for items in self.iter_market_pages(currencies[0], per_page=per_page, max_pages=max_pages):
+                yield currencies[0], items
+            return
+
+        results = queue.Queue(maxsize=len(currencies) * max(settings.MAX_WORKERS, 1))
+        stop = threading.Event()
+        done = object()
+
+        def offer(item) -> bool:
+            # ใส่คิวแบบมี Timeout เพื่อให้ Thread เลิกรอได้ทันทีเมื่อผู้เรียกหยุดอ่านหรือเกิด Error
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(vs_currency: str):
+            try:
+                for items in self.iter_market_pages(vs_currency, per_page=per_page, max_pages=max_pages):
+                    if not offer((vs_currency, items)):
+                        return
+            except Exception as e:
+                offer((vs_currency, e))
+            finally:
+                offer((vs_currency, done))
+
+        with ThreadPoolExecutor(max_workers=len(currencies)) as pool:
+            for vs_currency in currencies:
+                pool.submit(produce, vs_currency)
+            try:
+                remaining = len(currencies)
+                while remaining:
+                    vs_currency, payload = results.get()
+                    if payload is done:
+                        remaining -= 1
+                    elif isinstance(payload, Exception):
+                        raise payload
+                    else:
+                        yield vs_currency, payload
+            finally:
+                stop.set()
+
+    def iter_page_numbers(
+        self,
+        pages: Iterable[int],
+        vs_currency: str = 'usd',
+        per_page: int = None
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        ดึงเฉพาะหน้าที่กำหนดทีละหน้าตามลำดับ (ใช้โดย Shard ของ DAG ที่แต่ละ Task รับผิดชอบชุดหน้าของตัวเอง)
+        หยุดทันทีเมื่อพบหน้าที่มีข้อมูลไม่เต็ม เพราะหน้าถัดจากนั้นจะว่างทั้งหมด
+        """
+        per_page = per_page or settings.MARKET_PAGE_SIZE
+        for page in pages:
+            items = self._fetch_page(vs_currency, page, per_page)
+            if items:
+                yield items
+            if len(items) < per_page:
+                break
+
+    def get_all_coin_markets(self, vs_currency: str = 'usd', max_pages: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        ดึงข้อมูลตลาดทั้งหมดทุกหน้าแล้วรวมเป็น List เดียว (โหมด Full Market)
+        คืนค่า List ว่างหากมีหน้าใดล้มเหลว เพื่อไม่ให้ได้ข้อมูลที่ขาดหายไปบางส่วน
+        """
+        try:
+            result = []
+            for page in self.iter_market_pages(vs_currency=vs_currency, max_pages=max_pages):
+                result.extend(page)
+            logger.info('Successfully fetched %s coins across all pages.', len(result))
+            return result
+
+        except Exception as e:
+            logger.error('Critical error in paginated extraction: %s', e)
+            return []
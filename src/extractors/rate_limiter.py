@@ -0,0 +1,36 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Rate Limiter แบบ Token Bucket ที่ปลอดภัยต่อการใช้งานหลาย Thread (Thread-safe)
+    ใช้ร่วมกันทุก Worker ของ CoingeckoClient เพื่อคุมจำนวนคำขอไม่ให้เกินโควตาของแผน Demo/Pro
+    """
+
+    def __init__(self, rate_per_minute: int, burst: int = 1):
+        # อัตราการเติม Token ต่อวินาที และความจุสูงสุดของถัง (จำนวนคำขอที่ยิงติดกันได้)
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self):
+        """
+        รอจนกว่าจะมี Token ว่าง แล้วหัก Token ออกหนึ่งหน่วย (Blocking)
+        การ sleep ทำนอก Lock เพื่อไม่ให้ Thread อื่นถูกบล็อกโดยไม่จำเป็น
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
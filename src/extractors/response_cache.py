@@ -0,0 +1,101 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+from src.utils.logger import logger
+
+
+class ResponseCache:
+    """
+    แคชผลลัพธ์ของ API ลงดิสก์ (SQLite) โดยใช้ Endpoint + Query Parameters เป็นกุญแจ
+    ทำให้การ Retry ของ Airflow หรือการรันซ้ำด้วยมือภายในช่วง TTL ไม่ต้องยิง API ซ้ำ
+    และยังใช้เป็น Fixture สำหรับเล่นข้อมูลซ้ำแบบออฟไลน์ (Replay) ในการทดสอบและ Benchmark ได้
+    """
+
+    def __init__(self, path: str, ttl_seconds: Optional[int] = 3600, max_bytes: int = 256 * 1024 * 1024):
+        # ttl_seconds=None หมายถึงไม่มีวันหมดอายุ (เหมาะกับโหมด Replay)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS http_cache(
+            cache_key TEXT PRIMARY KEY,
+            endpoint TEXT,
+            params TEXT,
+            body TEXT,                  -- Response Body ดิบตามที่ได้รับจาก API
+            size INTEGER,
+            created_at REAL,
+            accessed_at REAL
+        )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_http_cache_accessed ON http_cache(accessed_at)')
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(endpoint: str, params: Dict[str, Any]) -> str:
+        """ สร้างกุญแจแคชที่ไม่ขึ้นกับลำดับของ Parameters """
+        raw = endpoint + '?' + json.dumps(params or {}, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, endpoint: str, params: Dict[str, Any]) -> Optional[Any]:
+        """
+        คืนค่า JSON ที่ถอดรหัสแล้วหากมีในแคชและยังไม่หมดอายุ มิฉะนั้นคืนค่า None
+        """
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body, created_at FROM http_cache WHERE cache_key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            body, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute('DELETE FROM http_cache WHERE cache_key = ?', (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE http_cache SET accessed_at = ? WHERE cache_key = ?', (now, key))
+            self._conn.commit()
+
+        logger.debug('Cache hit for %s', endpoint)
+        return json.loads(body)
+
+    def set(self, endpoint: str, params: Dict[str, Any], body: str):
+        """ บันทึก Response Body ลงแคช แล้วไล่ลบรายการที่ใช้งานล่าสุดนานที่สุด (LRU) หากขนาดรวมเกินกำหนด """
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, endpoint, json.dumps(params or {}, sort_keys=True), body, len(body), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM http_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for key, size in self._conn.execute(
+            'SELECT cache_key, size FROM http_cache ORDER BY accessed_at'
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM http_cache WHERE cache_key = ?', (key,))
+            total -= size
+            evicted += 1
+        logger.info('Response cache evicted %s entries (size limit %s bytes).', evicted, self.max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM http_cache')
+            self._conn.commit()
@@ -0,0 +1,406 @@
+import io
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from config.settings import settings
+from src.utils.database import Database, get_database, resolve_db_path
+from src.utils.logger import logger
+
+# คอลัมน์ของเส้นทางเขียนหลัก (ลำดับเดียวกันทุก Backend และตรงกับ Tuple ที่ Loader / Transformer ส่งมา)
+STAGING_COLUMNS = ('coin_id', 'raw_data', 'extracted_at', 'batch_id', 'vs_currency')
+META_COLUMNS = ('batch_id', 'coin_id', 'raw_data')
+FACT_COLUMNS = (
+    'batch_id', 'coin_id', 'symbol', 'name', 'price', 'market_cap', 'total_volume', 'last_updated_at', 'vs_currency'
+)
+
+# งานที่ต้อง Commit พร้อมการบันทึก Fact Table (เช่น สถานะ 'loaded' ใน Ledger) รับ Connection ของไฟล์ SQLite ของ Pipeline
+CommitHook = Optional[Callable[[Any], None]]
+
+# Schema ของ Staging / Fact บน PostgreSQL (โครงสร้างเดียวกับ Migration ล่าสุดของ SQLite)
+# ตารางสถานะของ Pipeline (Ledger / CDC / Rejects / สถิติ / Metrics) ยังอยู่ในไฟล์ SQLite ตาม settings.STATE_DB_PATH
+POSTGRES_SCHEMA: List[str] = [
+    '''
+    CREATE TABLE IF NOT EXISTS stg_crypto_markets(
+        id BIGSERIAL PRIMARY KEY,
+        coin_id TEXT,
+        raw_data TEXT,
+        extracted_at TIMESTAMP,
+        batch_id TEXT,
+        vs_currency TEXT NOT NULL DEFAULT 'usd'
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_stg_batch_id ON stg_crypto_markets(batch_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS stg_coin_meta(
+        batch_id TEXT,
+        coin_id TEXT,
+        raw_data TEXT,
+        PRIMARY KEY (batch_id, coin_id)
+    )
+    ''',
+    '''
+    CREATE OR REPLACE VIEW v_stg_crypto_markets AS
+    SELECT
+        s.id,
+        s.batch_id,
+        s.coin_id,
+        s.vs_currency,
+        s.extracted_at,
+        CASE
+            WHEN m.raw_data IS NULL OR m.raw_data = '{}' THEN s.raw_data
+            WHEN s.raw_data = '{}' THEN m.raw_data
+            ELSE left(m.raw_data, -1) || ', ' || substr(s.raw_data, 2)
+        END AS raw_data
+    FROM stg_crypto_markets s
+    LEFT JOIN stg_coin_meta m ON m.batch_id = s.batch_id AND m.coin_id = s.coin_id
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS fct_crypto_prices(
+        batch_id TEXT,
+        coin_id TEXT,
+        symbol TEXT,
+        name TEXT,
+        price DOUBLE PRECISION,
+        market_cap DOUBLE PRECISION,
+        total_volume DOUBLE PRECISION,
+        last_updated_at TIMESTAMPTZ,
+        vs_currency TEXT NOT NULL DEFAULT 'usd',
+        PRIMARY KEY (batch_id, coin_id, vs_currency)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_fct_coin_updated ON fct_crypto_prices(coin_id, vs_currency, last_updated_at)',
+]
+
+# Advisory Lock ป้องกันหลาย Process สร้าง Schema พร้อมกัน (ค่าคงที่ใดก็ได้ที่ไม่ชนกับระบบอื่น)
+_SCHEMA_LOCK_KEY = 727001
+
+
+class StorageBackend:
+    """
+    ส่วนต่อประสาน (Interface) ของที่เก็บข้อมูลสำหรับเส้นทางเขียน/อ่านหลักของ Pipeline
+    (เขียน Staging, อ่าน Staging ให้ Transform และโหลด Fact Table) เลือก Implementation จาก Scheme
+    ของ settings.DATABASE_URL ผ่าน get_backend()
+    """
+
+    name = ''
+
+    @contextmanager
+    def staging_writer(self, batch_id: str, replace: bool = False) -> Iterator['StagingWriter']:
+        """
+        เปิด Transaction สำหรับเขียน Staging ของหนึ่ง Batch (replace=True ลบข้อมูลเดิมของ Batch ก่อน)
+        ข้อมูลทั้งหมดที่เขียนผ่าน Writer ถูก Commit พร้อมกันเมื่อออกจากบล็อก หรือ Rollback ทั้งหมดหากเกิด Exception
+        """
+        raise NotImplementedError
+
+    def read_staging(self, batch_id: str = None) -> List[Tuple[str, str]]:
+        """ อ่าน (raw_data, vs_currency) ของ Batch ที่ระบุ (หรือทั้งหมด) จาก View v_stg_crypto_markets """
+        raise NotImplementedError
+
+    def staged_batches(self, after: str = '') -> List[str]:
+        """ batch_id ที่มีข้อมูลใน Staging และใหม่กว่า after เรียงจากเก่าไปใหม่ (ใช้หา Batch ค้างในโหมด Incremental) """
+        raise NotImplementedError
+
+    def has_staging(self, batch_id: str) -> bool:
+        """ True หาก Batch มีแถวอย่างน้อยหนึ่งแถวใน stg_crypto_markets """
+        raise NotImplementedError
+
+    def upsert_facts(self, rows: Sequence[Tuple], on_commit: CommitHook = None) -> int:
+        """
+        บันทึกแถวลง fct_crypto_prices แบบ Idempotent (แถวที่มี Key อยู่แล้วถูกข้าม) และคืนจำนวนแถวที่เขียนจริง
+
+        Args:
+            on_commit: เรียกด้วย Connection ของไฟล์ SQLite ของ Pipeline ก่อน Commit (SQLite: Transaction เดียวกับ Fact Table,
+                Backend อื่น: Transaction ของตารางสถานะหลัง Fact Table ถูก Commit แล้ว)
+        """
+        raise NotImplementedError
+
+    def iter_facts(self, chunk_size: int = 50000, batch_range: Tuple[str, str] = None) -> Iterator[List[Tuple]]:
+        """
+        อ่าน fct_crypto_prices แบบ Stream เป็นก้อนละไม่เกิน chunk_size แถว (ลำดับคอลัมน์ตาม FACT_COLUMNS)
+        batch_range=(start, end): เฉพาะ batch_id ในช่วง [start, end) เรียงตาม batch_id (Range Scan บน Primary Key)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """ คืนทรัพยากร (Connection / Pool) ของ Backend """
+
+
+class StagingWriter:
+    """ ตัวเขียน Staging ภายใน Transaction ที่เปิดโดย StorageBackend.staging_writer() """
+
+    def write(self, rows: Sequence[Tuple], meta_rows: Sequence[Tuple]):
+        raise NotImplementedError
+
+
+class SQLiteStagingWriter(StagingWriter):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, rows: Sequence[Tuple], meta_rows: Sequence[Tuple]):
+        # ใช้ Parameterized SQL เพื่อป้องกันช่องโหว่ SQL Injection
+        self.conn.executemany(
+            f'INSERT INTO stg_crypto_markets ({", ".join(STAGING_COLUMNS)}) VALUES (?, ?, ?, ?, ?)', rows
+        )
+        self.conn.executemany('INSERT OR IGNORE INTO stg_coin_meta (batch_id, coin_id, raw_data) VALUES (?, ?, ?)',
+                              meta_rows)
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Backend เดิมของโปรเจกต์: ไฟล์ SQLite ไฟล์เดียวผ่าน Connection Manager กลาง (executemany)
+    ใช้ Connection เดียวกับตารางสถานะ จึงเขียน Staging / Ledger / CDC ได้ใน Transaction เดียว
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    @contextmanager
+    def staging_writer(self, batch_id: str, replace: bool = False) -> Iterator[StagingWriter]:
+        conn = self.db.connection()
+        with conn:
+            if replace:
+                conn.execute('DELETE FROM stg_crypto_markets WHERE batch_id = ?', (batch_id,))
+                conn.execute('DELETE FROM stg_coin_meta WHERE batch_id = ?', (batch_id,))
+            yield SQLiteStagingWriter(conn)
+
+    def read_staging(self, batch_id: str = None) -> List[Tuple[str, str]]:
+        if batch_id:
+            return self.db.connection().execute(
+                'SELECT raw_data, vs_currency FROM v_stg_crypto_markets WHERE batch_id = ?', (batch_id,)
+            ).fetchall()
+        return self.db.connection().execute('SELECT raw_data, vs_currency FROM v_stg_crypto_markets').fetchall()
+
+    def staged_batches(self, after: str = '') -> List[str]:
+        # Range Scan บนดัชนี idx_stg_batch_id
+        return [row[0] for row in self.db.connection().execute(
+            'SELECT DISTINCT batch_id FROM stg_crypto_markets WHERE batch_id > ? ORDER BY batch_id', (after,)
+        )]
+
+    def has_staging(self, batch_id: str) -> bool:
+        return self.db.connection().execute(
+            'SELECT 1 FROM stg_crypto_markets WHERE batch_id = ? LIMIT 1', (batch_id,)
+        ).fetchone() is not None
+
+    def upsert_facts(self, rows: Sequence[Tuple], on_commit: CommitHook = None) -> int:
+        # 'OR IGNORE' รองรับคุณสมบัติ Idempotency (รันซ้ำได้ไม่พัง)
+        conn = self.db.connection()
+        with conn:
+            written = conn.executemany(
+                f'INSERT OR IGNORE INTO fct_crypto_prices ({", ".join(FACT_COLUMNS)}) '
+                f'VALUES ({", ".join("?" * len(FACT_COLUMNS))})',
+                rows
+            ).rowcount
+            if on_commit is not None:
+                on_commit(conn)
+            return written
+
+    def iter_facts(self, chunk_size: int = 50000, batch_range: Tuple[str, str] = None) -> Iterator[List[Tuple]]:
+        query = f'SELECT {", ".join(FACT_COLUMNS)} FROM fct_crypto_prices'
+        if batch_range is None:
+            cursor = self.db.connection().execute(query)
+        else:
+            cursor = self.db.connection().execute(
+                f'{query} WHERE batch_id >= ? AND batch_id < ? ORDER BY batch_id', batch_range
+            )
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _copy_text(value: Any) -> str:
+    """ แปลงค่าเป็นฟิลด์ของ COPY รูปแบบ text (NULL = \\N และ Escape อักขระควบคุม) """
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_buffer(rows: Iterable[Sequence[Any]]) -> io.StringIO:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_text(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+class PostgresStagingWriter(StagingWriter):
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def write(self, rows: Sequence[Tuple], meta_rows: Sequence[Tuple]):
+        if rows:
+            PostgresBackend.copy(self.cursor, 'stg_crypto_markets', STAGING_COLUMNS, rows)
+        if meta_rows:
+            PostgresBackend.merge(self.cursor, 'stg_coin_meta', META_COLUMNS, meta_rows, ('batch_id', 'coin_id'))
+
+
+class PostgresBackend(StorageBackend):
+    """
+    Backend สำหรับ PostgreSQL (รองรับหลาย Writer พร้อมกัน แทนข้อจำกัด Writer เดียวของ SQLite)
+    - Connection Pool แบบ Thread-safe (psycopg2.pool.ThreadedConnectionPool)
+    - เขียนเป็นก้อนด้วย COPY FROM STDIN แทน INSERT ทีละแถว
+    - ตารางที่มี Key เขียนผ่านตารางชั่วคราว (COPY) แล้ว INSERT ... ON CONFLICT DO NOTHING
+      ให้ผลเหมือน INSERT OR IGNORE ของ SQLite (รันซ้ำได้โดยไม่เกิดแถวซ้ำ)
+    """
+
+    name = 'postgresql'
+
+    def __init__(self, dsn: str, min_connections: int = None, max_connections: int = None):
+        try:
+            from psycopg2.pool import ThreadedConnectionPool
+        except ImportError as e:
+            raise ImportError('PostgreSQL backend requires psycopg2 (pip install psycopg2-binary)') from e
+        self.pool = ThreadedConnectionPool(
+            min_connections or settings.POSTGRES_POOL_MIN, max_connections or settings.POSTGRES_POOL_MAX, dsn
+        )
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    @contextmanager
+    def _connection(self):
+        """ ยืม Connection จาก Pool: Commit เมื่อออกจากบล็อกปกติ / Rollback เมื่อเกิด Exception แล้วคืนเข้า Pool """
+        conn = self.pool.getconn()
+        try:
+            self._ensure_schema(conn)
+            with conn:
+                yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    def _ensure_schema(self, conn):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            with conn, conn.cursor() as cur:
+                cur.execute('SELECT pg_advisory_xact_lock(%s)', (_SCHEMA_LOCK_KEY,))
+                for statement in POSTGRES_SCHEMA:
+                    cur.execute(statement)
+            logger.info('PostgreSQL schema is ready.')
+            self._schema_ready = True
+
+    @staticmethod
+    def copy(cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]):
+        cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', _copy_buffer(rows))
+
+    @staticmethod
+    def merge(cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]],
+              conflict: Sequence[str]) -> int:
+        """
+        COPY แถวลงตารางชั่วคราวของ Session แล้วย้ายเข้าตารางจริงด้วย INSERT ... ON CONFLICT DO NOTHING
+        (ตารางชั่วคราวถูกสร้างครั้งเดียวต่อ Connection ใน Pool และถูกล้างหลังย้ายข้อมูลทุกครั้ง)
+        """
+        temp_table = f'tmp_{table}'
+        column_list = ', '.join(columns)
+        cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {temp_table} (LIKE {table} INCLUDING DEFAULTS) '
+                       f'ON COMMIT DELETE ROWS')
+        PostgresBackend.copy(cursor, temp_table, columns, rows)
+        cursor.execute(
+            f'INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {temp_table} '
+            f'ON CONFLICT ({", ".join(conflict)}) DO NOTHING'
+        )
+        written = cursor.rowcount
+        cursor.execute(f'TRUNCATE {temp_table}')
+        return written
+
+    @contextmanager
+    def staging_writer(self, batch_id: str, replace: bool = False) -> Iterator[StagingWriter]:
+        with self._connection() as conn, conn.cursor() as cur:
+            if replace:
+                cur.execute('DELETE FROM stg_crypto_markets WHERE batch_id = %s', (batch_id,))
+                cur.execute('DELETE FROM stg_coin_meta WHERE batch_id = %s', (batch_id,))
+            yield PostgresStagingWriter(cur)
+
+    def read_staging(self, batch_id: str = None) -> List[Tuple[str, str]]:
+        with self._connection() as conn, conn.cursor() as cur:
+            if batch_id:
+                cur.execute('SELECT raw_data, vs_currency FROM v_stg_crypto_markets WHERE batch_id = %s ORDER BY id',
+                            (batch_id,))
+            else:
+                cur.execute('SELECT raw_data, vs_currency FROM v_stg_crypto_markets ORDER BY id')
+            return cur.fetchall()
+
+    def staged_batches(self, after: str = '') -> List[str]:
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT DISTINCT batch_id FROM stg_crypto_markets WHERE batch_id > %s ORDER BY batch_id',
+                        (after,))
+            return [row[0] for row in cur.fetchall()]
+
+    def has_staging(self, batch_id: str) -> bool:
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT 1 FROM stg_crypto_markets WHERE batch_id = %s LIMIT 1', (batch_id,))
+            return cur.fetchone() is not None
+
+    def upsert_facts(self, rows: Sequence[Tuple], on_commit: CommitHook = None) -> int:
+        written = 0
+        if rows:
+            with self._connection() as conn, conn.cursor() as cur:
+                written = self.merge(cur, 'fct_crypto_prices', FACT_COLUMNS, rows, ('batch_id', 'coin_id', 'vs_currency'))
+        if on_commit is not None:
+            # Fact Table ถูก Commit แล้ว: หากขั้นนี้ล้มเหลว การรันซ้ำเขียน Fact Table ซ้ำได้โดยไม่เกิดแถวซ้ำ
+            state = get_database(resolve_db_path()).connection()
+            with state:
+                on_commit(state)
+        return written
+
+    def iter_facts(self, chunk_size: int = 50000, batch_range: Tuple[str, str] = None) -> Iterator[List[Tuple]]:
+        # Named Cursor (Server-side) ไม่ดึงทั้งตารางมาไว้ในหน่วยความจำฝั่ง Client
+        query = f'SELECT {", ".join(FACT_COLUMNS)} FROM fct_crypto_prices'
+        with self._connection() as conn, conn.cursor(name='fct_crypto_prices_scan') as cur:
+            cur.itersize = chunk_size
+            if batch_range is None:
+                cur.execute(query)
+            else:
+                cur.execute(f'{query} WHERE batch_id >= %s AND batch_id < %s ORDER BY batch_id', batch_range)
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def close(self):
+        self.pool.closeall()
+
+
+_backends: Dict[str, StorageBackend] = {}
+_registry_lock = threading.Lock()
+
+
+def get_backend(database_url: str = None) -> StorageBackend:
+    """
+    คืนค่า Backend ที่ใช้ร่วมกันตาม Scheme ของ URL (ค่าเริ่มต้น settings.DATABASE_URL):
+    'sqlite:///path' -> SQLiteBackend, 'postgresql://...' (หรือ 'postgres://', 'postgresql+psycopg2://') -> PostgresBackend
+    """
+    database_url = database_url or settings.DATABASE_URL
+    scheme = database_url.split(':', 1)[0].split('+', 1)[0].lower()
+    with _registry_lock:
+        if database_url not in _backends:
+            if scheme == 'sqlite':
+                _backends[database_url] = SQLiteBackend(get_database(resolve_db_path(database_url)))
+            elif scheme in ('postgresql', 'postgres'):
+                dsn = 'postgresql' + database_url[database_url.index(':'):]
+                _backends[database_url] = PostgresBackend(dsn)
+            else:
+                raise ValueError(f'Unsupported DATABASE_URL scheme: {scheme!r}')
+        return _backends[database_url]
+
+
+def require_sqlite_backend(operation: str):
+    """
+    ตรวจว่า DATABASE_URL ชี้ไปที่ SQLite สำหรับงานที่อ่าน / ลบ Staging และ Fact Table ในไฟล์ SQLite โดยตรง
+    (เช่น VACUUM, ตารางเงาจาก sqlite_master, Connection แบบ Read-only ของแต่ละ Process) เพื่อไม่ให้งานเหล่านี้
+    ทำงานกับไฟล์สถานะที่ว่างเปล่าอย่างเงียบๆ เมื่อข้อมูลจริงอยู่ใน Backend อื่น
+    """
+    backend = get_backend()
+    if backend.name != 'sqlite':
+        raise RuntimeError(
+            f"{operation} works on the SQLite staging / fact tables only, "
+            f"but DATABASE_URL uses the {backend.name!r} backend"
+        )
@@ -0,0 +1,124 @@
+from datetime import datetime
+from typing import List, Optional
+from config.settings import settings
+from src.loaders.backends import SQLiteBackend, StorageBackend, get_backend
+from src.loaders.change_tracker import ChangeTracker
+from src.utils.database import get_database, resolve_db_path
+from src.utils.logger import logger
+
+# ลำดับขั้นตอนของหนึ่ง Batch (ใช้เทียบว่า Batch ไปถึงขั้นไหนแล้ว)
+STAGES = ('extracted', 'staged', 'transformed', 'validated', 'loaded')
+
+# สถานะสิ้นสุดของ Batch ที่ล้มเหลวครบ settings.BATCH_MAX_ATTEMPTS ครั้ง (ไม่ถูกหยิบมาประมวลผลซ้ำในโหมด Incremental)
+REJECTED = 'rejected'
+
+
+class BatchLedger:
+    """
+    สมุดบัญชี (Ledger) บันทึกสถานะของแต่ละ Batch ในตาราง pipeline_runs
+    ใช้สำหรับโหมด Incremental: รู้ว่า Batch ใดโหลดเสร็จแล้ว (Watermark) และ Batch ใดค้างอยู่ที่ขั้นไหน
+    เพื่อทำต่อจากขั้นที่ล้มเหลวได้ทันทีจากข้อมูลใน Staging โดยไม่ต้องดึงจาก API ใหม่
+    (Staging อ่านผ่าน StorageBackend จึงรองรับทั้ง SQLite และ PostgreSQL ส่วนตาราง pipeline_runs อยู่ในไฟล์ SQLite เสมอ)
+    """
+
+    def __init__(self, db_path: str = None, backend: StorageBackend = None):
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+        self.backend = backend or (SQLiteBackend(self.db) if db_path else None)
+
+    def mark(self, batch_id: str, stage: str, status: str = 'success', row_count: int = None,
+             error: str = None, conn=None):
+        """
+        บันทึกสถานะล่าสุดของ Batch (Upsert)
+
+        Args:
+            conn (sqlite3.Connection, optional): ส่ง Connection ที่อยู่ใน Transaction เดียวกับงานหลักเข้ามา
+            เพื่อให้สถานะถูก Commit พร้อมกับข้อมูล (เช่น ตอนบันทึก Staging)
+
+        การบันทึก 'loaded' สำเร็จจะย้ายลายนิ้วมือ CDC ของ Batch เข้าเป็นเวอร์ชันอ้างอิงใน Transaction เดียวกัน
+        การบันทึก 'failed' นับจำนวนครั้งที่ล้มเหลว เมื่อครบ settings.BATCH_MAX_ATTEMPTS สถานะจะกลายเป็น 'rejected'
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown pipeline stage: {stage}")
+
+        now = datetime.now().isoformat()
+        max_attempts = settings.BATCH_MAX_ATTEMPTS
+        failed = 1 if status == 'failed' else 0
+        query = '''
+        INSERT INTO pipeline_runs (batch_id, stage, status, row_count, error, started_at, updated_at, attempts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(batch_id) DO UPDATE SET
+            stage = excluded.stage,
+            status = CASE
+                WHEN excluded.attempts > 0 AND ? > 0 AND pipeline_runs.attempts + 1 >= ? THEN 'rejected'
+                ELSE excluded.status
+            END,
+            row_count = COALESCE(excluded.row_count, pipeline_runs.row_count),
+            error = excluded.error,
+            updated_at = excluded.updated_at,
+            attempts = pipeline_runs.attempts + excluded.attempts
+        '''
+        insert_status = REJECTED if failed and 0 < max_attempts <= 1 else status
+        params = (batch_id, stage, insert_status, row_count, error, now, now, failed, max_attempts, max_attempts)
+
+        if conn is not None:
+            self._write(conn, query, params, batch_id, stage, status)
+            return
+        conn = self.db.connection()
+        with conn:
+            self._write(conn, query, params, batch_id, stage, status)
+
+    @staticmethod
+    def _write(conn, query: str, params: tuple, batch_id: str, stage: str, status: str):
+        conn.execute(query, params)
+        if stage == 'loaded' and status == 'success':
+            ChangeTracker.promote(batch_id, conn)
+        elif status == 'failed':
+            attempts, final_status = conn.execute(
+                'SELECT attempts, status FROM pipeline_runs WHERE batch_id = ?', (batch_id,)
+            ).fetchone()
+            if final_status == REJECTED:
+                logger.warning("Batch %s rejected after %s failed attempts (stage=%s). It will not be retried.",
+                               batch_id, attempts, stage)
+
+    def get(self, batch_id: str) -> Optional[dict]:
+        """ คืนค่าสถานะล่าสุดของ Batch หรือ None หากยังไม่เคยถูกบันทึก """
+        row = self.db.connection().execute(
+            'SELECT batch_id, stage, status, row_count, error, attempts, updated_at FROM pipeline_runs '
+            'WHERE batch_id = ?',
+            (batch_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('batch_id', 'stage', 'status', 'row_count', 'error', 'attempts', 'updated_at'), row))
+
+    def watermark(self) -> Optional[str]:
+        """ batch_id ล่าสุดที่โหลดเข้า Core สำเร็จแล้ว (batch_id เรียงตามเวลาได้เพราะอยู่ในรูป YYYYmmdd_HHMMSS) """
+        row = self.db.connection().execute(
+            "SELECT MAX(batch_id) FROM pipeline_runs WHERE stage = 'loaded' AND status = 'success'"
+        ).fetchone()
+        return row[0]
+
+    def pending_batches(self) -> List[str]:
+        """
+        รายการ Batch ที่ต้องประมวลผลในโหมด Incremental เรียงจากเก่าไปใหม่:
+        - Batch ใน Staging ที่ใหม่กว่า Watermark (ถามจาก StorageBackend ที่เก็บ Staging จริง)
+        - Batch ที่ค้างอยู่กลางทางหรือเคยล้มเหลว ตามที่บันทึกไว้ใน Ledger
+        ยกเว้น Batch ที่ถูก 'rejected' แล้ว (ล้มเหลวครบจำนวนครั้งสูงสุด)
+        """
+        watermark = self.watermark() or ''
+        conn = self.db.connection()
+        pending = {row[0] for row in conn.execute(
+            "SELECT batch_id FROM pipeline_runs WHERE NOT (stage = 'loaded' AND status = 'success') AND status != ?",
+            (REJECTED,)
+        )}
+        closed = {row[0] for row in conn.execute(
+            "SELECT batch_id FROM pipeline_runs WHERE batch_id > ? "
+            "AND ((stage = 'loaded' AND status = 'success') OR status = ?)",
+            (watermark, REJECTED)
+        )}
+        staged = (self.backend or get_backend()).staged_batches(watermark)
+        pending.update(batch_id for batch_id in staged if batch_id not in closed)
+        batches = sorted(pending)
+        logger.info("Incremental scan: watermark=%s, %s batches pending.", watermark or 'none', len(batches))
+        return batches
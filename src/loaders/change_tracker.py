@@ -0,0 +1,96 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from src.loaders.backends import SQLiteBackend, StorageBackend, get_backend
+from src.utils.database import get_database, resolve_db_path
+
+# (fingerprint, batch_id ที่เก็บเวอร์ชันนั้น) ต่อคู่ (coin_id, vs_currency)
+Fingerprints = Dict[Tuple[str, str], Tuple[str, str]]
+
+
+class ChangeTracker:
+    """
+    Change Data Capture ของข้อมูลตลาด: เก็บลายนิ้วมือ (Hash ของ Payload ที่ Normalize แล้ว) ของเวอร์ชันล่าสุด
+    ที่ถูกโหลดเข้า Core จริงต่อ (เหรียญ, สกุลเงิน) ในตาราง cdc_coin_fingerprints
+    (ลายนิ้วมือของ Batch ใหม่รออยู่ใน cdc_pending_fingerprints จนกว่า Ledger จะบันทึกว่า Batch นั้น 'loaded')
+    Loader ใช้ตัดสินว่าแถวใดต้องเขียนลง Staging และแถวใดบันทึกเพียงการอ้างอิงลง cdc_unchanged_refs
+    ทำให้ปริมาณการเขียนและขนาดฐานข้อมูลเติบโตตามอัตราการเปลี่ยนแปลงจริง ไม่ใช่ตามจำนวนรอบที่รัน
+    """
+
+    def __init__(self, db_path: str = None, backend: StorageBackend = None):
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+        # ที่เก็บ Staging สำหรับ is_unchanged_batch(): ระบุ db_path = Staging ในไฟล์นั้น (เหมือน MarketRollups)
+        self.backend = backend or (SQLiteBackend(self.db) if db_path else None)
+
+    @staticmethod
+    def fingerprint(item: Dict[str, Any]) -> str:
+        """ Hash ของ Payload ที่ Normalize แล้ว (เรียงคีย์ ไม่มีช่องว่าง) ลำดับคีย์ที่ต่างกันจึงไม่นับเป็นการเปลี่ยนแปลง """
+        payload = json.dumps(item, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def load(self) -> Fingerprints:
+        """
+        โหลดลายนิ้วมือทั้งหมดครั้งเดียวต่อ Batch (ขนาดเท่าจำนวนเหรียญ × สกุลเงิน จึงอยู่ในหน่วยความจำได้)
+        เฉพาะเวอร์ชันของ Batch ที่ Ledger บันทึกว่าโหลดสำเร็จแล้ว แถวอ้างอิงจึงชี้ไปยังข้อมูลที่อยู่ใน Fact Table จริงเสมอ
+        """
+        rows = self.db.connection().execute(
+            '''
+            SELECT f.coin_id, f.vs_currency, f.fingerprint, f.batch_id
+            FROM cdc_coin_fingerprints f
+            JOIN pipeline_runs r ON r.batch_id = f.batch_id AND r.stage = 'loaded' AND r.status = 'success'
+            '''
+        )
+        return {(coin_id, vs_currency): (fingerprint, batch_id) for coin_id, vs_currency, fingerprint, batch_id in rows}
+
+    @staticmethod
+    def unchanged_ref(known: Fingerprints, coin_id: str, vs_currency: str, fingerprint: str,
+                      batch_id: str) -> Optional[str]:
+        """
+        คืนค่า batch_id ที่เก็บเวอร์ชันเดียวกันไว้แล้ว หรือ None หากต้องเขียนแถวนี้
+        (เวอร์ชันที่ถูกเก็บไว้ใน Batch ปัจจุบันเองนับว่าเปลี่ยน เพื่อให้การรันขั้น stage ซ้ำเขียนแถวเดิมกลับมาได้)
+        """
+        previous = known.get((coin_id, vs_currency))
+        if previous is None or previous[0] != fingerprint or previous[1] == batch_id:
+            return None
+        return previous[1]
+
+    @staticmethod
+    def fingerprint_row(coin_id: str, vs_currency: str, fingerprint: str, item: Dict[str, Any],
+                        batch_id: str) -> Tuple:
+        """ แถวของ cdc_pending_fingerprints (ลายนิ้วมือที่รอให้ Batch โหลดสำเร็จ) """
+        return (batch_id, coin_id, vs_currency, fingerprint, item.get('last_updated'))
+
+    @staticmethod
+    def promote(batch_id: str, conn):
+        """
+        ย้ายลายนิ้วมือที่รอของ Batch เข้า cdc_coin_fingerprints (เรียกใน Transaction ที่บันทึกสถานะ 'loaded')
+        ลายนิ้วมือของ Batch ที่เก่ากว่าเวอร์ชันที่มีอยู่ไม่เขียนทับ (เช่น ทำ Batch ที่ค้างต่อหลัง Batch ใหม่โหลดไปแล้ว)
+        """
+        conn.execute(
+            '''
+            INSERT INTO cdc_coin_fingerprints (coin_id, vs_currency, fingerprint, last_updated, batch_id, updated_at)
+            SELECT coin_id, vs_currency, fingerprint, last_updated, batch_id, ?
+            FROM cdc_pending_fingerprints WHERE batch_id = ?
+            ON CONFLICT (coin_id, vs_currency) DO UPDATE SET
+                fingerprint = excluded.fingerprint,
+                last_updated = excluded.last_updated,
+                batch_id = excluded.batch_id,
+                updated_at = excluded.updated_at
+            WHERE excluded.batch_id >= cdc_coin_fingerprints.batch_id
+            ''',
+            (datetime.now().isoformat(), batch_id)
+        )
+        conn.execute('DELETE FROM cdc_pending_fingerprints WHERE batch_id = ?', (batch_id,))
+
+    def is_unchanged_batch(self, batch_id: str) -> bool:
+        """
+        True หาก Batch นี้ไม่มีเหรียญที่เปลี่ยนเลย (ไม่มีแถวใน Staging แต่มีการอ้างอิงเวอร์ชันก่อนหน้า)
+        Staging ถูกตรวจผ่าน StorageBackend ส่วน cdc_unchanged_refs อยู่ในไฟล์ SQLite ของตารางสถานะเสมอ
+        """
+        if (self.backend or get_backend()).has_staging(batch_id):
+            return False
+        return self.db.connection().execute(
+            'SELECT 1 FROM cdc_unchanged_refs WHERE batch_id = ? LIMIT 1', (batch_id,)
+        ).fetchone() is not None
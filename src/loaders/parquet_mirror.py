@@ -0,0 +1,254 @@
+import os
+import shutil
+from datetime import date, datetime
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Sequence, Union
+from config.settings import settings
+from src.loaders.backends import FACT_COLUMNS, SQLiteBackend, StorageBackend, get_backend
+from src.transformers.records import MarketBatch
+from src.utils.database import get_database
+from src.utils.logger import logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:  # PyArrow เป็น Dependency เสริม ใช้เฉพาะเมื่อเปิด Parquet Mirror
+    pa = None
+
+# ชนิดของแต่ละคอลัมน์ในไฟล์ Parquet (ลำดับเดียวกับ fct_crypto_prices)
+_NUMERIC_COLUMNS = ('price', 'market_cap', 'total_volume')
+_UPDATED_AT_INDEX = FACT_COLUMNS.index('last_updated_at')
+
+DayBound = Union[str, date, None]
+
+
+def partition_day(batch_id: str) -> str:
+    """
+    วันของ Partition ('YYYY-MM-DD') จากส่วนหน้าของ batch_id (รูปแบบ '%Y%m%d_%H%M%S')
+    คือวันที่ Batch ถูกดึง (หรือเวลาของจุดข้อมูลสำหรับ Backfill) ไม่ใช่ last_updated_at ของแต่ละแถว
+    หนึ่ง Batch จึงอยู่ใน Partition เดียวเสมอ และเขียนทับ / สร้างใหม่ทีละ Batch ได้
+    """
+    return f'{batch_id[:4]}-{batch_id[4:6]}-{batch_id[6:8]}'
+
+
+def _text_timestamp(row: Sequence[Any]) -> Sequence[Any]:
+    """ last_updated_at จาก PostgreSQL (TIMESTAMPTZ) เป็น datetime: แปลงเป็น ISO 8601 ให้ตรงกับคอลัมน์ String ของไฟล์ """
+    updated_at = row[_UPDATED_AT_INDEX]
+    if isinstance(updated_at, datetime):
+        return (*row[:_UPDATED_AT_INDEX], updated_at.isoformat(), *row[_UPDATED_AT_INDEX + 1:])
+    return row
+
+
+def _format_day(value: DayBound) -> Optional[str]:
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+class ParquetMirror:
+    """
+    สำเนาของ fct_crypto_prices แบบ Parquet สำหรับงานวิเคราะห์ (อ่านได้โดยไม่แตะไฟล์ SQLite ที่ Pipeline กำลังเขียน)
+
+    โครงสร้างแบบ Hive: {root}/date=YYYY-MM-DD/[coin_id=.../]part-{batch_id}.parquet
+    - date= มาจากส่วนหน้าของ batch_id (ดู partition_day) ไม่ใช่ last_updated_at: แถวที่ราคาอัปเดตก่อนเที่ยงคืน
+      แต่ถูกดึงหลังเที่ยงคืนอยู่ใน Partition ของวันถัดไป การกรองตามเวลาของราคาให้ใช้คอลัมน์ last_updated_at
+    - หนึ่งไฟล์ต่อ Batch ต่อ Partition เขียนลงไฟล์ชั่วคราวแล้วเปลี่ยนชื่อ การโหลด Batch ซ้ำจึงเขียนทับไฟล์เดิม (Idempotent)
+    - แถวในไฟล์เรียงตามเหรียญและเขียนสถิติ min / max ต่อคอลัมน์ ทำให้ Reader ข้าม Row Group ที่ไม่เกี่ยวข้องได้
+    - scan() ตัด Partition ตามช่วงวัน (และเหรียญ) ก่อนเปิดไฟล์ และอ่านเฉพาะคอลัมน์ที่ขอผ่าน Memory-mapped I/O
+    """
+
+    def __init__(self, root: str = None, partition_by_coin: bool = None):
+        if pa is None:
+            raise ImportError("ParquetMirror requires pyarrow. Install it with 'pip install pyarrow'.")
+        self.root = Path(root or settings.PARQUET_MIRROR_DIR)
+        self.partition_by_coin = settings.PARQUET_PARTITION_BY_COIN if partition_by_coin is None else partition_by_coin
+        self.schema = pa.schema([
+            (column, pa.float64() if column in _NUMERIC_COLUMNS else pa.string()) for column in FACT_COLUMNS
+        ])
+
+    def _partition_dir(self, root: Path, day: str, coin_id: str = None) -> Path:
+        path = root / f'date={day}'
+        if self.partition_by_coin:
+            path = path / f'coin_id={coin_id}'
+        return path
+
+    def _file_schema(self) -> 'pa.Schema':
+        # คอลัมน์ที่เป็น Partition ไม่ถูกเก็บซ้ำในไฟล์ (Reader เติมกลับจากชื่อโฟลเดอร์)
+        if self.partition_by_coin:
+            return self.schema.remove(self.schema.get_field_index('coin_id'))
+        return self.schema
+
+    def write(self, rows: Sequence[Sequence[Any]]) -> int:
+        """
+        เขียนแถวที่เพิ่งโหลดเข้า Fact Table (ทั้ง Batch) ลง Partition ของวันนั้น
+
+        Args:
+            rows: แถวในลำดับคอลัมน์ของ fct_crypto_prices (MarketBatch / List ของ Tuple)
+
+        Returns:
+            int: จำนวนไฟล์ที่ถูกเขียน
+        """
+        return self._write(rows, self.root)
+
+    def _write(self, rows: Sequence[Sequence[Any]], root: Path) -> int:
+        if not len(rows):
+            return 0
+        records = list(rows) if isinstance(rows, MarketBatch) else rows
+        coin_index = FACT_COLUMNS.index('coin_id')
+        # เรียงตาม (batch_id, coin_id): แต่ละไฟล์เป็นช่วงต่อเนื่องของ List และสถิติของ coin_id แคบลง
+        ordered = sorted(records, key=lambda row: (row[0], row[coin_index] or ''))
+        written = 0
+        for batch_id, batch_rows in groupby(ordered, key=lambda row: row[0]):
+            batch_rows = list(batch_rows)
+            if self.partition_by_coin:
+                groups = groupby(batch_rows, key=lambda row: row[coin_index])
+            else:
+                groups = [(None, batch_rows)]
+            for coin_id, group in groups:
+                self._write_file(self._partition_dir(root, partition_day(batch_id), coin_id), batch_id, list(group))
+                written += 1
+        logger.info("Parquet mirror: %s rows written to %s files under %s", len(records), written, root)
+        return written
+
+    def _write_file(self, directory: Path, batch_id: str, rows: List[Sequence[Any]]):
+        schema = self._file_schema()
+        columns = dict(zip(FACT_COLUMNS, zip(*rows)))
+        table = pa.table({field.name: pa.array(columns[field.name], type=field.type) for field in schema}, schema=schema)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'part-{batch_id}.parquet'
+        tmp_path = directory / f'.part-{batch_id}.parquet.tmp'
+        pq.write_table(table, tmp_path, compression=settings.PARQUET_COMPRESSION, write_statistics=True)
+        os.replace(tmp_path, path)
+
+    def write_committed(self, rows: Sequence[Sequence[Any]]) -> int:
+        """
+        write() สำหรับแถวที่ถูก Commit เข้า Fact Table แล้ว: Mirror เป็นเพียงสำเนาที่สร้างใหม่ได้ด้วย export-parquet
+        ความล้มเหลว (เช่น ดิสก์เต็ม) จึงถูก Log แทนการ Raise เพื่อไม่ให้ Batch ที่โหลดสำเร็จแล้วถูกบันทึกว่าล้มเหลว
+        """
+        try:
+            return self.write(rows)
+        except Exception as e:
+            logger.error("Parquet mirror write failed (facts are committed; rebuild with 'export-parquet'): %s", e)
+            return 0
+
+    def export_committed(self, start: DayBound = None, end: DayBound = None, db_path: str = None) -> int:
+        """ export_days() หลัง Commit Fact Table แล้ว: Log ความล้มเหลวแทนการ Raise เช่นเดียวกับ write_committed() """
+        try:
+            return self.export_days(start, end, db_path=db_path)
+        except Exception as e:
+            logger.error("Parquet mirror export failed (facts are committed; rebuild with 'export-parquet'): %s", e)
+            return 0
+
+    def export_days(self, start: DayBound = None, end: DayBound = None, db_path: str = None,
+                    backend: StorageBackend = None) -> int:
+        """
+        สร้าง Partition รายวันใหม่จาก fct_crypto_prices (ใช้ครั้งแรก หลัง Backfill / Reprocess
+        หรือเพื่อซ่อม Partition ที่เสียหาย) แต่ละวันถูกเขียนลงโฟลเดอร์ชั่วคราวแล้วสลับแทนของเดิมทั้งโฟลเดอร์
+
+        Args:
+            start / end: ช่วงวัน (รวม start, ไม่รวม end) เป็น date หรือ 'YYYY-MM-DD' (ไม่ระบุ = ทุกวันที่มีข้อมูล)
+            db_path / backend: ที่เก็บ Fact Table (ไม่ระบุ = Backend ตาม settings.DATABASE_URL)
+
+        Returns:
+            int: จำนวนแถวที่ถูกเขียน
+        """
+        backend = backend or (SQLiteBackend(get_database(db_path)) if db_path else get_backend())
+        start, end = _format_day(start), _format_day(end)
+        # ช่วงของ batch_id (ขึ้นต้นด้วย YYYYmmdd) อ่านแบบ Stream เรียงตาม batch_id จึงถือแถวไว้ครั้งละหนึ่งวันเท่านั้น
+        batch_range = (
+            f'{start.replace("-", "")}_000000' if start else '',
+            f'{end.replace("-", "")}_000000' if end else '~',
+        )
+
+        total = 0
+        days = 0
+        day, rows = None, []
+        for chunk in backend.iter_facts(batch_range=batch_range):
+            for row in chunk:
+                row_day = partition_day(row[0])
+                if row_day != day:
+                    if rows:
+                        total += self._replace_day(day, rows)
+                        days += 1
+                    day, rows = row_day, []
+                rows.append(_text_timestamp(row))
+        if rows:
+            total += self._replace_day(day, rows)
+            days += 1
+        logger.info("Parquet mirror: exported %s rows across %s days.", total, days)
+        return total
+
+    def _replace_day(self, day: str, rows: List[Sequence[Any]]) -> int:
+        """ เขียน Partition ของวันลงโฟลเดอร์ชั่วคราวแล้วสลับแทนของเดิมทั้งโฟลเดอร์ คืนจำนวนแถวที่ถูกเขียน """
+        staging = self.root / f'.date={day}.tmp'
+        retired = self.root / f'.date={day}.old'
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(retired, ignore_errors=True)
+        self._write(rows, staging)
+        target = self.root / f'date={day}'
+        # สลับด้วยการเปลี่ยนชื่อเท่านั้น: ย้ายของเดิมออกก่อน แล้วจึงลบหลังของใหม่เข้าที่
+        # (ช่วงที่ไม่มี Partition สั้นเพียงระหว่าง rename สองครั้ง และหากล้มเหลวกลางทางของเดิมถูกย้ายกลับ)
+        if target.exists():
+            os.replace(target, retired)
+        try:
+            os.replace(staging / f'date={day}', target)
+        except OSError:
+            if retired.exists():
+                os.replace(retired, target)
+            raise
+        shutil.rmtree(retired, ignore_errors=True)
+        shutil.rmtree(staging, ignore_errors=True)
+        return len(rows)
+
+    # ---------------------------------------------------------------- Reader
+
+    def partitions(self, start: DayBound = None, end: DayBound = None) -> List[str]:
+        """ วันของ Partition ที่อยู่ในช่วง (รวม start, ไม่รวม end) จากชื่อโฟลเดอร์ โดยไม่เปิดไฟล์ใดๆ """
+        start, end = _format_day(start), _format_day(end)
+        if not self.root.exists():
+            return []
+        days = sorted(path.name[5:] for path in self.root.glob('date=*') if path.is_dir())
+        return [day for day in days if (start is None or day >= start) and (end is None or day < end)]
+
+    def scan(self, columns: Iterable[str] = None, start: DayBound = None, end: DayBound = None,
+             coin_ids: Iterable[str] = None, vs_currency: str = None) -> 'pa.Table':
+        """
+        อ่านข้อมูลจาก Mirror เป็น pyarrow.Table
+
+        Args:
+            columns: คอลัมน์ที่ต้องการ (ไม่ระบุ = ทุกคอลัมน์) อ่านเฉพาะ Column Chunk ของคอลัมน์เหล่านี้
+            start / end: ช่วงวันของ Partition (รวม start, ไม่รวม end)
+            coin_ids / vs_currency: เงื่อนไขที่ใช้ตัด Partition (เมื่อแบ่งตามเหรียญ) หรือ Row Group ด้วยสถิติ min / max
+        """
+        columns = list(columns) if columns is not None else list(FACT_COLUMNS)
+        coin_ids = list(coin_ids) if coin_ids is not None else None
+        days = self.partitions(start, end)
+        if not days or coin_ids == []:
+            return self.schema.empty_table().select(columns)
+
+        # Partition Pruning: ส่งเฉพาะโฟลเดอร์ของวัน (และเหรียญ) ที่อยู่ในช่วงให้ Dataset
+        paths = [self.root / f'date={day}' for day in days]
+        if self.partition_by_coin and coin_ids is not None:
+            paths = [path / f'coin_id={coin_id}' for path in paths for coin_id in coin_ids]
+        files = [str(file) for path in paths if path.exists() for file in sorted(path.rglob('part-*.parquet'))]
+        if not files:
+            return self.schema.empty_table().select(columns)
+
+        dataset = ds.dataset(
+            files, schema=self.schema, format='parquet', partition_base_dir=str(self.root),
+            partitioning=ds.partitioning(
+                pa.schema([('date', pa.string())] + ([('coin_id', pa.string())] if self.partition_by_coin else [])),
+                flavor='hive'
+            ),
+            filesystem=pafs.LocalFileSystem(use_mmap=True)
+        )
+        condition = None
+        if coin_ids is not None:
+            condition = ds.field('coin_id').isin(coin_ids)
+        if vs_currency is not None:
+            currency = ds.field('vs_currency') == vs_currency
+            condition = currency if condition is None else condition & currency
+        return dataset.to_table(columns=columns, filter=condition)
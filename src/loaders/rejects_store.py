@@ -0,0 +1,123 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Union
+from src.utils.database import get_database, resolve_db_path
+from src.utils.logger import logger
+
+# คอลัมน์ที่ส่งคืนจาก query() (ตรงกับ Schema ของ rej_crypto_markets)
+REJECT_COLUMNS = ('batch_id', 'coin_id', 'vs_currency', 'symbol', 'name', 'price', 'market_cap', 'total_volume',
+                  'last_updated_at', 'reason', 'rule_id', 'rejected_at')
+
+# rule_id ของรายการที่ไม่ได้ระบุกฎมาด้วย
+DEFAULT_RULE_ID = 'unspecified'
+
+TimeBound = Union[str, datetime, None]
+
+
+def _format_time(value: TimeBound) -> Optional[str]:
+    # rejected_at ถูกเติมด้วย CURRENT_TIMESTAMP ของ SQLite (UTC, รูปแบบ 'YYYY-MM-DD HH:MM:SS')
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+class RejectsStore:
+    """
+    ที่เก็บรายการที่ถูกคัดออก (Rejects) แบบ Append-only ในตาราง rej_crypto_markets
+    บันทึกทั้ง Batch ด้วยการเขียนแบบ Bulk ครั้งเดียว (แทนไฟล์ JSON รายรอบ) พร้อมเหตุผลและรหัสกฎ
+    และมี API สำหรับค้นหาเพื่อทำ Root Cause Analysis (RCA) ตามเหรียญ เหตุผล และช่วงเวลา ผ่านดัชนีของตาราง
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+
+    def write(self, issues: Iterable[Dict[str, Any]], batch_id: str = None, conn=None) -> int:
+        """
+        บันทึกรายการที่ถูกคัดออกทั้งหมดด้วย executemany ครั้งเดียว (รายการซ้ำของ Batch/เหรียญ/สกุลเงิน/กฎ เดิมจะถูกข้าม)
+
+        Args:
+            issues: รายการจาก Transform Engine (คีย์ id, symbol, name, price, market_cap, total_volume,
+                last_updated, vs_currency, reason, rule_id)
+            batch_id (str, optional): ใช้แทน batch_id ของรายการที่ไม่มีค่า
+            conn (sqlite3.Connection, optional): Connection ที่อยู่ใน Transaction ของงานหลัก
+
+        Returns:
+            int: จำนวนรายการที่ถูกบันทึกใหม่
+        """
+        rows = [
+            (
+                issue.get('batch_id') or batch_id, issue.get('id'), issue.get('vs_currency', 'usd'),
+                issue.get('symbol'), issue.get('name'), issue.get('price'), issue.get('market_cap'),
+                issue.get('total_volume'), issue.get('last_updated'), issue.get('reason'),
+                issue.get('rule_id') or DEFAULT_RULE_ID
+            )
+            for issue in issues
+        ]
+        if not rows:
+            return 0
+
+        query = '''
+        INSERT OR IGNORE INTO rej_crypto_markets
+        (batch_id, coin_id, vs_currency, symbol, name, price, market_cap, total_volume, last_updated_at, reason, rule_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        '''
+        if conn is not None:
+            written = conn.executemany(query, rows).rowcount
+        else:
+            conn = self.db.connection()
+            with conn:
+                written = conn.executemany(query, rows).rowcount
+
+        logger.info("Rejects recorded: %s of %s records (Batch: %s)", written, len(rows), batch_id)
+        return written
+
+    def query(self, coin_id: str = None, reason: str = None, rule_id: str = None, batch_id: str = None,
+              since: TimeBound = None, until: TimeBound = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """
+        ค้นหารายการที่ถูกคัดออก เรียงจากใหม่ไปเก่า
+
+        Args:
+            coin_id / reason / rule_id / batch_id: เงื่อนไขแบบเท่ากับ (ไม่ระบุ = ไม่กรอง)
+            since / until: ช่วงเวลาของ rejected_at (รวม since, ไม่รวม until) เป็น datetime หรือ String แบบ UTC
+            limit (int): จำนวนรายการสูงสุด
+        """
+        where, params = self._filters(coin_id=coin_id, reason=reason, rule_id=rule_id, batch_id=batch_id,
+                                      since=since, until=until)
+        rows = self.db.connection().execute(
+            f'SELECT {", ".join(REJECT_COLUMNS)} FROM rej_crypto_markets {where} '
+            f'ORDER BY rejected_at DESC, rowid DESC LIMIT ?',
+            params + [limit]
+        ).fetchall()
+        return [dict(zip(REJECT_COLUMNS, row)) for row in rows]
+
+    def summary(self, coin_id: str = None, since: TimeBound = None, until: TimeBound = None) -> List[Dict[str, Any]]:
+        """
+        สรุปจำนวนรายการที่ถูกคัดออกตามกฎและเหตุผล (เรียงจากมากไปน้อย) พร้อมจำนวนเหรียญและช่วงเวลาที่พบ
+        ใช้เป็นจุดเริ่มต้นของ RCA ก่อนเจาะดูรายการด้วย query()
+        """
+        where, params = self._filters(coin_id=coin_id, since=since, until=until)
+        rows = self.db.connection().execute(
+            f'''
+            SELECT rule_id, reason, COUNT(*), COUNT(DISTINCT coin_id), MIN(rejected_at), MAX(rejected_at)
+            FROM rej_crypto_markets {where}
+            GROUP BY rule_id, reason
+            ORDER BY COUNT(*) DESC
+            ''',
+            params
+        ).fetchall()
+        return [
+            dict(zip(('rule_id', 'reason', 'count', 'coins', 'first_seen', 'last_seen'), row))
+            for row in rows
+        ]
+
+    @staticmethod
+    def _filters(since: TimeBound = None, until: TimeBound = None, **equals: Optional[str]):
+        clauses = [f'{column} = ?' for column, value in equals.items() if value is not None]
+        params: List[Any] = [value for value in equals.values() if value is not None]
+        if since is not None:
+            clauses.append('rejected_at >= ?')
+            params.append(_format_time(since))
+        if until is not None:
+            clauses.append('rejected_at < ?')
+            params.append(_format_time(until))
+        return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', params
@@ -0,0 +1,294 @@
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from src.loaders.backends import FACT_COLUMNS, SQLiteBackend, StorageBackend, get_backend
+from src.utils.database import get_database, resolve_db_path
+from src.utils.logger import logger
+
+# ช่วงเวลาของตาราง OHLC -> จำนวนตัวอักษรของ observed_at ที่ใช้เป็น bucket และส่วนที่เติมท้าย
+INTERVALS = {'hourly': (13, ':00:00'), 'daily': (10, '')}
+
+# คอลัมน์ที่ส่งคืนจาก latest() และ ohlc()
+LATEST_COLUMNS = ('coin_id', 'vs_currency', 'symbol', 'name', 'price', 'market_cap', 'total_volume',
+                  'last_updated_at', 'batch_id')
+OHLC_COLUMNS = ('bucket', 'open', 'high', 'low', 'close', 'market_cap', 'total_volume')
+
+_ISO_TIME = re.compile(r'(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})')
+_BATCH_TIME = re.compile(r'(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})')
+
+TimeBound = Union[str, datetime, None]
+
+_LATEST_UPSERT = '''
+INSERT INTO dim_coin_latest
+(coin_id, vs_currency, symbol, name, price, market_cap, total_volume, last_updated_at, observed_at, batch_id, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+ON CONFLICT (coin_id, vs_currency) DO UPDATE SET
+    symbol = excluded.symbol,
+    name = excluded.name,
+    price = excluded.price,
+    market_cap = excluded.market_cap,
+    total_volume = excluded.total_volume,
+    last_updated_at = excluded.last_updated_at,
+    observed_at = excluded.observed_at,
+    batch_id = excluded.batch_id,
+    updated_at = excluded.updated_at
+WHERE (excluded.observed_at, excluded.batch_id) > (dim_coin_latest.observed_at, dim_coin_latest.batch_id)
+'''
+
+# ทุกนิพจน์ใน SET อ้างถึงค่าเดิมของแถว จึงเปรียบเทียบกับ open_at / close_at เดิมได้ก่อนถูกเขียนทับ
+_OHLC_UPSERT = '''
+INSERT INTO agg_crypto_ohlc_{interval}
+(coin_id, vs_currency, bucket, open, high, low, close, market_cap, total_volume,
+ open_at, open_batch_id, close_at, close_batch_id, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+ON CONFLICT (coin_id, vs_currency, bucket) DO UPDATE SET
+    open = CASE WHEN (excluded.open_at, excluded.open_batch_id) < (open_at, open_batch_id)
+                THEN excluded.open ELSE open END,
+    open_at = MIN(open_at, excluded.open_at),
+    open_batch_id = CASE WHEN (excluded.open_at, excluded.open_batch_id) < (open_at, open_batch_id)
+                         THEN excluded.open_batch_id ELSE open_batch_id END,
+    high = MAX(high, excluded.high),
+    low = MIN(low, excluded.low),
+    close = CASE WHEN (excluded.close_at, excluded.close_batch_id) > (close_at, close_batch_id)
+                 THEN excluded.close ELSE close END,
+    market_cap = CASE WHEN (excluded.close_at, excluded.close_batch_id) > (close_at, close_batch_id)
+                      THEN excluded.market_cap ELSE market_cap END,
+    total_volume = CASE WHEN (excluded.close_at, excluded.close_batch_id) > (close_at, close_batch_id)
+                        THEN excluded.total_volume ELSE total_volume END,
+    close_at = MAX(close_at, excluded.close_at),
+    close_batch_id = CASE WHEN (excluded.close_at, excluded.close_batch_id) > (close_at, close_batch_id)
+                          THEN excluded.close_batch_id ELSE close_batch_id END,
+    updated_at = excluded.updated_at
+'''
+
+
+def _fetch_chunks(conn, chunk_size: int) -> Iterable[List[Tuple]]:
+    cursor = conn.execute(f'SELECT {", ".join(FACT_COLUMNS)} FROM fct_crypto_prices')
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def observed_at(last_updated_at: Any, batch_id: Any) -> Optional[str]:
+    """
+    เวลาของข้อมูลหนึ่งแถวในรูปแบบ 'YYYY-MM-DDTHH:MM:SS' (เรียงลำดับแบบ String ได้):
+    ใช้ last_updated_at จาก API หากเป็นเวลาแบบ ISO มิฉะนั้นใช้เวลาจาก batch_id (รูปแบบ '%Y%m%d_%H%M%S')
+    """
+    match = _ISO_TIME.match(last_updated_at) if isinstance(last_updated_at, str) else None
+    if match:
+        return f'{match.group(1)}T{match.group(2)}'
+    match = _BATCH_TIME.match(batch_id) if isinstance(batch_id, str) else None
+    if match:
+        year, month, day, hour, minute, second = match.groups()
+        return f'{year}-{month}-{day}T{hour}:{minute}:{second}'
+    return None
+
+
+def bucket_of(observed: str, interval: str) -> str:
+    """ เวลาเริ่มของช่วง (hourly: 'YYYY-MM-DDTHH:00:00', daily: 'YYYY-MM-DD') ที่ observed อยู่ """
+    length, suffix = INTERVALS[interval]
+    return observed[:length] + suffix
+
+
+def _format_bound(value: TimeBound, interval: str) -> Optional[str]:
+    if isinstance(value, datetime):
+        return bucket_of(value.strftime('%Y-%m-%dT%H:%M:%S'), interval)
+    return value
+
+
+class MarketRollups:
+    """
+    ตารางสรุปของ fct_crypto_prices ที่อัปเดตแบบ Incremental ทุกครั้งที่โหลดข้อมูล (dim_coin_latest และ
+    agg_crypto_ohlc_hourly / agg_crypto_ohlc_daily) พร้อม API สำหรับค้นหาราคาล่าสุด / ช่วงราคา / OHLC
+    ที่อ่านเฉพาะแถวสรุปของเหรียญและช่วงเวลาที่ต้องการ ไม่ต้องสแกนหรือ GROUP BY ประวัติทั้งหมด
+
+    - apply() รวมแถวของ Batch ใน Python ก่อน (หนึ่งแถวต่อเหรียญ / ช่วงเวลา) แล้ว Upsert เฉพาะคีย์ที่ได้รับผลกระทบ
+    - ทุก Upsert ตัดสินด้วยเวลาของข้อมูล (observed_at, batch_id) ไม่ใช่ลำดับการโหลด การโหลดซ้ำหรือ Backfill
+      ข้อมูลย้อนหลังจึงให้ผลเหมือนกันเสมอ (Idempotent) และไม่เขียนทับราคาล่าสุดด้วยข้อมูลเก่า
+    - ตารางสรุปอยู่ในไฟล์ SQLite ของ Pipeline เสมอ (รวมถึงเมื่อ Fact Table อยู่ใน PostgreSQL) เช่นเดียวกับสถิติสะสม
+    """
+
+    def __init__(self, db_path: str = None, backend: StorageBackend = None):
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+        # ที่มาของ Fact Table สำหรับ rebuild(): ระบุ db_path = Fact Table ในไฟล์นั้น (เหมือน CryptoTransformer)
+        self.backend = backend or (SQLiteBackend(self.db) if db_path else None)
+
+    def apply(self, rows: Iterable[Sequence[Any]], conn=None) -> int:
+        """
+        อัปเดตตารางสรุปจากแถวที่เพิ่งโหลดเข้า Fact Table
+
+        Args:
+            rows: แถวในลำดับคอลัมน์ของ fct_crypto_prices (MarketRecord / MarketBatch / Tuple)
+            conn (sqlite3.Connection, optional): Connection ที่อยู่ใน Transaction ของงานหลัก
+
+        Returns:
+            int: จำนวน (เหรียญ, สกุลเงิน) ที่ได้รับผลกระทบ
+        """
+        latest: Dict[Tuple[str, str], Tuple] = {}
+        buckets: Dict[str, Dict[Tuple[str, str, str], List[Any]]] = {interval: {} for interval in INTERVALS}
+
+        for batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, vs_currency in rows:
+            observed = observed_at(last_updated_at, batch_id)
+            if observed is None or price is None:
+                continue
+            order = (observed, batch_id)
+            key = (coin_id, vs_currency)
+            current = latest.get(key)
+            if current is None or order > (current[8], current[9]):
+                latest[key] = (coin_id, vs_currency, symbol, name, price, market_cap, total_volume, last_updated_at,
+                               observed, batch_id)
+
+            for interval, aggregates in buckets.items():
+                bucket_key = (coin_id, vs_currency, bucket_of(observed, interval))
+                agg = aggregates.get(bucket_key)
+                if agg is None:
+                    aggregates[bucket_key] = [price, price, price, price, market_cap, total_volume,
+                                              observed, batch_id, observed, batch_id]
+                    continue
+                if order < (agg[6], agg[7]):
+                    agg[0], agg[6], agg[7] = price, observed, batch_id
+                agg[1] = max(agg[1], price)
+                agg[2] = min(agg[2], price)
+                if order > (agg[8], agg[9]):
+                    agg[3], agg[4], agg[5], agg[8], agg[9] = price, market_cap, total_volume, observed, batch_id
+
+        if not latest:
+            return 0
+
+        def write(conn):
+            conn.executemany(_LATEST_UPSERT, latest.values())
+            for interval, aggregates in buckets.items():
+                conn.executemany(
+                    _OHLC_UPSERT.format(interval=interval),
+                    (key + tuple(agg) for key, agg in aggregates.items())
+                )
+
+        if conn is not None:
+            write(conn)
+        else:
+            conn = self.db.connection()
+            with conn:
+                write(conn)
+        return len(latest)
+
+    def rebuild(self, chunk_size: int = 50000, conn=None) -> int:
+        """
+        สร้างตารางสรุปใหม่ทั้งหมดจาก fct_crypto_prices (ใช้หลัง Rebuild Fact Table
+        หรือครั้งแรกหลัง Migration กับฐานข้อมูลที่มีประวัติอยู่แล้ว) อ่านแบบ Stream ทีละก้อนใน Transaction เดียว
+        Fact Table ถูกอ่านผ่าน StorageBackend ที่ใช้งานอยู่ (เช่น PostgreSQL) ส่วนตารางสรุปอยู่ในไฟล์ SQLite เสมอ
+
+        Args:
+            conn (sqlite3.Connection, optional): Connection ที่อยู่ใน Transaction ของงานหลัก (เช่น การสลับ Fact Table)
+                Fact Table ถูกอ่านจาก Connection เดียวกันนี้ (ภายใน Transaction เดียวกัน)
+
+        Returns:
+            int: จำนวนแถวของ Fact Table ที่ถูกประมวลผล
+        """
+        def build(conn, chunks: Iterable[List[Tuple]]) -> int:
+            total = 0
+            self.clear(conn=conn)
+            for chunk in chunks:
+                self.apply(chunk, conn=conn)
+                total += len(chunk)
+            return total
+
+        if conn is not None:
+            total = build(conn, _fetch_chunks(conn, chunk_size))
+        else:
+            conn = self.db.connection()
+            with conn:
+                total = build(conn, (self.backend or get_backend()).iter_facts(chunk_size))
+        logger.info("Rollups rebuilt from %s fact rows.", total)
+        return total
+
+    def clear(self, conn=None):
+        """ ลบข้อมูลในตารางสรุปทั้งหมด (ใช้คู่กับการล้าง Fact Table) """
+        tables = ['dim_coin_latest'] + [f'agg_crypto_ohlc_{interval}' for interval in INTERVALS]
+        if conn is None:
+            conn = self.db.connection()
+            with conn:
+                for table in tables:
+                    conn.execute(f'DELETE FROM {table}')
+            return
+        for table in tables:
+            conn.execute(f'DELETE FROM {table}')
+
+    # ---------------------------------------------------------------- Query API
+
+    def latest(self, coin_ids: Iterable[str] = None, vs_currency: str = 'usd') -> List[Dict[str, Any]]:
+        """
+        ข้อมูลล่าสุดของเหรียญที่ระบุ (ไม่ระบุ = ทุกเหรียญ) ในสกุลเงินเดียว เรียงตามมูลค่าตลาดจากมากไปน้อย
+        อ่านหนึ่งแถวต่อเหรียญจาก dim_coin_latest
+        """
+        where = 'WHERE vs_currency = ?'
+        params: List[Any] = [vs_currency]
+        if coin_ids is not None:
+            coin_ids = list(coin_ids)
+            if not coin_ids:
+                return []
+            where += f' AND coin_id IN ({", ".join("?" * len(coin_ids))})'
+            params.extend(coin_ids)
+        rows = self.db.connection().execute(
+            f'SELECT {", ".join(LATEST_COLUMNS)} FROM dim_coin_latest {where} '
+            f'ORDER BY market_cap IS NULL, market_cap DESC, coin_id',
+            params
+        ).fetchall()
+        return [dict(zip(LATEST_COLUMNS, row)) for row in rows]
+
+    def latest_price(self, coin_id: str, vs_currency: str = 'usd') -> Optional[float]:
+        """ ราคาล่าสุดของเหรียญหนึ่งเหรียญ (None หากยังไม่เคยโหลด) """
+        row = self.db.connection().execute(
+            'SELECT price FROM dim_coin_latest WHERE coin_id = ? AND vs_currency = ?', (coin_id, vs_currency)
+        ).fetchone()
+        return row[0] if row else None
+
+    def ohlc(self, coin_id: str, vs_currency: str = 'usd', interval: str = 'daily',
+             since: TimeBound = None, until: TimeBound = None) -> List[Dict[str, Any]]:
+        """
+        แท่งราคา OHLC ของเหรียญหนึ่งเหรียญ เรียงตามเวลา
+
+        Args:
+            interval (str): 'hourly' หรือ 'daily'
+            since / until: ช่วงเวลาเริ่มของแท่ง (รวม since, ไม่รวม until) เป็น datetime หรือ String แบบ UTC
+        """
+        if interval not in INTERVALS:
+            raise ValueError(f'Unsupported OHLC interval: {interval!r}')
+        where = 'WHERE coin_id = ? AND vs_currency = ?'
+        params: List[Any] = [coin_id, vs_currency]
+        if since is not None:
+            where += ' AND bucket >= ?'
+            params.append(_format_bound(since, interval))
+        if until is not None:
+            where += ' AND bucket < ?'
+            params.append(_format_bound(until, interval))
+        rows = self.db.connection().execute(
+            f'SELECT {", ".join(OHLC_COLUMNS)} FROM agg_crypto_ohlc_{interval} {where} ORDER BY bucket',
+            params
+        ).fetchall()
+        return [dict(zip(OHLC_COLUMNS, row)) for row in rows]
+
+    def price_range(self, coin_id: str, vs_currency: str = 'usd', since: TimeBound = None, until: TimeBound = None,
+                    interval: str = 'hourly') -> Optional[Dict[str, Any]]:
+        """
+        สรุปราคาของช่วงเวลา (เปิด / สูงสุด / ต่ำสุด / ปิด) รวมจากแท่ง OHLC ในช่วงนั้น
+        ความละเอียดของขอบช่วงเท่ากับ interval ('hourly' ค่าเริ่มต้น หรือ 'daily' สำหรับช่วงยาว)
+
+        Returns:
+            Optional[Dict[str, Any]]: None หากไม่มีข้อมูลในช่วงที่ระบุ
+        """
+        bars = self.ohlc(coin_id, vs_currency=vs_currency, interval=interval, since=since, until=until)
+        if not bars:
+            return None
+        return {
+            'coin_id': coin_id,
+            'vs_currency': vs_currency,
+            'from_bucket': bars[0]['bucket'],
+            'to_bucket': bars[-1]['bucket'],
+            'open': bars[0]['open'],
+            'high': max(bar['high'] for bar in bars),
+            'low': min(bar['low'] for bar in bars),
+            'close': bars[-1]['close'],
+        }
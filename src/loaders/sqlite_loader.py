@@ -1,46 +1,44 @@
-import sqlite3
 import json
-from typing import List, Dict, Any, Tuple
+import time
+from itertools import islice
+from typing import List, Dict, Any, Tuple, Iterable, Iterator, Optional
 from datetime import datetime
 from config.settings import settings
+from src.loaders.backends import SQLiteBackend, StorageBackend, get_backend
+from src.loaders.batch_ledger import BatchLedger
+from src.loaders.change_tracker import ChangeTracker, Fingerprints
+from src.utils.database import get_database, resolve_db_path
 from src.utils.logger import logger
+from src.utils.metrics import record_stage
+
+# ฟิลด์ของ /coins/markets ที่ไม่ขึ้นกับสกุลเงินอ้างอิง: เก็บใน stg_coin_meta ครั้งเดียวต่อเหรียญต่อ Batch
+# แทนการทำซ้ำในข้อมูลดิบของทุกสกุลเงิน (View v_stg_crypto_markets ประกอบกลับเป็น JSON ก้อนเดิม)
+META_FIELDS = ('symbol', 'name', 'image', 'market_cap_rank', 'circulating_supply', 'total_supply', 'max_supply')
 
 class SQLiteLoader:
     """
     จัดการขั้นตอน 'Load' ของกระบวนการ ELT โดยการบันทึกข้อมูลดิบ (Raw Data)
-    ลงใน SQLite staging area ซึ่งเปรียบเสมือน Data Lake ของโปรเจกต์
+    ลงใน Staging Area ซึ่งเปรียบเสมือน Data Lake ของโปรเจกต์
+    ตาราง Staging อยู่ใน Backend ตาม DATABASE_URL (SQLite หรือ PostgreSQL) ส่วน Ledger / CDC อยู่ในไฟล์ SQLite เสมอ
     """
     
-    def __init__(self):
+    def __init__(self, db_path: str = None, backend: StorageBackend = None):
         # ดึงที่อยู่ไฟล์ฐานข้อมูลโดยการตัด prefix 'sqlite:///' ออก
-        self.db_path = settings.DATABASE_URL.replace('sqlite:///', '').strip()
+        self.db_path = db_path or resolve_db_path()
         try:
             # แจ้งสถานะการเริ่มต้นฐานข้อมูล Staging (Log เป็นภาษาอังกฤษ)
-            logger.info(f"Initializing SQLite staging at: {self.db_path}")
-            # ตรวจสอบและสร้างตาราง Staging ทันทีเมื่อเริ่มใช้งาน Class
-            self._create_staging_table()
+            logger.info("Initializing SQLite staging at: %s", self.db_path)
+            # ใช้ Connection Manager กลาง: Schema และดัชนีถูกสร้าง/Migrate เพียงครั้งเดียวเมื่อเปิด Connection แรก
+            self.db = get_database(self.db_path)
+            self.db.connection()
+            self.ledger = BatchLedger(self.db_path)
+            # ระบุ db_path ตรงๆ (เช่น ในการทดสอบ / Benchmark) หมายถึงใช้ไฟล์ SQLite นั้นเป็นที่เก็บ Staging ด้วย
+            self.backend = backend or (SQLiteBackend(self.db) if db_path else get_backend())
+            self.change_tracker = ChangeTracker(self.db_path, backend=self.backend)
         except Exception as e:
-            logger.error(f"Failed to initialize SQLiteLoader: {str(e)}")
+            logger.error("Failed to initialize SQLiteLoader: %s", e)
             raise
 
-    def _create_staging_table(self):
-        """
-        สร้างตาราง Staging เพื่อเก็บข้อมูลดิบในรูปแบบ JSON ที่ไม่ถูกแก้ไข (Immutable)
-        มีการเก็บ batch_id เพื่อใช้ในการตรวจสอบที่มาของข้อมูล (Traceability) และการตรวจสอบ (Auditing)
-        """
-        query = '''
-        CREATE TABLE IF NOT EXISTS stg_crypto_markets(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            coin_id TEXT,               -- รหัสอ้างอิงของเหรียญ (เช่น 'bitcoin')
-            raw_data TEXT,              -- ข้อมูล JSON ทั้งก้อนที่ได้รับจาก API เก็บในรูปแบบ String
-            extracted_at TIMESTAMP,     -- วันเวลาที่ดึงข้อมูลออกมา
-            batch_id TEXT               -- รหัสชุดข้อมูลเพื่อใช้ระบุรอบการรันของ Pipeline
-        );
-        '''
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(query)
-            logger.debug("Staging table 'stg_crypto_markets' is ready.")
-
     def load_to_staging(self, data: List[Dict[str, Any]]) -> str:
         """
         บันทึก List ของ Dictionary ลงในตาราง Staging โดยใช้เทคนิค Bulk Insertion
@@ -51,33 +49,164 @@ class SQLiteLoader:
         Returns:
             str: รหัส batch_id ที่สร้างขึ้นสำหรับรอบการโหลดข้อมูลนี้
         """
+        batch_id, _ = self.load_pages_to_staging([data])
+        return batch_id
+
+    def load_pages_to_staging(self, pages: Iterable[List[Dict[str, Any]]], chunk_size: int = None,
+                              batch_id: str = None, replace: bool = False,
+                              vs_currency: str = 'usd') -> Tuple[str, int]:
+        """
+        บันทึกข้อมูลแบบ Stream ของสกุลเงินเดียว (ดู load_market_pages สำหรับหลายสกุลเงิน)
+
+        Args:
+            pages (Iterable[List[Dict[str, Any]]]): หน้าข้อมูลดิบที่ทยอยส่งมาจาก API
+            chunk_size (int, optional): จำนวนแถวต่อการเขียนหนึ่งครั้ง (ค่าเริ่มต้น settings.STAGING_CHUNK_SIZE)
+            batch_id (str, optional): ใช้รหัส Batch ที่กำหนดไว้แล้ว (เช่น จาก DAG แบบแยกขั้นตอน) แทนการสร้างใหม่
+            replace (bool): ลบข้อมูลเดิมของ batch_id นี้ใน Transaction เดียวกันก่อนเขียน (ทำให้รันซ้ำได้โดยไม่ซ้ำซ้อน)
+            vs_currency (str): สกุลเงินอ้างอิงของราคาในหน้าข้อมูลเหล่านี้
+
+        Returns:
+            Tuple[str, int]: รหัส batch_id และจำนวนแถวที่บันทึกได้
+        """
+        return self.load_market_pages(
+            ((vs_currency, page) for page in pages), chunk_size=chunk_size, batch_id=batch_id, replace=replace
+        )
+
+    def load_market_pages(self, currency_pages: Iterable[Tuple[str, List[Dict[str, Any]]]], chunk_size: int = None,
+                          batch_id: str = None, replace: bool = False,
+                          known: Optional[Fingerprints] = None) -> Tuple[str, int]:
+        """
+        บันทึกข้อมูลแบบ Stream: รับหน้าข้อมูล (สกุลเงิน, หน้า) จาก Generator ของ Client แล้วแปลงเป็น JSON ทันทีที่มาถึง
+        และเขียนลง Staging เป็นก้อนขนาดคงที่ (executemany) ภายใน Transaction เดียว
+        ทำให้หน่วยความจำสูงสุดขึ้นกับ chunk_size ไม่ใช่ขนาดของข้อมูลทั้ง Batch
+
+        ข้อมูลแต่ละรายการถูกแยกเป็นสองส่วน: ฟิลด์ที่ขึ้นกับสกุลเงินลง stg_crypto_markets หนึ่งแถวต่อ (เหรียญ, สกุลเงิน)
+        และฟิลด์ที่ไม่ขึ้นกับสกุลเงิน (META_FIELDS) ลง stg_coin_meta เพียงครั้งเดียวต่อเหรียญต่อ Batch
+        เมื่อเปิด settings.CDC_ENABLED แถวที่ข้อมูลไม่เปลี่ยนจากเวอร์ชันล่าสุดจะถูกบันทึกเป็นการอ้างอิงใน cdc_unchanged_refs แทน
+
+        Args:
+            currency_pages (Iterable[Tuple[str, List[Dict[str, Any]]]]): คู่ของสกุลเงินและหน้าข้อมูลดิบ
+            chunk_size (int, optional): จำนวนแถวต่อการเขียนหนึ่งครั้ง (ค่าเริ่มต้น settings.STAGING_CHUNK_SIZE)
+            batch_id (str, optional): ใช้รหัส Batch ที่กำหนดไว้แล้ว แทนการสร้างใหม่
+            replace (bool): ลบข้อมูลเดิมของ batch_id นี้ใน Transaction เดียวกันก่อนเขียน
+            known (Fingerprints, optional): ลายนิ้วมือที่ผู้เรียกถือไว้ในหน่วยความจำแล้ว (เช่น Daemon)
+                ใช้แทนการโหลดจากฐานข้อมูล และเปิดการทำงานแบบ CDC สำหรับการโหลดครั้งนี้
+
+        Returns:
+            Tuple[str, int]: รหัส batch_id และจำนวนแถว (เหรียญ, สกุลเงิน) ที่ได้รับ (รวมแถวที่ไม่เปลี่ยนในโหมด CDC)
+        """
+        chunk_size = chunk_size or settings.STAGING_CHUNK_SIZE
         try:
             # สร้าง batch_id และเวลาที่ดึงข้อมูล เพื่อใช้ติดตามข้อมูลรายรอบ (Incremental Loading)
-            batch_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+            batch_id = batch_id or datetime.now().strftime('%Y%m%d_%H%M%S')
             extracted_at = datetime.now().isoformat()
 
             # ใช้ Parameterized SQL เพื่อป้องกันช่องโหว่ SQL Injection
-            insert_query = ''' 
-            INSERT INTO stg_crypto_markets (coin_id, raw_data, extracted_at, batch_id)
+            insert_ref_query = '''
+            INSERT OR REPLACE INTO cdc_unchanged_refs (batch_id, coin_id, vs_currency, ref_batch_id)
             VALUES (?, ?, ?, ?)
             '''
-            
-            # เตรียมข้อมูลสำหรับการทำ รูปแบบ List of Tuples
-            rows_to_insert = [
-                (item.get('id'), json.dumps(item), extracted_at, batch_id)
-                for item in data
-            ]
-
-            # ดำเนินการ Insert ข้อมูลปริมาณมากภายในหนึ่ง Transaction
-            with sqlite3.connect(self.db_path) as conn:
-                conn.executemany(insert_query, rows_to_insert)
-                conn.commit()
+            # ลายนิ้วมือใหม่รอใน cdc_pending_fingerprints และมีผลเมื่อ Batch ถูกบันทึกว่า 'loaded' (ดู ChangeTracker.promote)
+            upsert_fingerprint_query = '''
+            INSERT OR REPLACE INTO cdc_pending_fingerprints
+            (batch_id, coin_id, vs_currency, fingerprint, last_updated)
+            VALUES (?, ?, ?, ?, ?)
+            '''
+
+            if known is None and settings.CDC_ENABLED:
+                known = self.change_tracker.load()
+            rows = self._iter_staging_rows(currency_pages, extracted_at, batch_id, known)
+            total = 0
+            written = 0
+            # จับเวลาเฉพาะช่วงเขียนฐานข้อมูล (แยกออกจากเวลาที่รอข้อมูลจาก API ซึ่งไหลเข้ามาแบบ Stream)
+            write_wall = 0.0
+            write_cpu = 0.0
+
+            # ดำเนินการ Insert ทีละก้อนภายในหนึ่ง Transaction: หากหน้าใดล้มเหลวจะ Rollback ทั้ง Batch
+            # (Backend SQLite ใช้ Connection เดียวกับตารางสถานะ ส่วน Backend อื่นถูก Commit ก่อนตารางสถานะ
+            # หาก Commit ของ Backend ล้มเหลว Ledger จะไม่ถูกบันทึก และการรันซ้ำด้วย replace=True เขียนทับได้)
+            conn = self.db.connection()
+            with conn, self.backend.staging_writer(batch_id, replace=replace) as writer:
+                if replace:
+                    conn.execute('DELETE FROM cdc_unchanged_refs WHERE batch_id = ?', (batch_id,))
+                    conn.execute('DELETE FROM cdc_pending_fingerprints WHERE batch_id = ?', (batch_id,))
+                while True:
+                    chunk = list(islice(rows, chunk_size))
+                    if not chunk:
+                        break
+                    wall_start, cpu_start = time.perf_counter(), time.process_time()
+                    staged = [row for row, _, _, _ in chunk if row is not None]
+                    writer.write(staged, [meta for _, meta, _, _ in chunk if meta is not None])
+                    if known is not None:
+                        conn.executemany(insert_ref_query, [ref for _, _, ref, _ in chunk if ref is not None])
+                        conn.executemany(upsert_fingerprint_query, [fp for _, _, _, fp in chunk if fp is not None])
+                    write_wall += time.perf_counter() - wall_start
+                    write_cpu += time.process_time() - cpu_start
+                    total += len(chunk)
+                    written += len(staged)
+                # บันทึกสถานะใน Ledger ภายใน Transaction เดียวกัน: Batch จะถูกนับว่า 'staged' ก็ต่อเมื่อข้อมูลถูก Commit จริง
+                if total:
+                    self.ledger.mark(batch_id, 'staged', row_count=total, conn=conn)
                 # บันทึกสถานะการโหลดข้อมูลสำเร็จ 
-                logger.info(f"Successfully loaded {len(rows_to_insert)} records to Staging (Batch: {batch_id})")
+                logger.info("Successfully loaded %s records to Staging (Batch: %s)", written, batch_id)
+                if known is not None:
+                    logger.info("CDC: %s unchanged records stored as references (Batch: %s)", total - written, batch_id)
+
+            record_stage('stage', batch_id, wall_seconds=write_wall, cpu_seconds=write_cpu,
+                         rows_in=total, rows_out=written)
 
             # ส่งค่า batch_id กลับไปเพื่อให้ขั้นตอน Transform ใช้งานต่อได้ถูกต้อง
-            return batch_id
+            return batch_id, total
 
         except Exception as e:
-            logger.error(f"Load to staging failed: {str(e)}")
-            raise
\ No newline at end of file
+            logger.error("Load to staging failed: %s", e)
+            raise
+
+    @staticmethod
+    def _iter_staging_rows(currency_pages: Iterable[Tuple[str, List[Dict[str, Any]]]], extracted_at: str,
+                           batch_id: str, known: Optional[Fingerprints] = None) -> Iterator[Tuple]:
+        """
+        แปลงข้อมูลแต่ละรายการเป็นแถวของ Staging แบบ Lazy (ไม่สร้าง List ทั้งก้อน)
+        คืนค่า (แถวราคา, แถว Meta, แถวอ้างอิง, แถวลายนิ้วมือ) โดยช่องที่ไม่ต้องเขียนเป็น None:
+        - แถว Meta เป็น None หากเหรียญนี้ถูกบันทึก Meta ไปแล้วใน Batch นี้
+        - ในโหมด CDC (known ไม่เป็น None) แถวที่ไม่เปลี่ยนมีเพียงแถวอ้างอิง ส่วนแถวที่เปลี่ยนมีแถวลายนิ้วมือใหม่
+
+        (เหรียญ, สกุลเงิน) ที่ซ้ำกันใน Batch ถูกเก็บเพียงแถวแรก: หน้าที่เรียงตาม market_cap_desc ถูกดึงพร้อมกันตาม Offset
+        อันดับที่ขยับระหว่างคำขอจึงทำให้เหรียญเดียวกันโผล่ในสองหน้าติดกันได้ (แถวซ้ำจะทำให้กฎ unique ของ DQ ไม่ผ่านทั้ง Batch)
+        """
+        seen = set()
+        seen_pairs = set()
+        overlapped = 0
+        for vs_currency, page in currency_pages:
+            for item in page:
+                coin_id = item.get('id')
+                if coin_id is None:
+                    # ไม่มีกุญแจให้ผูก Meta: เก็บทั้งก้อนไว้ในแถวราคาเหมือนเดิม
+                    yield (coin_id, json.dumps(item), extracted_at, batch_id, vs_currency), None, None, None
+                    continue
+                if (coin_id, vs_currency) in seen_pairs:
+                    overlapped += 1
+                    continue
+                seen_pairs.add((coin_id, vs_currency))
+
+                fingerprint_row = None
+                if known is not None:
+                    fingerprint = ChangeTracker.fingerprint(item)
+                    ref_batch_id = ChangeTracker.unchanged_ref(known, coin_id, vs_currency, fingerprint, batch_id)
+                    if ref_batch_id is not None:
+                        yield None, None, (batch_id, coin_id, vs_currency, ref_batch_id), None
+                        continue
+                    fingerprint_row = ChangeTracker.fingerprint_row(coin_id, vs_currency, fingerprint, item, batch_id)
+
+                price_part = {key: value for key, value in item.items() if key not in META_FIELDS}
+                meta = None
+                if coin_id not in seen:
+                    seen.add(coin_id)
+                    meta_part = {key: item[key] for key in META_FIELDS if key in item}
+                    if meta_part:
+                        meta = (batch_id, coin_id, json.dumps(meta_part))
+                yield (coin_id, json.dumps(price_part), extracted_at, batch_id, vs_currency), meta, None, fingerprint_row
+
+        if overlapped:
+            logger.warning("Dropped %s duplicate coin/currency rows that overlapped between pages (Batch: %s)",
+                           overlapped, batch_id)
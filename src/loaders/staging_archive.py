@@ -0,0 +1,158 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+from config.settings import settings
+from src.loaders.backends import require_sqlite_backend
+from src.loaders.batch_ledger import BatchLedger
+from src.utils.database import get_database, resolve_db_path
+from src.utils.logger import logger
+
+# คอลัมน์ของแต่ละบรรทัดใน Segment (raw_data เป็น JSON ที่ประกอบ Meta กลับเข้าไปแล้ว จึงอ่านได้โดยไม่ต้องพึ่ง stg_coin_meta)
+_ARCHIVE_FIELDS = ('batch_id', 'coin_id', 'vs_currency', 'extracted_at', 'raw_data')
+
+
+class StagingArchive:
+    """
+    นโยบายการเก็บรักษา (Retention) ของ stg_crypto_markets: Batch ที่เก่ากว่า N วันถูกรวมเป็น Segment รายวัน
+    แบบ JSON Lines บีบอัดด้วย gzip (stg_YYYYMMDD.jsonl.gz) แล้วลบออกจากตาราง และคืนพื้นที่ด้วย Incremental Vacuum
+    ทำให้ขนาดไฟล์ SQLite และต้นทุนการ Scan ขึ้นกับช่วง Retention ไม่ใช่อายุของระบบ
+
+    Segment อ่านกลับได้ทีละ Batch แบบ Stream ผ่าน iter_batches() ในรูปแบบแถวเดียวกับที่ CryptoTransformer รับจาก Staging
+    """
+
+    def __init__(self, db_path: str = None, archive_dir: str = None):
+        if db_path is None:
+            require_sqlite_backend('Staging compaction')
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+        self.archive_dir = Path(archive_dir or settings.STAGING_ARCHIVE_DIR)
+
+    def segment_path(self, day: str) -> Path:
+        """ ที่อยู่ของ Segment ของวัน (day อยู่ในรูป YYYYmmdd ตามส่วนหน้าของ batch_id) """
+        return self.archive_dir / f'stg_{day}.jsonl.gz'
+
+    def eligible_batches(self, retention_days: int = None, now: datetime = None) -> List[str]:
+        """
+        Batch ที่เก่ากว่าช่วง Retention และประมวลผลเสร็จแล้ว
+        (Batch ที่ยังค้างอยู่ใน Ledger จะถูกเก็บไว้ใน Staging เพื่อให้โหมด Incremental ทำต่อได้)
+        """
+        retention_days = settings.STAGING_RETENTION_DAYS if retention_days is None else retention_days
+        cutoff = ((now or datetime.now()) - timedelta(days=retention_days)).strftime('%Y%m%d_000000')
+        rows = self.db.connection().execute(
+            'SELECT DISTINCT batch_id FROM stg_crypto_markets WHERE batch_id < ? ORDER BY batch_id', (cutoff,)
+        ).fetchall()
+        pending = set(BatchLedger(self.db_path).pending_batches())
+        return [row[0] for row in rows if row[0] not in pending]
+
+    def compact(self, retention_days: int = None, now: datetime = None) -> Dict[str, int]:
+        """
+        ย้าย Batch ที่หมดช่วง Retention ไปยัง Segment รายวัน แล้วลบออกจาก Staging
+
+        ลำดับการทำงานทนต่อการล้มกลางทาง: Segment ถูกเขียนเป็นไฟล์ชั่วคราวแล้วเปลี่ยนชื่อก่อน
+        จากนั้นจึงลบแถวใน Transaction เดียว การรันซ้ำจะเขียนแถวของ Batch เดิมทับใน Segment (ไม่เกิดแถวซ้ำ)
+
+        Returns:
+            Dict[str, int]: จำนวน Batch, แถว, Segment ที่ถูกเขียน และจำนวนหน้าที่คืนให้ระบบไฟล์
+        """
+        batch_ids = self.eligible_batches(retention_days, now)
+        if not batch_ids:
+            logger.info('Staging compaction: no batches older than the retention window.')
+            return {'batches': 0, 'rows': 0, 'segments': 0, 'freed_pages': 0}
+
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        rows_archived = 0
+        segments = 0
+        for day, day_batches in groupby(batch_ids, key=lambda batch_id: batch_id[:8]):
+            day_batches = list(day_batches)
+            rows_archived += self._write_segment(day, day_batches)
+            segments += 1
+
+        conn = self.db.connection()
+        with conn:
+            for start in range(0, len(batch_ids), 500):
+                chunk = batch_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                conn.execute(f'DELETE FROM stg_crypto_markets WHERE batch_id IN ({placeholders})', chunk)
+                conn.execute(f'DELETE FROM stg_coin_meta WHERE batch_id IN ({placeholders})', chunk)
+        freed_pages = self._reclaim_space()
+
+        logger.info(
+            'Staging compaction: archived %s rows from %s batches into %s segments (%s pages freed).',
+            rows_archived, len(batch_ids), segments, freed_pages
+        )
+        return {'batches': len(batch_ids), 'rows': rows_archived, 'segments': segments, 'freed_pages': freed_pages}
+
+    def _write_segment(self, day: str, batch_ids: List[str]) -> int:
+        """ เขียน Segment ของวันใหม่ทั้งไฟล์: แถวเดิมของ Batch อื่นในวันนั้นคงไว้ แถวของ Batch ที่กำลังย้ายมาแทนที่ของเดิม """
+        path = self.segment_path(day)
+        tmp_path = path.with_name(path.name + '.tmp')
+        replacing = set(batch_ids)
+        placeholders = ','.join('?' * len(batch_ids))
+        cursor = self.db.connection().execute(
+            f'SELECT {", ".join(_ARCHIVE_FIELDS)} FROM v_stg_crypto_markets '
+            f'WHERE batch_id IN ({placeholders}) ORDER BY batch_id, id',
+            batch_ids
+        )
+
+        written = 0
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            if path.exists():
+                for line in self._iter_lines(path):
+                    if json.loads(line)['batch_id'] not in replacing:
+                        f.write(line)
+            for row in cursor:
+                f.write(json.dumps(dict(zip(_ARCHIVE_FIELDS, row)), ensure_ascii=False))
+                f.write('\n')
+                written += 1
+        os.replace(tmp_path, path)
+        return written
+
+    def _reclaim_space(self) -> int:
+        """
+        คืนพื้นที่ว่างด้วย Incremental Vacuum (ไม่ล็อกฐานข้อมูลนานเท่า VACUUM ทั้งไฟล์)
+        ไฟล์ที่สร้างก่อนเปิด auto_vacuum=INCREMENTAL ต้อง VACUUM เต็มหนึ่งครั้งเพื่อเปลี่ยนโหมด
+        """
+        conn = self.db.connection()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            logger.info('Switching %s to incremental auto-vacuum (one-time full VACUUM).', self.db_path)
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.execute('PRAGMA incremental_vacuum').fetchall()
+        return free_pages
+
+    @staticmethod
+    def _iter_lines(path: Path) -> Iterator[str]:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            yield from f
+
+    def iter_batches(self, days: Iterable[str] = None,
+                     batch_ids: Iterable[str] = None) -> Iterator[Tuple[str, List[Tuple[str, str]]]]:
+        """
+        อ่าน Batch ที่ถูกเก็บถาวรกลับมาทีละ Batch แบบ Stream (หน่วยความจำเท่าขนาดของหนึ่ง Batch)
+
+        Args:
+            days (Iterable[str], optional): วันที่ต้องการ (YYYYmmdd) ค่าเริ่มต้นคือทุก Segment
+            batch_ids (Iterable[str], optional): เลือกเฉพาะ Batch เหล่านี้
+
+        Yields:
+            Tuple[str, List[Tuple[str, str]]]: batch_id และแถว (raw_data, vs_currency) สำหรับ CryptoTransformer
+        """
+        wanted = set(batch_ids) if batch_ids is not None else None
+        if days is None:
+            paths = sorted(self.archive_dir.glob('stg_*.jsonl.gz'))
+        else:
+            paths = [self.segment_path(day) for day in sorted(set(days))]
+
+        for path in paths:
+            if not path.exists():
+                continue
+            records = (json.loads(line) for line in self._iter_lines(path))
+            for batch_id, batch_records in groupby(records, key=lambda record: record['batch_id']):
+                if wanted is not None and batch_id not in wanted:
+                    continue
+                yield batch_id, [(record['raw_data'], record['vs_currency']) for record in batch_records]
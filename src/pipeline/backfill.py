@@ -0,0 +1,213 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from config.settings import settings
+from src.extractors.coingecko import CoingeckoClient
+from src.loaders.backends import SQLiteBackend, StorageBackend, get_backend
+from src.loaders.parquet_mirror import ParquetMirror
+from src.loaders.rollups import MarketRollups
+from src.utils.database import get_database, resolve_db_path
+from src.utils.logger import logger
+from src.utils.metrics import track_stage
+
+# งานหนึ่งหน่วยของ Backfill: (coin_id, vs_currency, range_start, range_end) เป็น UNIX Timestamp (วินาที)
+BackfillTask = Tuple[str, str, int, int]
+
+_CHECKPOINT_UPSERT = '''
+INSERT OR REPLACE INTO backfill_progress
+(coin_id, vs_currency, range_start, range_end, status, row_count, error, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def _to_timestamp(value: date) -> int:
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+class HistoricalBackfill:
+    """
+    ดึงอนุกรมเวลาย้อนหลัง (ราคา / มูลค่าตลาด / วอลลุ่ม) ของแต่ละเหรียญจาก /coins/{id}/market_chart/range
+    แล้วบันทึกลง fct_crypto_prices เพื่อให้ระบบที่เพิ่งติดตั้งมีประวัติตั้งแต่วันแรก
+
+    - ช่วงวันที่ถูกแบ่งเป็นหน้าต่างขนาด BACKFILL_WINDOW_DAYS และแต่ละ (เหรียญ, สกุลเงิน, หน้าต่าง) คือหนึ่งงาน
+    - งานถูกดึงพร้อมกันด้วย Thread Pool ภายใต้ Rate Limiter ของ Client และเขียนลงฐานข้อมูลเป็นก้อนโดย Writer เดียว
+    - ข้อมูลถูกเขียนผ่าน StorageBackend ที่ใช้งานอยู่ (SQLite / PostgreSQL) เช่นเดียวกับการโหลดปกติ
+    - Checkpoint ของแต่ละงานถูก Commit พร้อมข้อมูล (ตาราง backfill_progress ผ่าน on_commit ของ upsert_facts)
+      การรันซ้ำด้วยช่วงวันที่เดิมจึงข้ามงานที่เสร็จแล้ว และทำต่อเฉพาะงานที่ค้างหรือล้มเหลว
+    """
+
+    def __init__(self, db_path: str = None, client: CoingeckoClient = None, workers: int = None,
+                 window_days: int = None, write_rows: int = None, backend: StorageBackend = None):
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+        self.backend = backend or (SQLiteBackend(self.db) if db_path else get_backend())
+        self.rollups = MarketRollups(self.db_path)
+        self.client = client or CoingeckoClient()
+        self.workers = workers or settings.BACKFILL_WORKERS
+        self.window_days = window_days or settings.BACKFILL_WINDOW_DAYS
+        self.write_rows = write_rows or settings.BACKFILL_WRITE_ROWS
+
+    def plan(self, coin_ids: Iterable[str], start: date, end: date,
+             vs_currencies: Iterable[str] = None) -> List[BackfillTask]:
+        """ แบ่งงานตามเหรียญ × สกุลเงิน × หน้าต่างเวลา (ช่วงสุดท้ายถูกตัดที่ end) """
+        start_ts, end_ts = _to_timestamp(start), _to_timestamp(end)
+        step = self.window_days * 86400
+        windows = [(ts, min(ts + step, end_ts)) for ts in range(start_ts, end_ts, step)]
+        return [
+            (coin_id, vs_currency, range_start, range_end)
+            for coin_id in coin_ids
+            for vs_currency in (vs_currencies or settings.VS_CURRENCIES)
+            for range_start, range_end in windows
+        ]
+
+    def completed(self) -> Set[BackfillTask]:
+        """ งานที่ถูก Checkpoint ว่าเสร็จแล้ว """
+        rows = self.db.connection().execute(
+            "SELECT coin_id, vs_currency, range_start, range_end FROM backfill_progress WHERE status = 'done'"
+        )
+        return {tuple(row) for row in rows}
+
+    def default_coins(self) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        """
+        ค่าเริ่มต้นของรายชื่อเหรียญ: Top N ตามมูลค่าตลาดปัจจุบัน (N = settings.BATCH_SIZE)
+        คืน coin_id -> (symbol, name) ตามลำดับมูลค่าตลาด จากหน้า /coins/markets เดียวกัน
+        """
+        page = next(self.client.iter_market_pages(per_page=settings.BATCH_SIZE, max_pages=1), [])
+        return {item['id']: (item.get('symbol'), item.get('name')) for item in page if item.get('id')}
+
+    def run(self, start: date, end: date, coin_ids: Iterable[str] = None,
+            vs_currencies: Iterable[str] = None) -> Dict[str, int]:
+        """
+        ดึงข้อมูลย้อนหลังในช่วง [start, end) ของเหรียญที่ระบุ (ค่าเริ่มต้น: Top N ปัจจุบัน)
+
+        Returns:
+            Dict[str, int]: จำนวนงานทั้งหมด / ที่ข้าม (เสร็จแล้ว) / สำเร็จ / ล้มเหลว และจำนวนแถวที่บันทึก
+        """
+        market = {} if coin_ids else self.default_coins()
+        coin_ids = list(coin_ids) if coin_ids else list(market)
+        tasks = self.plan(coin_ids, start, end, vs_currencies)
+        done = self.completed()
+        todo = [task for task in tasks if task not in done]
+        # market_chart ไม่มี symbol / name: ใช้จากหน้า /coins/markets (ระบบที่เพิ่งติดตั้ง) หรือจาก Fact Table
+        names = market or self._coin_names(coin_ids)
+        summary = {'tasks': len(tasks), 'skipped': len(tasks) - len(todo), 'succeeded': 0, 'failed': 0, 'rows': 0}
+        logger.info(
+            'Backfill %s..%s: %s coins, %s tasks (%s already done, Workers: %s)',
+            start, end, len(coin_ids), len(tasks), summary['skipped'], self.workers
+        )
+
+        rows: List[Tuple] = []
+        checkpoints: List[Tuple] = []
+        with track_stage('backfill') as stage_metrics, ThreadPoolExecutor(max_workers=self.workers) as pool:
+            queue = iter(todo)
+            futures: Dict[Future, BackfillTask] = {}
+            try:
+                while True:
+                    # เติมงานเข้า Pool แบบหน้าต่างเลื่อน เพื่อไม่ให้ผลลัพธ์ค้างอยู่ในหน่วยความจำพร้อมกันทั้งหมด
+                    while len(futures) < self.workers * 2:
+                        task = next(queue, None)
+                        if task is None:
+                            break
+                        futures[pool.submit(self.client.get_market_chart_range, *task)] = task
+                    if not futures:
+                        break
+
+                    finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        task = futures.pop(future)
+                        now = datetime.now().isoformat()
+                        try:
+                            points = self._points(task, future.result(), names.get(task[0], (None, None)))
+                        except Exception as e:
+                            logger.error('Backfill failed for %s/%s [%s, %s): %s', *task, e)
+                            checkpoints.append(task + ('failed', 0, str(e), now))
+                            summary['failed'] += 1
+                            continue
+                        rows.extend(points)
+                        checkpoints.append(task + ('done', len(points), None, now))
+                        summary['succeeded'] += 1
+
+                    if len(rows) >= self.write_rows:
+                        summary['rows'] += self._flush(rows, checkpoints)
+            finally:
+                # บันทึกงานที่เสร็จแล้วเสมอ แม้จะถูกขัดจังหวะ เพื่อให้การรันครั้งถัดไปทำต่อได้
+                for future in futures:
+                    future.cancel()
+                summary['rows'] += self._flush(rows, checkpoints)
+                stage_metrics.rows_in = len(todo)
+                stage_metrics.rows_out = summary['rows']
+                stage_metrics.bytes_fetched = self.client.bytes_fetched
+                stage_metrics.retries = self.client.retry_count
+
+        # หนึ่ง batch_id ต่อจุดเวลาถูกกระจายอยู่หลายรอบการเขียน จึงสร้าง Partition ของช่วงวันใหม่ทั้งหมดครั้งเดียวตอนจบ
+        if summary['rows'] and settings.PARQUET_MIRROR_ENABLED:
+            ParquetMirror().export_committed(start, end, db_path=self.db_path)
+
+        logger.info(
+            'Backfill finished: %s rows written, %s tasks succeeded, %s failed, %s skipped.',
+            summary['rows'], summary['succeeded'], summary['failed'], summary['skipped']
+        )
+        return summary
+
+    def _flush(self, rows: List[Tuple], checkpoints: List[Tuple]) -> int:
+        """ เขียนข้อมูลและ Checkpoint ของงานที่เสร็จแล้ว (พร้อมตารางสรุป) ผ่าน StorageBackend แล้วล้าง Buffer """
+        if not rows and not checkpoints:
+            return 0
+
+        def finalize(conn):
+            self.rollups.apply(rows, conn=conn)
+            conn.executemany(_CHECKPOINT_UPSERT, checkpoints)
+
+        if rows:
+            written = self.backend.upsert_facts(rows, on_commit=finalize)
+        else:
+            written = 0
+            conn = self.db.connection()
+            with conn:
+                finalize(conn)
+        rows.clear()
+        checkpoints.clear()
+        return written
+
+    @staticmethod
+    def _points(task: BackfillTask, chart: Dict[str, Any], name: Tuple[Optional[str], Optional[str]]) -> List[Tuple]:
+        """
+        รวมอนุกรม prices / market_caps / total_volumes ตาม Timestamp เป็นแถวของ Fact Table
+        (ใช้กฎเดียวกับการ Transform ปกติ: เก็บเฉพาะจุดที่ราคาและวอลลุ่ม > 0)
+        batch_id ของแต่ละจุดคือเวลาของจุดนั้น (UTC) ในรูปแบบเดียวกับ batch_id ของการรันปกติ
+        """
+        coin_id, vs_currency = task[0], task[1]
+        symbol, coin_name = name
+        market_caps = {int(ts): value for ts, value in chart.get('market_caps') or []}
+        volumes = {int(ts): value for ts, value in chart.get('total_volumes') or []}
+        points = []
+        for ts, price in chart.get('prices') or []:
+            ts = int(ts)
+            volume = volumes.get(ts)
+            if not isinstance(price, (int, float)) or not isinstance(volume, (int, float)) or price <= 0 or volume <= 0:
+                continue
+            moment = datetime.fromtimestamp(ts / 1000, tz=timezone.utc)
+            points.append((
+                moment.strftime('%Y%m%d_%H%M%S'), coin_id, symbol, coin_name, price, market_caps.get(ts), volume,
+                moment.isoformat(), vs_currency
+            ))
+        return points
+
+    def _coin_names(self, coin_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+        """ symbol / name ล่าสุดของแต่ละเหรียญจาก Fact Table (ไม่มีใน market_chart) """
+        names = {}
+        conn = self.db.connection()
+        for start in range(0, len(coin_ids), 500):
+            chunk = coin_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for coin_id, symbol, name in conn.execute(
+                f'SELECT coin_id, symbol, name FROM fct_crypto_prices WHERE coin_id IN ({placeholders}) '
+                f'AND name IS NOT NULL GROUP BY coin_id HAVING last_updated_at = MAX(last_updated_at)',
+                chunk
+            ):
+                names[coin_id] = (symbol, name)
+        return names
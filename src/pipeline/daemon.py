@@ -0,0 +1,269 @@
+import queue
+import signal
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+from config.settings import settings
+from src.extractors.coingecko import CoingeckoClient
+from src.loaders.batch_ledger import BatchLedger
+from src.loaders.change_tracker import ChangeTracker, Fingerprints
+from src.loaders.sqlite_loader import SQLiteLoader
+from src.pipeline.stages import DataQualityError, new_batch_id
+from src.quality.anomaly import AnomalyDetector
+from src.quality.data_quality import DataqualityValidator
+from src.transformers.crypto_transformer import CryptoTransformer
+from src.utils.logger import log_context, logger
+
+# กุญแจของสถานะล่าสุด: (coin_id, vs_currency)
+StateKey = Tuple[str, str]
+# Micro-batch หนึ่งก้อน: ภาพรวมของรอบล่าสุด ทุกเหรียญ -> (ลายนิ้วมือ, ข้อมูลดิบล่าสุด)
+Changes = Dict[StateKey, Tuple[str, Dict[str, Any]]]
+
+_STOP = object()
+
+
+class PollingDaemon:
+    """
+    โหมดทำงานต่อเนื่อง (Long-running): ดึง /coins/markets ทุก POLL_INTERVAL_SECONDS และเก็บสถานะล่าสุดของทุกเหรียญ
+    ไว้ในหน่วยความจำ แล้วส่งเฉพาะเหรียญที่ข้อมูลเปลี่ยนเข้า Transform -> DQ -> Load เป็น Micro-batch ขนาดเล็ก
+    (เหรียญที่ไม่เปลี่ยนถูกบันทึกเป็นการอ้างอิงใน cdc_unchanged_refs เหมือนโหมด CDC ของการรันปกติ
+    ทุก Micro-batch จึงมีภาพรวมครบทุกเหรียญใน v_fct_crypto_prices_snapshot)
+
+    - Client / Loader / Transformer / Validator ถูกสร้างครั้งเดียว: Session ของ HTTP และ Connection ของ SQLite
+      (หนึ่งเส้นต่อ Thread ของ Writer) ถูกใช้ซ้ำตลอดอายุ Process ไม่ต้องจ่ายค่าเริ่มต้นทุกรอบเหมือน run_pipeline
+    - Thread ดึงข้อมูลกับ Thread เขียนแยกกันผ่านคิวที่มีขนาดจำกัด หากคิวเต็ม (เขียนไม่ทัน) ภาพรวมที่ค้างอยู่จะถูก
+      แทนด้วยภาพรวมของรอบถัดไป (เวอร์ชันล่าสุดต่อเหรียญ) หน่วยความจำจึงไม่เกินจำนวนเหรียญ × สกุลเงิน ต่อช่องของคิว
+    - ลายนิ้วมือของเวอร์ชันที่โหลดสำเร็จถูกย้ายเข้า cdc_coin_fingerprints พร้อมสถานะ 'loaded' ใน Ledger
+      การเริ่ม Daemon ใหม่จึงไม่ส่งข้อมูลที่ไม่เปลี่ยนซ้ำ
+    - SIGINT / SIGTERM: หยุดรับรอบใหม่ เขียนการเปลี่ยนแปลงที่ค้างอยู่ให้หมด แล้วจึงจบการทำงาน
+    """
+
+    def __init__(self, interval: float = None, queue_size: int = None, client: CoingeckoClient = None):
+        self.interval = settings.POLL_INTERVAL_SECONDS if interval is None else interval
+        self.client = client or CoingeckoClient()
+        # ทุกรอบต้องได้ข้อมูลสดจาก API (ไม่อ่านจากแคชของคำขอ)
+        self.client.cache = None
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size or settings.DAEMON_QUEUE_SIZE)
+        self.stop_event = threading.Event()
+
+        # สถานะล่าสุดที่เห็นจาก API (ฝั่ง Poller) และเวอร์ชันที่บันทึกลงฐานข้อมูลแล้ว (ฝั่ง Writer)
+        self.latest: Dict[StateKey, Dict[str, Any]] = {}
+        self._seen: Dict[StateKey, str] = {}
+        self._persisted: Fingerprints = ChangeTracker().load()
+        self._seen.update((key, fingerprint) for key, (fingerprint, _) in self._persisted.items())
+        self._pending: Changes = {}
+        # เหรียญที่เขียนไม่สำเร็จ: Poller ลืมสถานะของเหรียญเหล่านี้เพื่อส่งใหม่ในรอบถัดไป
+        self._invalidated: Set[StateKey] = set()
+        self._lock = threading.Lock()
+        self._last_batch_id: Optional[str] = None
+        self.stats = {'polls': 0, 'changed': 0, 'micro_batches': 0, 'rows_loaded': 0, 'coalesced': 0, 'failed': 0}
+
+    def latest_state(self, coin_id: str, vs_currency: str = 'usd') -> Optional[Dict[str, Any]]:
+        """ ข้อมูลดิบล่าสุดของเหรียญที่ Daemon เห็น (ไม่ต้องอ่านจากฐานข้อมูล) """
+        return self.latest.get((coin_id, vs_currency))
+
+    # ---------------------------------------------------------------- Poller
+
+    def poll_once(self) -> int:
+        """
+        ดึงข้อมูลหนึ่งรอบ เทียบกับสถานะในหน่วยความจำ และส่งเหรียญที่เปลี่ยนให้ Writer
+
+        Returns:
+            int: จำนวน (เหรียญ, สกุลเงิน) ที่เปลี่ยนในรอบนี้
+        """
+        with self._lock:
+            invalidated, self._invalidated = self._invalidated, set()
+        for key in invalidated:
+            self._seen.pop(key, None)
+
+        if settings.FULL_MARKET_EXTRACT:
+            pages = self.client.iter_currency_pages(settings.VS_CURRENCIES, max_pages=settings.MAX_PAGES)
+        else:
+            pages = self.client.iter_currency_pages(settings.VS_CURRENCIES, per_page=settings.BATCH_SIZE, max_pages=1)
+
+        changed = 0
+        snapshot: Changes = {}
+        for vs_currency, items in pages:
+            for item in items:
+                coin_id = item.get('id')
+                if coin_id is None:
+                    continue
+                key = (coin_id, vs_currency)
+                fingerprint = ChangeTracker.fingerprint(item)
+                self.latest[key] = item
+                snapshot[key] = (fingerprint, item)
+                if self._seen.get(key) != fingerprint:
+                    self._seen[key] = fingerprint
+                    changed += 1
+
+        # ภาพรวมใหม่แทนของเดิมที่ยังไม่ถูกส่ง (Writer เทียบกับลายนิ้วมือที่โหลดแล้วเองว่าเหรียญใดเปลี่ยน)
+        if changed or self._pending:
+            self._pending = snapshot
+        self.stats['polls'] += 1
+        self.stats['changed'] += changed
+        self._offer()
+        return changed
+
+    def _offer(self):
+        """ ส่งภาพรวมที่ค้างอยู่เข้าคิวโดยไม่รอ หากคิวเต็มให้แทนด้วยภาพรวมของรอบถัดไป (Backpressure) """
+        if not self._pending:
+            return
+        try:
+            self.queue.put_nowait(self._pending)
+        except queue.Full:
+            self.stats['coalesced'] += 1
+            logger.warning(
+                'Daemon: Writer is behind (%s micro-batches queued). Coalescing %s changed coins into the next poll.',
+                self.queue.qsize(), len(self._pending)
+            )
+            return
+        self._pending = {}
+
+    # ---------------------------------------------------------------- Writer
+
+    def _writer_loop(self):
+        # สร้าง Component ใน Thread ของ Writer: Connection ของ SQLite ผูกกับ Thread นี้และถูกใช้ซ้ำทุก Micro-batch
+        self.loader = SQLiteLoader()
+        self.transformer = CryptoTransformer()
+        self.validator = DataqualityValidator()
+        self.detector = AnomalyDetector() if settings.ANOMALY_DETECTION_ENABLED else None
+        self.ledger = BatchLedger()
+        while True:
+            changes = self.queue.get()
+            if changes is _STOP:
+                break
+            try:
+                self.write(changes)
+            except Exception as e:
+                logger.error('Daemon: Unexpected writer error: %s', e)
+
+    def _next_batch_id(self) -> str:
+        # Micro-batch อาจเกิดถี่กว่าหนึ่งครั้งต่อวินาที: รอจนได้ batch_id ที่ใหม่กว่าครั้งก่อน (ลำดับของ Watermark)
+        batch_id = new_batch_id()
+        while self._last_batch_id is not None and batch_id <= self._last_batch_id:
+            time.sleep(0.05)
+            batch_id = new_batch_id()
+        self._last_batch_id = batch_id
+        return batch_id
+
+    def write(self, changes: Changes) -> bool:
+        """
+        เขียน Micro-batch หนึ่งก้อน: Staging (พร้อมลายนิ้วมือ) -> Transform -> DQ -> Load Core และบันทึก Ledger ทุกขั้น
+        เฉพาะเหรียญที่ต่างจากเวอร์ชันที่โหลดแล้วถูกเขียนลง Staging เหรียญที่เหลือในภาพรวมถูกบันทึกเป็นการอ้างอิง
+        หากล้มเหลวหลังเขียน Staging แล้ว Batch จะค้างใน Ledger และทำต่อได้ด้วย `python main.py incremental`
+
+        Returns:
+            bool: True หาก Micro-batch ถูกโหลดเข้า Core สำเร็จ
+        """
+        batch_id = self._next_batch_id()
+        pages: Dict[str, List[Dict[str, Any]]] = {}
+        for (_, vs_currency), (_, item) in changes.items():
+            pages.setdefault(vs_currency, []).append(item)
+        changed = [key for key, (fingerprint, _) in changes.items()
+                   if self._persisted.get(key, (None, None))[0] != fingerprint]
+
+        with log_context(batch_id=batch_id, stage='daemon'):
+            try:
+                self.loader.load_market_pages(pages.items(), batch_id=batch_id, known=self._persisted)
+            except Exception as e:
+                # Staging ถูก Rollback ทั้งก้อน: ให้ Poller ส่งเหรียญเหล่านี้ใหม่ในรอบถัดไป
+                with self._lock:
+                    self._invalidated.update(changed)
+                self.stats['failed'] += 1
+                logger.error('Daemon: Staging failed for micro-batch %s: %s', batch_id, e)
+                return False
+
+            loaded = self._process(batch_id)
+            self.stats['micro_batches'] += 1
+            if loaded is None:
+                self.stats['failed'] += 1
+                return False
+            # ลายนิ้วมือมีผลเมื่อ Batch โหลดสำเร็จเท่านั้น (ตรงกับ cdc_coin_fingerprints ที่ย้ายตอนบันทึก 'loaded')
+            for key in changed:
+                self._persisted[key] = (changes[key][0], batch_id)
+            self.stats['rows_loaded'] += loaded
+            logger.info('Daemon: Micro-batch %s loaded %s of %s changed coins.', batch_id, loaded, len(changed))
+            return True
+
+    def _process(self, batch_id: str) -> Optional[int]:
+        """ Transform -> DQ -> Load ของ Micro-batch (กฎเดียวกับ main.process_batch ยกเว้นการตรวจเหรียญที่หายไป) """
+        stage = 'transformed'
+        try:
+            cleaned_data = self.transformer.get_cleaned_data(batch_id=batch_id)
+            self.ledger.mark(batch_id, 'transformed', row_count=len(cleaned_data))
+
+            # Micro-batch ที่เหรียญที่เปลี่ยนทั้งหมดถูกคัดออก (เช่น วอลลุ่มเป็น 0) ไม่มีอะไรต้องตรวจหรือโหลด
+            if cleaned_data:
+                stage = 'validated'
+                if not self.validator.validate_market_data(cleaned_data):
+                    raise DataQualityError('Data Quality validation failed')
+                # Micro-batch มีเพียงเหรียญที่เปลี่ยน จึงไม่ตรวจเหรียญที่ "หายไป" จากรอบก่อน
+                if self.detector is not None:
+                    report = self.detector.check(cleaned_data, batch_id=batch_id, check_dropped=False)
+                    if report.has_anomalies and settings.ANOMALY_ACTION == 'fail':
+                        raise DataQualityError('Statistical anomaly check failed')
+                self.ledger.mark(batch_id, 'validated')
+
+                stage = 'loaded'
+
+                def finalize(conn):
+                    if self.detector is not None:
+                        self.detector.update(cleaned_data, batch_id=batch_id, conn=conn)
+                    self.ledger.mark(batch_id, 'loaded', row_count=len(cleaned_data), conn=conn)
+
+                self.transformer.save_to_core(cleaned_data, on_commit=finalize)
+            else:
+                self.ledger.mark(batch_id, 'loaded', row_count=0)
+            return len(cleaned_data)
+        except Exception as e:
+            self.ledger.mark(batch_id, stage, status='failed', error=str(e))
+            logger.error('Daemon: Micro-batch %s failed at stage %s: %s', batch_id, stage, e)
+            return None
+
+    # ---------------------------------------------------------------- Lifecycle
+
+    def stop(self, signum: int = None, frame: Any = None):
+        """ ขอให้ Daemon หยุดหลังรอบปัจจุบัน (ใช้เป็น Signal Handler ได้โดยตรง) """
+        if not self.stop_event.is_set():
+            logger.info('Daemon: Shutdown requested (signal %s). Finishing pending writes...', signum)
+        self.stop_event.set()
+
+    def run(self, max_polls: int = None) -> Dict[str, int]:
+        """
+        เริ่ม Daemon: วนดึงข้อมูลทุก interval วินาทีจนกว่าจะได้รับ SIGINT / SIGTERM (หรือครบ max_polls รอบ)
+
+        Returns:
+            Dict[str, int]: สถิติการทำงาน (จำนวนรอบ, เหรียญที่เปลี่ยน, Micro-batch, แถวที่โหลด, ครั้งที่รวมรอบ, ล้มเหลว)
+        """
+        # Signal Handler ติดตั้งได้เฉพาะใน Main Thread
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                handlers[signum] = signal.signal(signum, self.stop)
+
+        writer = threading.Thread(target=self._writer_loop, name='daemon-writer', daemon=True)
+        writer.start()
+        logger.info('--- Daemon started: polling every %ss (%s currencies) ---', self.interval, len(settings.VS_CURRENCIES))
+        try:
+            while not self.stop_event.is_set():
+                started = time.monotonic()
+                try:
+                    changed = self.poll_once()
+                    logger.info('Daemon: Poll %s found %s changed coins.', self.stats['polls'], changed)
+                except Exception as e:
+                    logger.error('Daemon: Poll failed: %s', e)
+                if max_polls is not None and self.stats['polls'] >= max_polls:
+                    break
+                self.stop_event.wait(max(self.interval - (time.monotonic() - started), 0))
+        finally:
+            # ส่งการเปลี่ยนแปลงที่ค้างอยู่ให้ Writer (รอได้) แล้วรอให้ Writer เขียนคิวจนหมดก่อนจบ
+            if self._pending:
+                self.queue.put(self._pending)
+                self._pending = {}
+            self.queue.put(_STOP)
+            writer.join()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        logger.info('--- Daemon stopped: %s ---', self.stats)
+        return dict(self.stats)
@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple, Union
+from config.settings import settings
+from src.extractors.coingecko import CoingeckoClient
+from src.extractors.rate_limiter import TokenBucket
+from src.loaders.batch_ledger import BatchLedger
+from src.loaders.change_tracker import ChangeTracker
+from src.loaders.sqlite_loader import SQLiteLoader
+from src.quality.anomaly import AnomalyDetector
+from src.quality.data_quality import DataqualityValidator
+from src.transformers.crypto_transformer import CryptoTransformer
+from src.transformers.records import MarketBatch
+from src.utils.database import get_database
+from src.utils.logger import log_context, logger
+from src.utils.metrics import PipelineMetrics, track_stage
+
+# คอลัมน์ของตารางพัก int_crypto_prices (ลำดับเดียวกับ fct_crypto_prices และ Tuple ที่ได้จากการ Transform)
+_INT_COLUMNS = 'batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, vs_currency'
+
+
+class DataQualityError(Exception):
+    """ Batch ไม่ผ่านการตรวจคุณภาพข้อมูล (DQ หรือการตรวจค่าผิดปกติในโหมด fail) """
+
+
+def new_batch_id() -> str:
+    """ สร้างรหัส Batch สำหรับหนึ่งรอบของ DAG (รูปแบบเดียวกับ Loader เพื่อให้ Watermark เรียงลำดับได้) """
+    return datetime.now().strftime('%Y%m%d_%H%M%S')
+
+
+def plan_shards() -> List[Dict[str, Union[str, int]]]:
+    """
+    แบ่งงานดึงข้อมูลเป็น Shard สำหรับ Dynamic Task Mapping: ทุกสกุลเงินใน settings.VS_CURRENCIES × ชุดหน้า
+    Shard ที่ i ของแต่ละสกุลเงินรับผิดชอบหน้า i+1, i+1+n, i+1+2n, ... (แบ่งแบบสลับหน้า)
+    จึงไม่ต้องรู้จำนวนหน้าทั้งหมดล่วงหน้า โหมดดึงหน้าเดียว (FULL_MARKET_EXTRACT=False) มีหนึ่ง Shard ต่อสกุลเงิน
+    """
+    shard_count = max(settings.EXTRACT_SHARDS, 1) if settings.FULL_MARKET_EXTRACT else 1
+    return [
+        {'vs_currency': vs_currency, 'shard_index': i, 'shard_count': shard_count}
+        for vs_currency in settings.VS_CURRENCIES
+        for i in range(shard_count)
+    ]
+
+
+def _landing_dir(batch_id: str) -> Path:
+    return Path(settings.LANDING_DIR) / batch_id
+
+
+@contextmanager
+def _stage(name: str, batch_id: str, ledger_stage: str = None) -> Iterator[None]:
+    """
+    ครอบการทำงานของหนึ่งขั้นตอน: ผูกบริบท Log, วัดผลลงตาราง pipeline_metrics
+    และบันทึกสถานะ failed ลง Ledger ก่อนส่ง Exception ต่อให้ Airflow Retry เฉพาะขั้นนี้
+    """
+    metrics = PipelineMetrics(run_id=f'{batch_id}_{name}', trace_memory=settings.METRICS_TRACE_MEMORY)
+    with log_context(batch_id=batch_id, stage=name), metrics:
+        try:
+            yield
+        except Exception as e:
+            if ledger_stage is not None:
+                BatchLedger().mark(batch_id, ledger_stage, status='failed', error=str(e))
+            logger.error('Stage %s failed for batch %s: %s', name, batch_id, e)
+            raise
+        finally:
+            if settings.METRICS_ENABLED and metrics.stages:
+                try:
+                    metrics.save()
+                except Exception as e:
+                    logger.error('Failed to save stage metrics: %s', e)
+
+
+def extract_shard(batch_id: str, shard_index: int = 0, shard_count: int = 1, vs_currency: str = 'usd') -> int:
+    """
+    ขั้น extract: ดึงหน้าของ Shard นี้แล้วเขียนลงไฟล์พัก (Landing) แบบ JSON Lines หนึ่งบรรทัดต่อหนึ่งหน้า
+    ในรูปแบบ [vs_currency, items] เขียนลงไฟล์ชั่วคราวแล้วเปลี่ยนชื่อ ทำให้การ Retry เขียนทับได้
+    และขั้น stage ไม่เห็นไฟล์ที่เขียนไม่เสร็จ
+    Rate Limit และ Burst ของแต่ละ Shard ถูกหารตามจำนวน Shard ทั้งหมด (ทุกสกุลเงิน) เพื่อให้รวมกันไม่เกินโควตาของ API
+
+    Returns:
+        int: จำนวนเหรียญที่ดึงได้ใน Shard นี้
+    """
+    with _stage('extract', batch_id):
+        total_shards = shard_count * max(len(settings.VS_CURRENCIES), 1)
+        client = CoingeckoClient(rate_limiter=TokenBucket(
+            max(settings.API_RATE_LIMIT_PER_MINUTE // total_shards, 1),
+            max(settings.API_RATE_LIMIT_BURST // total_shards, 1)
+        ))
+        if settings.FULL_MARKET_EXTRACT:
+            per_page = settings.MARKET_PAGE_SIZE
+            pages = count(shard_index + 1, shard_count)
+            if settings.MAX_PAGES:
+                pages = range(shard_index + 1, settings.MAX_PAGES + 1, shard_count)
+        else:
+            per_page = settings.BATCH_SIZE
+            pages = [1]
+
+        landing = _landing_dir(batch_id)
+        landing.mkdir(parents=True, exist_ok=True)
+        path = landing / f'shard_{vs_currency}_{shard_index:04d}_of_{shard_count:04d}.jsonl'
+        tmp_path = path.with_suffix('.tmp')
+
+        with track_stage('extract', batch_id) as stage_metrics:
+            total = 0
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for items in client.iter_page_numbers(pages, vs_currency=vs_currency, per_page=per_page):
+                    f.write(json.dumps([vs_currency, items]))
+                    f.write('\n')
+                    total += len(items)
+            os.replace(tmp_path, path)
+            stage_metrics.rows_out = total
+            stage_metrics.bytes_fetched = client.bytes_fetched
+            stage_metrics.retries = client.retry_count
+
+        logger.info('Shard %s/%s (%s) extracted %s coins to %s', shard_index + 1, shard_count, vs_currency, total, path)
+        return total
+
+
+def _iter_landing_pages(batch_id: str) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    for path in sorted(_landing_dir(batch_id).glob('shard_*.jsonl')):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                vs_currency, items = json.loads(line)
+                yield vs_currency, items
+
+
+def stage_batch(batch_id: str) -> int:
+    """
+    ขั้น stage: โหลดไฟล์พักของทุก Shard ลง stg_crypto_markets ภายใน Transaction เดียว
+    (ลบข้อมูลเดิมของ Batch ก่อน ทำให้ Retry ได้โดยไม่เกิดแถวซ้ำ) และบันทึกสถานะ 'staged' ลง Ledger
+    """
+    with _stage('stage', batch_id):
+        if not _landing_dir(batch_id).exists():
+            raise FileNotFoundError(f'No landing files for batch {batch_id}')
+        _, total = SQLiteLoader().load_market_pages(_iter_landing_pages(batch_id), batch_id=batch_id, replace=True)
+        if not total:
+            raise ValueError(f'No data retrieved from API for batch {batch_id}')
+        return total
+
+
+def _read_transformed(batch_id: str) -> MarketBatch:
+    # คืนเป็น MarketBatch พร้อมคอลัมน์เสริม circulating_supply ให้กฎ DQ ใช้ (แถวยังอยู่ใน Schema ของ Fact Table)
+    data = MarketBatch()
+    for row in get_database().connection().execute(
+        f'SELECT {_INT_COLUMNS}, circulating_supply FROM int_crypto_prices WHERE batch_id = ? ORDER BY rowid',
+        (batch_id,)
+    ):
+        data.append(row[:-1], row[-1])
+    return data
+
+
+def transform_batch(batch_id: str) -> int:
+    """
+    ขั้น transform: แปลงข้อมูลจาก Staging แล้วพักไว้ใน int_crypto_prices ให้ขั้น validate / load อ่านต่อ
+    (ใช้ Engine 'python' หรือ 'columnar' ตาม settings; Engine 'sql' โหลดตรงเข้า Fact Table จึงใช้ Python แทนในโหมดนี้)
+    """
+    with _stage('transform', batch_id, 'transformed'):
+        cleaned_data = CryptoTransformer().get_cleaned_data(batch_id=batch_id)
+        conn = get_database().connection()
+        with conn:
+            conn.execute('DELETE FROM int_crypto_prices WHERE batch_id = ?', (batch_id,))
+            conn.executemany(
+                f'INSERT OR IGNORE INTO int_crypto_prices ({_INT_COLUMNS}, circulating_supply) '
+                f'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((*record, supply)
+                 for record, supply in zip(cleaned_data, cleaned_data.columns()['circulating_supply']))
+            )
+            BatchLedger().mark(batch_id, 'transformed', row_count=len(cleaned_data), conn=conn)
+        return len(cleaned_data)
+
+
+def validate_batch(batch_id: str) -> int:
+    """
+    ขั้น validate: ตรวจคุณภาพข้อมูลและค่าผิดปกติของข้อมูลที่พักไว้
+    หากไม่ผ่านจะ Raise DataQualityError (Retry ขั้นนี้ได้หลังแก้กฎ/เกณฑ์ โดยไม่ต้องดึงข้อมูลใหม่)
+    """
+    with _stage('validate', batch_id, 'validated'):
+        data = _read_transformed(batch_id)
+        if not data and ChangeTracker().is_unchanged_batch(batch_id):
+            # โหมด CDC: ไม่มีเหรียญใดเปลี่ยนใน Batch นี้ จึงไม่มีข้อมูลให้ตรวจ
+            logger.info('CDC: No changed coins in batch %s. Nothing to validate.', batch_id)
+            BatchLedger().mark(batch_id, 'validated', row_count=0)
+            return 0
+        if not DataqualityValidator().validate_market_data(data):
+            raise DataQualityError('Data Quality validation failed')
+
+        if settings.ANOMALY_DETECTION_ENABLED:
+            report = AnomalyDetector().check(data, batch_id=batch_id)
+            if report.has_anomalies and settings.ANOMALY_ACTION == 'fail':
+                raise DataQualityError('Statistical anomaly check failed')
+
+        BatchLedger().mark(batch_id, 'validated', row_count=len(data))
+        return len(data)
+
+
+def load_batch(batch_id: str) -> int:
+    """
+    ขั้น load: บันทึกข้อมูลที่ผ่านการตรวจลง fct_crypto_prices อัปเดตสถิติสะสม
+    แล้วล้างตารางพักและไฟล์ Landing ของ Batch นี้
+    """
+    with _stage('load', batch_id, 'loaded'):
+        data = _read_transformed(batch_id)
+
+        def finalize(conn):
+            # อัปเดตสถิติสะสมและปิด Batch ใน Transaction เดียวกับการ Upsert ลง Fact Table
+            if settings.ANOMALY_DETECTION_ENABLED:
+                AnomalyDetector().update(data, batch_id=batch_id, conn=conn)
+            BatchLedger().mark(batch_id, 'loaded', row_count=len(data), conn=conn)
+            conn.execute('DELETE FROM int_crypto_prices WHERE batch_id = ?', (batch_id,))
+
+        CryptoTransformer().save_to_core(data, on_commit=finalize)
+        shutil.rmtree(_landing_dir(batch_id), ignore_errors=True)
+        return len(data)
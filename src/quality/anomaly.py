@@ -0,0 +1,224 @@
+import math
+from datetime import datetime
+from typing import Any, Dict, List, Sequence, Tuple
+from config.settings import settings
+from src.quality.rules import numeric_values, to_columns
+from src.utils.database import get_database, resolve_db_path
+from src.utils.logger import logger
+from src.utils.metrics import track_stage
+
+# จำนวน coin_id สูงสุดต่อหนึ่งคำสั่ง IN (...) เพื่อไม่ให้เกินขีดจำกัดจำนวน Parameter ของ SQLite
+_LOOKUP_CHUNK = 500
+
+_STATS_COLUMNS = (
+    'n', 'price_mean', 'price_m2', 'volume_mean', 'volume_m2', 'last_price', 'last_volume', 'last_batch_id'
+)
+
+
+class Anomaly:
+    """ ค่าผิดปกติหนึ่งรายการที่ตรวจพบ (เหรียญ / สกุลเงิน / ตัวชี้วัด / ค่าปัจจุบันเทียบกับสถิติสะสม) """
+
+    def __init__(self, coin_id: str, metric: str, value: float, baseline: float, z_score: float = None,
+                 pct_change: float = None, vs_currency: str = 'usd'):
+        self.coin_id = coin_id
+        self.vs_currency = vs_currency
+        self.metric = metric
+        self.value = value
+        self.baseline = baseline
+        self.z_score = z_score
+        self.pct_change = pct_change
+
+    def __repr__(self):
+        return (f"Anomaly({self.coin_id}/{self.vs_currency}, {self.metric}, value={self.value}, baseline={self.baseline}, "
+                f"z={self.z_score}, pct={self.pct_change})")
+
+
+class AnomalyReport:
+    """ ผลการตรวจความผิดปกติข้าม Batch: ค่าที่กระโดดผิดปกติ และเหรียญที่หายไปจาก Batch ก่อนหน้า """
+
+    def __init__(self):
+        self.anomalies: List[Anomaly] = []
+        self.dropped_coins: List[str] = []
+
+    @property
+    def has_anomalies(self) -> bool:
+        return bool(self.anomalies or self.dropped_coins)
+
+
+class AnomalyDetector:
+    """
+    ขั้นตอน DQ เชิงสถิติ: เปรียบเทียบแต่ละ Batch กับค่าเฉลี่ยและความแปรปรวนสะสม (Rolling Statistics) ของแต่ละเหรียญ
+    สถิติถูกเก็บในตาราง dq_coin_stats และอัปเดตแบบ Incremental ด้วยสูตรของ Welford ทุกครั้งที่โหลดข้อมูล
+    ทำให้การตรวจใช้เวลาคงที่ต่อเหรียญ โดยไม่ต้องสแกนประวัติทั้งหมดใน fct_crypto_prices
+    (สถิติแยกตามคู่ (coin_id, vs_currency) เพราะราคาแต่ละสกุลเงินมีระดับต่างกัน)
+    """
+
+    def __init__(self, db_path: str = None, z_threshold: float = None, pct_threshold: float = None,
+                 min_samples: int = None):
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+        self.z_threshold = z_threshold or settings.ANOMALY_Z_THRESHOLD
+        self.pct_threshold = pct_threshold or settings.ANOMALY_PCT_THRESHOLD
+        self.min_samples = min_samples or settings.ANOMALY_MIN_SAMPLES
+
+    def _load_stats(self, keys: Sequence[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """ ดึงสถิติเฉพาะคู่ (coin_id, vs_currency) ที่อยู่ใน Batch นี้ (ค้นหาตาม Primary Key) """
+        conn = self.db.connection()
+        stats = {}
+        keys = set(keys)
+        coin_ids = sorted({coin_id for coin_id, _ in keys})
+        for start in range(0, len(coin_ids), _LOOKUP_CHUNK):
+            chunk = coin_ids[start:start + _LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            for row in conn.execute(
+                f'SELECT coin_id, vs_currency, {", ".join(_STATS_COLUMNS)} FROM dq_coin_stats '
+                f'WHERE coin_id IN ({placeholders})',
+                chunk
+            ):
+                if (row[0], row[1]) in keys:
+                    stats[(row[0], row[1])] = dict(zip(_STATS_COLUMNS, row[2:]))
+        return stats
+
+    @staticmethod
+    def _batch_series(data: Sequence[Sequence[Any]]) -> List[Tuple[str, str, float, float]]:
+        columns = to_columns(data)
+        currencies = columns.get('vs_currency') or ['usd'] * len(columns['coin_id'])
+        return [
+            (coin_id, vs_currency, price, volume)
+            for coin_id, vs_currency, price, volume in zip(
+                columns['coin_id'], currencies,
+                numeric_values(columns, 'price'), numeric_values(columns, 'total_volume')
+            )
+            if coin_id is not None and price is not None and volume is not None
+        ]
+
+    def _score(self, coin_id: str, metric: str, value: float, mean: float, m2: float, n: int,
+               last: float, vs_currency: str = 'usd') -> Anomaly:
+        z_score = None
+        if n >= self.min_samples and n > 1:
+            std = math.sqrt(m2 / (n - 1))
+            if std > 0:
+                z_score = (value - mean) / std
+        pct_change = (value - last) / last if last else None
+
+        if (z_score is not None and abs(z_score) > self.z_threshold) or \
+                (pct_change is not None and abs(pct_change) > self.pct_threshold):
+            return Anomaly(coin_id, metric, value, mean, z_score, pct_change, vs_currency)
+        return None
+
+    def check(self, data: Sequence[Sequence[Any]], batch_id: str = None, check_dropped: bool = True) -> AnomalyReport:
+        """
+        ตรวจหาค่าผิดปกติของ Batch ที่เข้ามา (ยังไม่อัปเดตสถิติ)
+
+        Args:
+            data: ลิสต์ของ Tuple ตาม Schema ของ Fact Table
+            batch_id (str, optional): ใช้หาเหรียญที่เคยอยู่ใน Batch ก่อนหน้าแต่หายไปในรอบนี้
+            check_dropped (bool): False สำหรับ Batch ที่มีเพียงบางเหรียญโดยธรรมชาติ (เช่น Micro-batch ของ Daemon)
+        """
+        with track_stage('anomaly', batch_id) as stage_metrics:
+            report = self._check(data, batch_id, check_dropped)
+            stage_metrics.rows_in = len(data)
+            stage_metrics.rows_out = len(data) - len(report.anomalies)
+        self._log_report(report)
+        return report
+
+    def _check(self, data: Sequence[Sequence[Any]], batch_id: str = None, check_dropped: bool = True) -> AnomalyReport:
+        report = AnomalyReport()
+        series = self._batch_series(data)
+        stats = self._load_stats((coin_id, vs_currency) for coin_id, vs_currency, _, _ in series)
+
+        for coin_id, vs_currency, price, volume in series:
+            state = stats.get((coin_id, vs_currency))
+            if state is None:
+                continue
+            for metric, value in (('price', price), ('volume', volume)):
+                anomaly = self._score(
+                    coin_id, metric, value, state[f'{metric}_mean'], state[f'{metric}_m2'], state['n'],
+                    state[f'last_{metric}'], vs_currency
+                )
+                if anomaly is not None:
+                    report.anomalies.append(anomaly)
+
+        if not check_dropped:
+            return report
+
+        # เหรียญที่อยู่ใน Batch ล่าสุดก่อนหน้า แต่ไม่อยู่ใน Batch นี้ (เช่น หลุดจาก Top-N)
+        conn = self.db.connection()
+        previous = conn.execute(
+            'SELECT MAX(last_batch_id) FROM dq_coin_stats WHERE last_batch_id IS NOT ?', (batch_id,)
+        ).fetchone()[0]
+        if previous is not None:
+            incoming = {coin_id for coin_id, _, _, _ in series}
+            # โหมด CDC: เหรียญที่ไม่เปลี่ยนไม่มีแถวใน Batch นี้ แต่ยังอยู่ในตลาด (ถูกบันทึกเป็นการอ้างอิง)
+            incoming.update(row[0] for row in conn.execute(
+                'SELECT DISTINCT coin_id FROM cdc_unchanged_refs WHERE batch_id = ?', (batch_id,)
+            ))
+            # เหรียญของ Batch ก่อนหน้า = แถวที่โหลดจริง + แถวที่อ้างอิง (Micro-batch ของ Daemon / โหมด CDC)
+            report.dropped_coins = [
+                row[0] for row in conn.execute(
+                    'SELECT coin_id FROM dq_coin_stats WHERE last_batch_id = ? '
+                    'UNION SELECT coin_id FROM cdc_unchanged_refs WHERE batch_id = ? ORDER BY 1', (previous, previous)
+                )
+                if row[0] not in incoming
+            ]
+        return report
+
+    def update(self, data: Sequence[Sequence[Any]], batch_id: str = None, conn=None):
+        """
+        อัปเดตสถิติสะสมของทุกเหรียญใน Batch ด้วยสูตรของ Welford (O(1) ต่อเหรียญ)
+
+        Idempotent: เหรียญที่สถิติล่าสุดมาจาก batch_id เดียวกันอยู่แล้วถูกข้าม การโหลด Batch ซ้ำจึงไม่นับค่าเดิมสองครั้ง
+
+        Args:
+            conn (sqlite3.Connection, optional): Connection ที่อยู่ใน Transaction ของงานหลัก
+                (เช่น on_commit ของ save_to_core เพื่อให้สถิติ Commit พร้อมข้อมูลใน Fact Table)
+        """
+        series = self._batch_series(data)
+        stats = self._load_stats((coin_id, vs_currency) for coin_id, vs_currency, _, _ in series)
+        now = datetime.now().isoformat()
+        rows = []
+
+        for coin_id, vs_currency, price, volume in series:
+            state = stats.get((coin_id, vs_currency)) or {'n': 0, 'price_mean': 0.0, 'price_m2': 0.0,
+                                           'volume_mean': 0.0, 'volume_m2': 0.0}
+            if batch_id is not None and state.get('last_batch_id') == batch_id:
+                continue
+            n = state['n'] + 1
+            values = {}
+            for metric, value in (('price', price), ('volume', volume)):
+                mean = state[f'{metric}_mean']
+                delta = value - mean
+                mean += delta / n
+                values[f'{metric}_mean'] = mean
+                values[f'{metric}_m2'] = state[f'{metric}_m2'] + delta * (value - mean)
+            rows.append((coin_id, vs_currency, n, values['price_mean'], values['price_m2'], values['volume_mean'],
+                         values['volume_m2'], price, volume, batch_id, now))
+
+        def write(conn):
+            conn.executemany(
+                'INSERT OR REPLACE INTO dq_coin_stats '
+                '(coin_id, vs_currency, n, price_mean, price_m2, volume_mean, volume_m2, last_price, last_volume, '
+                'last_batch_id, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+        if conn is not None:
+            write(conn)
+        else:
+            conn = self.db.connection()
+            with conn:
+                write(conn)
+        logger.info("Rolling statistics updated for %s coin/currency pairs.", len(rows))
+
+    def _log_report(self, report: AnomalyReport):
+        if report.anomalies:
+            sample = [f'{a.coin_id}/{a.vs_currency}:{a.metric}' for a in report.anomalies[:5]]
+            logger.warning("Anomaly Check: %s statistical outliers detected (e.g. %s)", len(report.anomalies), sample)
+        if report.dropped_coins:
+            logger.warning(
+                "Anomaly Check: %s coins missing since previous batch (e.g. %s)",
+                len(report.dropped_coins), report.dropped_coins[:5]
+            )
+        if not report.has_anomalies:
+            logger.info("Anomaly Check: PASSED (No outliers against rolling statistics)")
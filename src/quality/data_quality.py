@@ -1,74 +1,140 @@
+from typing import Any, Dict, List, Sequence, Union
+from config.settings import settings
+from src.quality.rules import Columns, DQRule, default_market_rules, to_columns
 from src.utils.logger import logger
+from src.utils.metrics import track_stage
+
+
+class DQReport:
+    """
+    ผลการตรวจคุณภาพข้อมูลของหนึ่ง Batch แบบมีโครงสร้าง:
+    จำนวนการละเมิดต่อกฎ ตัวอย่าง coin_id ที่ละเมิด และสัดส่วนแถวที่มีปัญหาเทียบกับเกณฑ์ที่ยอมรับได้
+    """
+
+    def __init__(self, total_rows: int, failure_threshold: float):
+        self.total_rows = total_rows
+        self.failure_threshold = failure_threshold
+        self.violations: Dict[str, int] = {}
+        self.samples: Dict[str, List[Any]] = {}
+        self.severities: Dict[str, str] = {}
+        self.skipped_rules: List[str] = []
+        self.failed_rows = 0
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failed_rows / self.total_rows if self.total_rows else 1.0
+
+    @property
+    def passed(self) -> bool:
+        if not self.total_rows:
+            return False
+        if self.failure_threshold <= 0:
+            return self.failed_rows == 0
+        return self.failure_rate <= self.failure_threshold
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'passed': self.passed,
+            'total_rows': self.total_rows,
+            'failed_rows': self.failed_rows,
+            'failure_rate': self.failure_rate,
+            'failure_threshold': self.failure_threshold,
+            'violations': dict(self.violations),
+            'samples': {rule_id: list(ids) for rule_id, ids in self.samples.items()},
+            'skipped_rules': list(self.skipped_rules),
+        }
+
 
 class DataqualityValidator:
     """
     ทำหน้าที่เป็น 'Gatekeeper' (ผู้คุมประตู) ขั้นสุดท้ายของ Pipeline
     เพื่อตรวจสอบความถูกต้องของข้อมูล (Data Integrity) ให้เป็นไปตามกฎธุรกิจก่อนจะบันทึกถาวร
+
+    กฎถูกประกาศแบบ Declarative (ดู src/quality/rules.py) และประเมินผลทีละคอลัมน์
+    ผลลัพธ์ถูกสรุปเป็นรายงานเดียวต่อ Batch แทนการเขียน Log ทุกแถวที่ละเมิด
     """
-    def __init__(self):
-        # ไม่มีการกำหนดค่าเริ่มต้นเป็นพิเศษ
-        pass
+    def __init__(self, rules: List[DQRule] = None, failure_threshold: float = None, sample_size: int = 5):
+        self.rules = rules if rules is not None else default_market_rules()
+        # สัดส่วนแถวที่ละเมิดกฎระดับ error ที่ยอมรับได้ (0 = ต้องสะอาดทั้ง Batch เหมือนเดิม)
+        self.failure_threshold = settings.DQ_FAILURE_THRESHOLD if failure_threshold is None else failure_threshold
+        self.sample_size = sample_size
+
+    def evaluate(self, data: Union[Sequence[Sequence[Any]], Columns]) -> DQReport:
+        """
+        ประเมินกฎทั้งหมดกับชุดข้อมูลหนึ่ง Batch
+
+        Args:
+            data: MarketBatch จากขั้น Transform (ใช้คอลัมน์ที่แปลงชนิดแล้วโดยตรง),
+            ลิสต์ของ Tuple ตาม Schema ของ Fact Table (batch_id[0], coin_id[1], ..., price[4], volume[6])
+            หรือ dict ของคอลัมน์ (สามารถมีคอลัมน์เพิ่ม เช่น circulating_supply สำหรับกฎความสอดคล้อง)
+
+        Returns:
+            DQReport: รายงานผลการตรวจแบบมีโครงสร้าง
+        """
+        columns = dict(data) if isinstance(data, dict) else to_columns(data)
+        total_rows = len(columns.get('coin_id', ()))
+        report = DQReport(total_rows, self.failure_threshold)
+        failed = [False] * total_rows
+        coin_ids = columns.get('coin_id', [None] * total_rows)
+
+        for rule in self.rules:
+            if not rule.applies_to(columns):
+                report.skipped_rules.append(rule.rule_id)
+                continue
+
+            mask = rule.check(columns)
+            offending = [i for i, violated in enumerate(mask) if violated]
+            report.violations[rule.rule_id] = len(offending)
+            report.severities[rule.rule_id] = rule.severity
+            report.samples[rule.rule_id] = [coin_ids[i] for i in offending[:self.sample_size]]
+
+            if rule.severity == 'error':
+                for i in offending:
+                    failed[i] = True
+
+        report.failed_rows = sum(failed)
+        return report
 
     def validate_market_data(self, data: list) -> bool:
         """
         ดำเนินการตรวจสอบคุณภาพข้อมูล (Data Quality Checks) กับชุดข้อมูลที่ผ่านการ Transform มาแล้ว
-        
+
         Args:
             data (list): ลิสต์ของ Tuple ที่บรรจุข้อมูลตลาดที่ผ่านการแปลงมาแล้ว
-            ลำดับดัชนี (Schema Index): (batch_id[0], coin_id[1], symbol[2], name[3], 
-            price[4], market_cap[5], volume[6], updated[7])
-            
+            ลำดับดัชนี (Schema Index): (batch_id[0], coin_id[1], symbol[2], name[3],
+            price[4], market_cap[5], volume[6], updated[7], vs_currency[8])
+
         Returns:
-            bool: คืนค่า True หากข้อมูลทั้งชุดผ่านมาตรฐานคุณภาพ, คืนค่า False หากพบปัญหา
+            bool: คืนค่า True หากสัดส่วนแถวที่มีปัญหาไม่เกินเกณฑ์ (settings.DQ_FAILURE_THRESHOLD)
         """
         # ตรวจสอบเบื้องต้นว่ามีข้อมูลส่งเข้ามาให้ตรวจหรือไม่
         if not data:
             logger.warning('DQ Check: No data provided for validation.')
             return False
-        
-        # แจ้งสถานะการเริ่มตรวจสอบคุณภาพข้อมูล 
-        logger.info(f'Executing Data Quality (DQ) checks for {len(data)} records...')
-        
-        is_valid = True
-        error_count = 0
-
-        for item in data:
-            # ดึงค่าจากดัชนีของ Tuple ที่ได้จาก Transformer
-            # หมายเหตุ: โครงสร้างข้อมูลใน Transformer จะมี batch_id อยู่ที่ลำดับ 0
-            coin_id = item[1]
-            price = item[4]
-            volume = item[6]
-
-            # --- กฎข้อที่ 1: ตรวจสอบความถูกต้องของราคา (Price Consistency) ---
-            try:
-                # ตรวจสอบว่าราคาต้องเป็นตัวเลขที่มากกว่า 0
-                if float(price) <= 0:
-                    logger.warning(f"DQ Violation: Invalid price for {coin_id} (Value: {price})")
-                    is_valid = False
-                    error_count += 1
-            except (ValueError, TypeError):
-                # กรณีข้อมูลราคาไม่ใช่ตัวเลข (เช่น เป็นค่าว่าง หรือ String ที่แปลงไม่ได้)
-                logger.error(f"DQ Violation: Non-numeric price detected for {coin_id}")
-                is_valid = False
-                error_count += 1
-
-            # --- กฎข้อที่ 2: ตรวจสอบความครบถ้วนของปริมาณการซื้อขาย (Volume Integrity) ---
-            try:
-                # ตรวจสอบว่าปริมาณการซื้อขายต้องมากกว่า 0
-                if float(volume) <= 0:
-                    logger.warning(f"DQ Violation: Zero or negative volume for {coin_id} (Value: {volume})")
-                    is_valid = False
-                    error_count += 1
-            except (ValueError, TypeError):
-                # กรณีข้อมูลวอลลุ่มไม่ใช่ตัวเลข
-                logger.error(f"DQ Violation: Non-numeric volume detected for {coin_id}")
-                is_valid = False
-                error_count += 1
+
+        # แจ้งสถานะการเริ่มตรวจสอบคุณภาพข้อมูล
+        logger.info('Executing Data Quality (DQ) checks for %s records...', len(data))
+        with track_stage('dq', data[0][0] if not isinstance(data, dict) else None) as stage_metrics:
+            stage_metrics.rows_in = len(data)
+            report = self.evaluate(data)
+            stage_metrics.rows_out = report.total_rows - report.failed_rows
+        self.log_report(report)
+        return report.passed
+
+    def log_report(self, report: DQReport):
+        """ สรุปผลการตรวจเป็น Log หนึ่งบรรทัดต่อกฎที่พบการละเมิด (ไม่ใช่หนึ่งบรรทัดต่อแถว) """
+        for rule_id, count in report.violations.items():
+            if count:
+                log = logger.error if report.severities[rule_id] == 'error' else logger.warning
+                log("DQ Violation: %s failed for %s records (e.g. %s)", rule_id, count, report.samples[rule_id])
 
         # สรุปผลการตรวจสอบคุณภาพข้อมูลราย Batch
-        if is_valid:
+        if report.passed and not report.failed_rows:
             logger.info("Data Quality Status: PASSED (All records healthy)")
+        elif report.passed:
+            logger.warning(
+                "Data Quality Status: PASSED within threshold (%s/%s records failed, limit %.2f%%)",
+                report.failed_rows, report.total_rows, report.failure_threshold * 100
+            )
         else:
-            logger.error(f"Data Quality Status: FAILED (Found {error_count} integrity issues)")
-            
-        return is_valid
\ No newline at end of file
+            logger.error("Data Quality Status: FAILED (Found %s records with integrity issues)", report.failed_rows)
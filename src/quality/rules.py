@@ -0,0 +1,147 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from src.transformers.records import MarketBatch, coerce_number
+
+# ลำดับคอลัมน์ของแถวที่ผ่านการ Transform (ตรงกับ Schema ของ fct_crypto_prices)
+FACT_COLUMNS = ('batch_id', 'coin_id', 'symbol', 'name', 'price', 'market_cap', 'total_volume', 'last_updated_at',
+                'vs_currency')
+
+Columns = Dict[str, List[Any]]
+
+
+def to_columns(data: Sequence[Sequence[Any]], names: Sequence[str] = FACT_COLUMNS) -> Columns:
+    """
+    สลับแถวเป็นคอลัมน์ (Transpose) ด้วย zip ซึ่งทำงานในระดับ C ครั้งเดียวต่อ Batch
+    MarketBatch เก็บเป็นคอลัมน์อยู่แล้ว จึงใช้คอลัมน์ของมันโดยตรง (รวมคอลัมน์ตัวเลขที่แปลงชนิดแล้ว)
+    """
+    if isinstance(data, MarketBatch) and tuple(names) == FACT_COLUMNS:
+        return data.columns()
+    if not data:
+        return {name: [] for name in names}
+    return {name: list(values) for name, values in zip(names, zip(*data))}
+
+
+def numeric_column(values: List[Any]) -> List[Optional[float]]:
+    """
+    แปลงคอลัมน์เป็น float เพียงครั้งเดียว ค่าที่แปลงไม่ได้ (None, String ที่ไม่ใช่ตัวเลข) จะเป็น None
+    (กฎเดียวกับการ Parse ของ Transform Engine ดู coerce_number)
+    """
+    return [coerce_number(value) for value in values]
+
+
+class DQRule:
+    """
+    กฎคุณภาพข้อมูลหนึ่งข้อที่ประกาศไว้ครั้งเดียว และประเมินผลทีละคอลัมน์ (Column-wise) ครั้งเดียวต่อ Batch
+    หมายเหตุ: check ภายในยังวนทีละค่าด้วย List Comprehension ของ Python (ไม่ใช่ Vectorized แบบ NumPy)
+    ที่ได้คือไม่สร้าง Object ต่อแถว และกฎหลายข้อใช้คอลัมน์ตัวเลขที่แปลงชนิดแล้วร่วมกัน (ดู numeric_values)
+
+    Args:
+        rule_id (str): รหัสกฎ (ใช้ในรายงานและตาราง Rejects)
+        description (str): คำอธิบายกฎ
+        columns (Sequence[str]): คอลัมน์ที่กฎนี้ต้องใช้ หากไม่มีใน Batch กฎจะถูกข้าม
+        check (Callable[[Columns], List[bool]]): ฟังก์ชันคืนค่า Mask ว่าแถวใดละเมิดกฎ
+        severity (str): 'error' นับรวมในเกณฑ์การผ่าน/ไม่ผ่าน, 'warning' รายงานอย่างเดียว
+    """
+
+    def __init__(self, rule_id: str, description: str, columns: Sequence[str],
+                 check: Callable[[Columns], List[bool]], severity: str = 'error'):
+        self.rule_id = rule_id
+        self.description = description
+        self.columns = tuple(columns)
+        self.check = check
+        self.severity = severity
+
+    def applies_to(self, columns: Columns) -> bool:
+        return all(name in columns for name in self.columns)
+
+
+def numeric_values(columns: Columns, name: str) -> List[Optional[float]]:
+    """ คอลัมน์ตัวเลขของ Batch: แคชไว้ใน dict ของ Batch เพื่อให้หลายกฎ (และ AnomalyDetector) ใช้ผลการแปลงร่วมกัน """
+    key = f'__numeric__{name}'
+    if key not in columns:
+        columns[key] = numeric_column(columns[name])
+    return columns[key]
+
+
+def not_null(column: str, rule_id: str = None) -> DQRule:
+    return DQRule(
+        rule_id or f'{column}_not_null', f'{column} must not be null', (column,),
+        lambda cols: [value is None or value == '' for value in cols[column]]
+    )
+
+
+def numeric(column: str, rule_id: str = None) -> DQRule:
+    return DQRule(
+        rule_id or f'{column}_numeric', f'{column} must be numeric', (column,),
+        lambda cols: [value is None for value in numeric_values(cols, column)]
+    )
+
+
+def positive(column: str, rule_id: str = None) -> DQRule:
+    # ค่าที่ไม่ใช่ตัวเลขถูกนับโดยกฎ numeric แล้ว จึงไม่นับซ้ำที่นี่
+    return DQRule(
+        rule_id or f'{column}_positive', f'{column} must be greater than 0', (column,),
+        lambda cols: [value is not None and value <= 0 for value in numeric_values(cols, column)]
+    )
+
+
+def in_range(column: str, minimum: float = None, maximum: float = None, rule_id: str = None,
+             severity: str = 'error') -> DQRule:
+    def check(cols: Columns) -> List[bool]:
+        return [
+            value is not None and (
+                (minimum is not None and value < minimum) or (maximum is not None and value > maximum)
+            )
+            for value in numeric_values(cols, column)
+        ]
+    return DQRule(rule_id or f'{column}_range', f'{column} must be within [{minimum}, {maximum}]',
+                  (column,), check, severity)
+
+
+def unique(column: str, rule_id: str = None, partition_by: str = None) -> DQRule:
+    """ ค่าต้องไม่ซ้ำภายใน Batch (หรือภายในแต่ละค่าของ partition_by หาก Batch มีคอลัมน์นั้น เช่น vs_currency) """
+    def check(cols: Columns) -> List[bool]:
+        values = cols[column]
+        if partition_by is not None and partition_by in cols:
+            values = zip(values, cols[partition_by])
+        seen = set()
+        mask = []
+        for value in values:
+            mask.append(value in seen)
+            seen.add(value)
+        return mask
+    scope = f'per {partition_by} ' if partition_by else ''
+    return DQRule(rule_id or f'{column}_unique', f'{column} must be unique {scope}within a batch', (column,), check)
+
+
+def market_cap_consistency(tolerance: float = 0.05, rule_id: str = 'market_cap_consistency',
+                           severity: str = 'warning') -> DQRule:
+    """
+    market_cap ต้องใกล้เคียง price × circulating_supply (ข้ามแถวที่ไม่มี Supply หรือ Market Cap เป็น 0)
+    circulating_supply ไม่อยู่ใน Fact Table: มาจากคอลัมน์เสริมของ MarketBatch ที่ทุก Transform Engine เติมจากข้อมูลดิบ
+    (แถวแบบ Tuple ธรรมดาไม่มีคอลัมน์นี้ กฎจึงถูกข้ามและรายงานใน skipped_rules)
+    """
+    def check(cols: Columns) -> List[bool]:
+        return [
+            None not in (price, cap, supply) and cap > 0 and supply > 0
+            and abs(price * supply - cap) > tolerance * cap
+            for price, cap, supply in zip(
+                numeric_values(cols, 'price'), numeric_values(cols, 'market_cap'),
+                numeric_values(cols, 'circulating_supply')
+            )
+        ]
+    return DQRule(rule_id, f'market_cap must be within {tolerance:.0%} of price x circulating_supply',
+                  ('price', 'market_cap', 'circulating_supply'), check, severity)
+
+
+def default_market_rules() -> List[DQRule]:
+    """ ชุดกฎมาตรฐานของข้อมูลตลาดที่ผ่านการ Transform แล้ว """
+    return [
+        not_null('coin_id'),
+        unique('coin_id', partition_by='vs_currency'),
+        numeric('price'),
+        positive('price'),
+        numeric('total_volume'),
+        positive('total_volume'),
+        in_range('market_cap', minimum=0),
+        market_cap_consistency(),
+    ]
@@ -0,0 +1,133 @@
+import json
+from typing import Any, Dict, List, Sequence, Tuple
+from src.transformers.crypto_transformer import REJECT_REASON_ZERO_PRICE_OR_VOLUME, REJECT_RULE_ZERO_PRICE_OR_VOLUME
+from src.transformers.records import MarketBatch, coerce_number
+from src.utils.logger import aggregate_log, logger
+
+try:
+    import numpy as np
+except ImportError:  # NumPy เป็น Dependency เสริม ใช้เฉพาะเมื่อเลือก Engine แบบ Columnar
+    np = None
+
+class ColumnarTransformer:
+    """
+    Transform Engine แบบ Columnar/Vectorized สำหรับ Batch ขนาดใหญ่และการ Backfill
+    ถอดรหัส JSON ทีละแถว (คงลำดับคู่กับสกุลเงิน) แยกเป็นคอลัมน์ แล้วใช้ NumPy Mask
+    ในการกรอง price/volume แทนการสร้าง dict และ tuple ทีละแถว ผลลัพธ์เป็น MarketBatch ที่สร้างจากคอลัมน์โดยตรง
+
+    ผลลัพธ์ (แถวที่ผ่านและแถวที่ถูกคัดออก) ตรงกับ CryptoTransformer.transform_logic ทุกประการ
+    """
+
+    FIELDS = (
+        'id', 'symbol', 'name', 'current_price', 'market_cap', 'total_volume', 'last_updated', 'circulating_supply'
+    )
+    NUMERIC_DEFAULTS = {'current_price': 0, 'market_cap': 0, 'total_volume': 0, 'circulating_supply': None}
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("ColumnarTransformer requires numpy. Install it with 'pip install numpy'.")
+
+    def transform(self, rows: Sequence[Tuple], batch_id: str = None) -> Tuple[MarketBatch, List[Dict[str, Any]]]:
+        """
+        แปลงข้อมูลดิบทั้ง Batch แบบคอลัมน์
+
+        Args:
+            rows (Sequence[Tuple]): แถวจาก Staging โดย raw_data อยู่ที่ตำแหน่ง 0 และ vs_currency ที่ตำแหน่ง 1 (ถ้ามี)
+            batch_id (str, optional): รหัสชุดข้อมูลที่จะใส่ในทุกแถวของผลลัพธ์
+
+        Returns:
+            Tuple[MarketBatch, List[Dict]]: แถวที่ผ่านกฎ (Schema เดียวกับ Fact Table) และรายการที่ถูกคัดออก
+        """
+        items, currencies = self._decode(rows)
+        count = len(items)
+        if not count:
+            return MarketBatch(), []
+
+        # แยกเป็นคอลัมน์: คีย์ตัวเลขที่หายไปถือเป็น 0 เหมือน item.get(key, 0) ใน Python Engine
+        columns = {
+            field: [item.get(field, self.NUMERIC_DEFAULTS.get(field)) for item in items]
+            for field in self.FIELDS
+        }
+
+        # แปลงชนิดของคอลัมน์ตัวเลขครั้งเดียว (กฎเดียวกับ Python Engine: "50000" -> 50000.0, null -> None)
+        for field in self.NUMERIC_DEFAULTS:
+            columns[field] = [coerce_number(value) for value in columns[field]]
+        price, price_ok = self._numeric_column(columns['current_price'])
+        volume, volume_ok = self._numeric_column(columns['total_volume'])
+
+        # เลียนแบบ Short-circuit ของ `price > 0 and volume > 0`: ชนิดข้อมูลของวอลลุ่มถูกตรวจเฉพาะเมื่อราคา > 0
+        price_positive = price_ok & (price > 0)
+        corrupt = ~price_ok | (price_positive & ~volume_ok)
+        clean = price_positive & volume_ok & (volume > 0)
+        rejected = ~corrupt & ~clean
+
+        corrupt_count = int(corrupt.sum())
+        if corrupt_count:
+            logger.error("Data corruption detected - %s records with non-numeric price or volume skipped.", corrupt_count)
+
+        clean_idx = np.flatnonzero(clean).tolist()
+        cleaned_data = MarketBatch.from_columns(
+            batch_id=[batch_id] * len(clean_idx),
+            coin_id=[columns['id'][i] for i in clean_idx],
+            symbol=[columns['symbol'][i] for i in clean_idx],
+            name=[columns['name'][i] for i in clean_idx],
+            price=price[clean].tolist(),
+            market_cap=[columns['market_cap'][i] for i in clean_idx],
+            total_volume=volume[clean].tolist(),
+            last_updated_at=[columns['last_updated'][i] for i in clean_idx],
+            vs_currency=[currencies[i] for i in clean_idx],
+            circulating_supply=[columns['circulating_supply'][i] for i in clean_idx],
+        )
+
+        data_issues = [
+            {
+                'batch_id': batch_id,
+                'id': columns['id'][i],
+                'symbol': columns['symbol'][i],
+                'name': columns['name'][i],
+                'price': columns['current_price'][i],
+                'market_cap': columns['market_cap'][i],
+                'total_volume': columns['total_volume'][i],
+                'last_updated': columns['last_updated'][i],
+                'vs_currency': currencies[i],
+                'reason': REJECT_REASON_ZERO_PRICE_OR_VOLUME,
+                'rule_id': REJECT_RULE_ZERO_PRICE_OR_VOLUME
+            }
+            for i in np.flatnonzero(rejected).tolist()
+        ]
+
+        logger.info("Columnar transformation complete: %s valid, %s rejected.", len(cleaned_data), len(data_issues))
+        return cleaned_data, data_issues
+
+    @staticmethod
+    def _decode(rows: Sequence[Tuple]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        ถอดรหัส JSON ทีละแถว แล้วคืนรายการที่ถอดรหัสได้คู่กับคอลัมน์สกุลเงินที่เรียงตรงกันตามแถว
+        แถวที่เสียหายหรือไม่ใช่ JSON Object ถูกข้ามเหมือน Python Engine
+        (ไม่รวมทั้ง Batch เป็น JSON Array เดียว เพราะแถวที่มีหลายค่าหรือค่าไม่ครบทำให้ลำดับเลื่อนได้โดยไม่เกิด Error)
+        """
+        items = []
+        currencies = []
+        with aggregate_log("Data corruption detected - JSON Parsing Error: %s") as corrupt_rows:
+            for row in rows:
+                try:
+                    item = json.loads(row[0])
+                except (json.JSONDecodeError, TypeError) as e:
+                    corrupt_rows.add(e)
+                    continue
+                if not isinstance(item, dict):
+                    corrupt_rows.add(f'expected a JSON object, got {type(item).__name__}')
+                    continue
+                items.append(item)
+                currencies.append(row[1] if len(row) > 1 else 'usd')
+        return items, currencies
+
+    @staticmethod
+    def _numeric_column(values: List[Any]):
+        """ แปลงคอลัมน์ที่ผ่าน coerce_number แล้วเป็น float64 พร้อม Mask ที่บอกว่าแถวใดเป็นตัวเลข (ไม่ใช่ None) """
+        mask = np.fromiter((v is not None for v in values), dtype=bool, count=len(values))
+        if mask.all():
+            return np.asarray(values, dtype=np.float64), mask
+        array = np.zeros(len(values), dtype=np.float64)
+        array[mask] = np.asarray([v for v, ok in zip(values, mask) if ok], dtype=np.float64)
+        return array, mask
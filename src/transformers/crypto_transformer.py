@@ -1,9 +1,18 @@
-import sqlite3
 import json
-import os
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Sequence, Tuple
 from config.settings import settings
-from src.utils.logger import logger
+from src.loaders.backends import CommitHook, SQLiteBackend, StorageBackend, get_backend
+from src.loaders.parquet_mirror import ParquetMirror
+from src.loaders.rejects_store import RejectsStore
+from src.loaders.rollups import MarketRollups
+from src.transformers.records import MarketBatch, MarketRecord, coerce_number
+from src.utils.database import get_database, resolve_db_path
+from src.utils.logger import aggregate_log, logger
+from src.utils.metrics import track_stage
+
+# เหตุผลและรหัสกฎของการคัดออกตามกฎธุรกิจ (ใช้ร่วมกันทุก Transform Engine เพื่อให้ผลลัพธ์ตรงกัน)
+REJECT_REASON_ZERO_PRICE_OR_VOLUME = 'Invalid asset: Zero price or volume detected'
+REJECT_RULE_ZERO_PRICE_OR_VOLUME = 'zero_price_or_volume'
 
 class CryptoTransformer:
     """
@@ -11,11 +20,26 @@ class CryptoTransformer:
     รับผิดชอบการใส่กฎทางธุรกิจ (Business Logic), การกรองข้อมูล และการบันทึกข้อมูลที่ถูกคัดออก (Auditing)
     """
     
-    def __init__(self):
-        # ดึงที่อยู่ฐานข้อมูลจากระบบ Config ส่วนกลาง
-        self.db_path = settings.DATABASE_URL.replace('sqlite:///', '').strip()
+    def __init__(self, db_path: str = None, engine: str = None, backend: StorageBackend = None):
+        # ดึงที่อยู่ฐานข้อมูลจากระบบ Config ส่วนกลาง และใช้ Connection Manager ร่วมกับ Loader
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+        self.rejects = RejectsStore(self.db_path)
+        self.rollups = MarketRollups(self.db_path)
+        # สำเนา Parquet สำหรับงานวิเคราะห์ (เปิดด้วย PARQUET_MIRROR_ENABLED)
+        self.mirror = ParquetMirror() if settings.PARQUET_MIRROR_ENABLED else None
+        # Staging / Fact Table อ่านเขียนผ่าน Backend ตาม DATABASE_URL (ระบุ db_path ตรงๆ = ใช้ไฟล์ SQLite นั้น)
+        self.backend = backend or (SQLiteBackend(self.db) if db_path else get_backend())
+
+        # เลือก Engine สำหรับขั้นตอน Transform: 'python' (ทีละแถว) หรือ 'columnar' (NumPy แบบทั้ง Batch)
+        self.engine = engine or settings.TRANSFORM_ENGINE
+        self._columnar = None
+        if self.engine == 'columnar':
+            # Import เมื่อจำเป็นเท่านั้น เพื่อไม่ให้ NumPy เป็น Dependency บังคับ
+            from src.transformers.columnar_transformer import ColumnarTransformer
+            self._columnar = ColumnarTransformer()
     
-    def get_cleaned_data(self, batch_id: str = None) -> List[Tuple]:
+    def get_cleaned_data(self, batch_id: str = None) -> MarketBatch:
         """
         ดึงข้อมูลดิบจาก Staging และเริ่มกระบวนการแปลงข้อมูล (Transformation)
         
@@ -24,137 +48,163 @@ class CryptoTransformer:
             หากไม่ระบุจะดึงข้อมูลทั้งหมดที่มีใน Staging
         """
         try:
-            logger.info(f"Extracting raw data for processing (Batch: {batch_id})")
+            logger.info("Extracting raw data for processing (Batch: %s)", batch_id)
 
             # กลไก Incremental Loading: เลือกดึงข้อมูลเฉพาะรหัส Batch ที่ระบุเท่านั้น
-            if batch_id:
-                select_query = 'SELECT raw_data FROM stg_crypto_markets WHERE batch_id = ?'
-                params = (batch_id,)
-            else:
-                select_query = 'SELECT raw_data FROM stg_crypto_markets'
-                params = ()
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(select_query, params)
-                rows = cursor.fetchall()
-
-            if not rows:
-                logger.warning(f"No records found in staging for batch: {batch_id}")
-                return []
-            
-            # ส่งข้อมูลดิบที่ดึงมาได้ไปประมวลผลต่อที่ฟังก์ชัน transform_logic
-            return self.transform_logic(rows, batch_id)
+            # (อ่านผ่าน View ที่ประกอบฟิลด์ราคารายสกุลเงินเข้ากับ Meta ของเหรียญเป็น JSON ก้อนเดียว)
+            with track_stage('transform', batch_id) as stage_metrics:
+                rows = self.backend.read_staging(batch_id)
+                stage_metrics.rows_in = len(rows)
+
+                if not rows:
+                    logger.warning("No records found in staging for batch: %s", batch_id)
+                    return MarketBatch()
+
+                if self._columnar is not None:
+                    cleaned_data, data_issues = self._columnar.transform(rows, batch_id)
+                    if data_issues:
+                        self.save_rejects(data_issues, batch_id)
+                else:
+                    # ส่งข้อมูลดิบที่ดึงมาได้ไปประมวลผลต่อที่ฟังก์ชัน transform_logic
+                    cleaned_data = self.transform_logic(rows, batch_id)
+
+                stage_metrics.rows_out = len(cleaned_data)
+                return cleaned_data
 
         except Exception as e:
-            logger.error(f"Failed to extract data from Staging: {str(e)}")
-            return []
+            logger.error("Failed to extract data from Staging: %s", e)
+            return MarketBatch()
     
-    def transform_logic(self, rows: List[Tuple], batch_id: str = None) -> List[Tuple]:
+    def transform_logic(self, rows: List[Tuple], batch_id: str = None) -> MarketBatch:
         """ 
         ถอดรหัส JSON และนำกฎทางธุรกิจมาประยุกต์ใช้เพื่อกรองข้อมูลที่ไม่สมบูรณ์ออก
         """
-        cleaned_data = []
+        cleaned_data, data_issues = self._apply_row_rules(rows, batch_id)
+
+        # หากพบข้อมูลที่มีปัญหา ให้บันทึกลงตาราง Rejects เพื่อความโปร่งใสของข้อมูล (Observability)
+        if data_issues:
+            self.save_rejects(data_issues, batch_id)
+
+        logger.info("Transformation complete: %s valid, %s rejected.", len(cleaned_data), len(data_issues))
+        return cleaned_data 
+
+    def apply_rules(self, rows: List[Tuple], batch_id: str = None) -> Tuple[MarketBatch, List[Dict]]:
+        """
+        ประมวลผลกฎทางธุรกิจด้วย Engine ที่เลือกไว้ โดยไม่มี Side Effect (ไม่บันทึกรายการที่ถูกคัดออก)
+        ใช้โดย Worker ของการ Reprocess ที่ต้องส่งผลลัพธ์กลับไปให้ Writer กลางเป็นผู้บันทึก
+
+        Returns:
+            Tuple[MarketBatch, List[Dict]]: แถวที่ผ่านกฎ และรายการที่ถูกคัดออก
+        """
+        if self._columnar is not None:
+            return self._columnar.transform(rows, batch_id)
+        return self._apply_row_rules(rows, batch_id)
+
+    def _apply_row_rules(self, rows: List[Tuple], batch_id: str = None) -> Tuple[MarketBatch, List[Dict]]:
+        """
+        กฎทางธุรกิจแบบทีละแถว (Python Engine)
+        แถวจาก Staging คือ (raw_data, vs_currency) หากไม่มีคอลัมน์สกุลเงินจะถือเป็น 'usd'
+        ฟิลด์ตัวเลขถูกแปลงชนิดครั้งเดียวด้วย coerce_number (เช่น "50000" -> 50000.0) ค่าที่แปลงไม่ได้ถือว่าเสียหาย
+        """
+        cleaned_data = MarketBatch()
+        append = cleaned_data.append
         data_issues = [] 
-        
-        for row in rows:
-            try:
-                # แปลงข้อมูลจาก JSON String กลับมาเป็น Dictionary (Deserialization)
-                item = json.loads(row[0])
-                price = item.get('current_price', 0)
-                volume = item.get('total_volume', 0)
+        # แถวเสียหายอาจมีได้ทั้ง Batch: Log เฉพาะตัวอย่างแรกๆ แล้วสรุปจำนวนรวมตอนจบ แทนการ Log ทุกแถว
+        with aggregate_log("Data corruption detected - JSON Parsing Error: %s") as corrupt_rows, \
+                aggregate_log("Data corruption detected - Non-numeric price or volume: %s") as non_numeric_rows:
+            for row in rows:
+                try:
+                    # แปลงข้อมูลจาก JSON String กลับมาเป็น Dictionary (Deserialization)
+                    item = json.loads(row[0])
+                except (json.JSONDecodeError, TypeError) as e:
+                    corrupt_rows.add(e)
+                    continue
+                # แถวต้องเป็น JSON Object (เหมือนเงื่อนไข json_type = 'object' ของ Engine แบบ SQL)
+                if not isinstance(item, dict):
+                    corrupt_rows.add(f'expected a JSON object, got {type(item).__name__}')
+                    continue
+
+                # คีย์ที่หายไปถือเป็น 0 ส่วนค่าที่มีแต่ไม่ใช่ตัวเลข (null / "N/A") แปลงเป็น None
+                price = coerce_number(item.get('current_price', 0))
+                volume = coerce_number(item.get('total_volume', 0))
+                # ชนิดของวอลลุ่มถูกตรวจเฉพาะเมื่อราคา > 0 (Short-circuit แบบเดียวกับทุก Engine)
+                if price is None or (price > 0 and volume is None):
+                    non_numeric_rows.add(item.get('id'))
+                    continue
 
                 # ออกแบบโครงสร้างข้อมูลใหม่ (Mapping) ให้ตรงกับตาราง Fact Table หลัก
-                record = {
-                    'batch_id': batch_id,
-                    'id': item.get('id'),
-                    'symbol': item.get('symbol'),
-                    'name': item.get('name'),
-                    'price': price,
-                    'market_cap': item.get('market_cap', 0),
-                    'total_volume': volume,
-                    'last_updated': item.get('last_updated')
-                }
+                record = MarketRecord(
+                    batch_id, item.get('id'), item.get('symbol'), item.get('name'), price,
+                    coerce_number(item.get('market_cap', 0)), volume, item.get('last_updated'),
+                    row[1] if len(row) > 1 else 'usd'
+                )
 
                 # กฎการแปลงข้อมูล (Transformation Rule): เก็บเฉพาะเหรียญที่มีการซื้อขายจริง (ราคาและวอลลุ่ม > 0)
                 if price > 0 and volume > 0:
-                    cleaned_data.append(tuple(record.values()))
+                    append(record, coerce_number(item.get('circulating_supply')))
                 else:
                     # เก็บข้อมูลที่ถูกคัดออกเพื่อใช้ในการตรวจสอบสาเหตุภายหลัง (Data Quality Auditing)
-                    record['reason'] = 'Invalid asset: Zero price or volume detected'
-                    data_issues.append(record)
-                    
-            except (json.JSONDecodeError, TypeError) as e:
-                logger.error(f"Data corruption detected - JSON Parsing Error: {e}")
-                continue
-
-        # หากพบข้อมูลที่มีปัญหา ให้ทำการบันทึกลงไฟล์ JSON เพื่อความโปร่งใสของข้อมูล (Observability)
-        if data_issues:
-            self.save_issues_to_json(data_issues, batch_id)
+                    data_issues.append({
+                        'batch_id': batch_id,
+                        'id': record.coin_id,
+                        'symbol': record.symbol,
+                        'name': record.name,
+                        'price': record.price,
+                        'market_cap': record.market_cap,
+                        'total_volume': record.total_volume,
+                        'last_updated': record.last_updated_at,
+                        'vs_currency': record.vs_currency,
+                        'reason': REJECT_REASON_ZERO_PRICE_OR_VOLUME,
+                        'rule_id': REJECT_RULE_ZERO_PRICE_OR_VOLUME
+                    })
 
-        logger.info(f"Transformation complete: {len(cleaned_data)} valid, {len(data_issues)} rejected.")
-        return cleaned_data 
+        return cleaned_data, data_issues
         
-    def save_issues_to_json(self, issues: List[Dict], batch_id: str = None):
+    def save_rejects(self, issues: List[Dict], batch_id: str = None):
         """ 
-        บันทึกข้อมูลที่ไม่ผ่านเกณฑ์ลงไฟล์ JSON เพื่อทำ Root Cause Analysis (RCA)
-        โดยเก็บแยกตามโฟลเดอร์และรหัส Batch
+        บันทึกข้อมูลที่ไม่ผ่านเกณฑ์ลงตาราง rej_crypto_markets ด้วยการเขียนแบบ Bulk ครั้งเดียว
+        เพื่อทำ Root Cause Analysis (RCA) ผ่าน RejectsStore.query() / summary()
         """
         try:
-            folder_path = 'data/issues'
-            if not os.path.exists(folder_path):
-                os.makedirs(folder_path)
-
-            file_name = f'issues_{batch_id}.json' if batch_id else 'issues_unknown.json'
-            file_path = os.path.join(folder_path, file_name)
-
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(issues, f, ensure_ascii=False, indent=4)
-
-            logger.info(f"Data Quality Report generated: {file_path}")
+            self.rejects.write(issues, batch_id)
         except Exception as e:
-            logger.error(f"Auditing failure: Could not save issue report: {e}")
+            logger.error("Auditing failure: Could not save rejected records: %s", e)
             
-    def save_to_core(self, data: List[Tuple]):
+    def save_to_core(self, data: Sequence[Tuple], on_commit: CommitHook = None):
         """
         นำเข้าข้อมูลที่ถูกทำความสะอาดแล้วเข้าสู่ Fact Table หลัก
         ใช้รูปแบบการบันทึกแบบจัดเก็บประวัติ (Time-series) ด้วย Composite Primary Key
+
+        Args:
+            on_commit: งานที่ต้อง Commit พร้อมข้อมูล เช่น บันทึกสถานะ 'loaded' ของ Batch ลง Ledger
+                (ดู StorageBackend.upsert_facts) ถูกเรียกเสมอแม้ไม่มีแถวให้บันทึก
         """
         if not data:
             logger.warning("Ingestion skipped: No valid records to load.")
+            if on_commit is not None:
+                conn = self.db.connection()
+                with conn:
+                    on_commit(conn)
             return
+
+        def finalize(conn):
+            # ตารางสรุป (ราคาล่าสุด / OHLC) อัปเดตเฉพาะเหรียญและช่วงเวลาของ Batch นี้ใน Transaction เดียวกัน
+            self.rollups.apply(data, conn=conn)
+            if on_commit is not None:
+                on_commit(conn)
         
         try:
-            # สร้างตาราง Fact Table หากยังไม่มี (Schema นี้เน้นความเร็วในการวิเคราะห์ข้อมูล)
-            # ใช้ (batch_id, coin_id) เป็น Primary Key เพื่อป้องกันข้อมูลซ้ำซ้อนในรอบการรันเดียวกัน
-            create_table_query = '''
-            CREATE TABLE IF NOT EXISTS fct_crypto_prices(
-                batch_id TEXT,
-                coin_id TEXT,
-                symbol TEXT,
-                name TEXT,
-                price REAL,
-                market_cap REAL,
-                total_volume REAL,
-                last_updated_at TIMESTAMP,
-                PRIMARY KEY (batch_id, coin_id)
-            )
-            '''
-            
-            # คำสั่งบันทึกข้อมูลแบบ Bulk พร้อมกลไก 'OR IGNORE' เพื่อรองรับคุณสมบัติ Idempotency (รันซ้ำได้ไม่พัง)
-            insert_query = '''
-            INSERT OR IGNORE INTO fct_crypto_prices
-            (batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            '''
-
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute(create_table_query)
-                # บันทึกข้อมูลปริมาณมากในครั้งเดียวเพื่อประสิทธิภาพสูงสุด
-                conn.executemany(insert_query, data)
-                conn.commit()
-                logger.info(f"DATABASE LOAD SUCCESS: {len(data)} records archived in Fact Table.")
+            with track_stage('load_core', data[0][0]) as stage_metrics:
+                stage_metrics.rows_in = len(data)
+                # บันทึกข้อมูลปริมาณมากในครั้งเดียวเพื่อประสิทธิภาพสูงสุด (SQLite: executemany แบบ 'OR IGNORE',
+                # PostgreSQL: COPY + ON CONFLICT DO NOTHING) เพื่อรองรับคุณสมบัติ Idempotency (รันซ้ำได้ไม่พัง)
+                stage_metrics.rows_out = self.backend.upsert_facts(data, on_commit=finalize)
+                logger.info("DATABASE LOAD SUCCESS: %s records archived in Fact Table.", len(data))
         
         except Exception as e:
-            logger.error(f"Core Layer Load Error: {str(e)}")
-            raise
\ No newline at end of file
+            logger.error("Core Layer Load Error: %s", e)
+            raise
+
+        # ข้อมูลและสถานะ 'loaded' ถูก Commit แล้ว: Mirror ที่ล้มเหลวต้องไม่ทำให้ Batch ถูกบันทึกว่าล้มเหลว
+        if self.mirror is not None:
+            self.mirror.write_committed(data)
\ No newline at end of file
@@ -0,0 +1,148 @@
+import math
+import re
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+# String ที่ถือว่าเป็นตัวเลข (เช่น "50000", "1.5e-3") ตัวอื่นๆ (เช่น "N/A", "nan") ถือว่าไม่ใช่ตัวเลข
+_DECIMAL = re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$')
+
+
+def coerce_number(value: Any) -> Optional[float]:
+    """
+    แปลงค่าตัวเลขจาก API เป็น float เพียงครั้งเดียวตอน Parse (ใช้ร่วมกันทุก Transform Engine):
+    int / float และ String ทศนิยม (เช่น "50000") -> float, ค่าอื่น (None, bool, "N/A", Object) -> None
+    (bool เป็น Subclass ของ int แต่ true / false ไม่ใช่ราคาหรือวอลลุ่ม จึงต้องตัดออกก่อน)
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and _DECIMAL.match(value):
+        return float(value)
+    return None
+
+
+class MarketRecord(NamedTuple):
+    """
+    ข้อมูลตลาดหนึ่งแถวที่ผ่านการ Transform แล้ว (Schema เดียวกับ fct_crypto_prices)
+    เป็น Tuple จึงส่งให้ executemany / COPY ได้โดยตรง และอ่านด้วยชื่อฟิลด์แทนดัชนี (record.price แทน row[4])
+    """
+    batch_id: Optional[str]
+    coin_id: Optional[str]
+    symbol: Optional[str]
+    name: Optional[str]
+    price: float
+    market_cap: Optional[float]
+    total_volume: float
+    last_updated_at: Optional[str]
+    vs_currency: str = 'usd'
+
+
+# ฟิลด์ตัวเลขถูกเก็บเป็น array('d') (8 ไบต์ต่อค่า) ค่าที่ไม่มี (None) เก็บเป็น NaN
+_NUMERIC_FIELDS = ('price', 'market_cap', 'total_volume')
+
+
+def _none_if_nan(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+class MarketBatch:
+    """
+    ข้อมูลที่ผ่านการ Transform ของหนึ่ง Batch แบบคอลัมน์ (หนึ่งคอลัมน์ต่อฟิลด์ของ MarketRecord)
+    คอลัมน์ตัวเลขเป็น array('d') ที่แปลงชนิดแล้วตั้งแต่ตอน Parse ขั้น DQ / Anomaly จึงใช้คอลัมน์ได้ทันที
+    โดยไม่ต้องสลับแถวเป็นคอลัมน์หรือเรียก float() ซ้ำ และทำงานเหมือนลิสต์ของ MarketRecord
+    (len / index / วนลูป) สำหรับขั้นที่ต้องการทีละแถว เช่น executemany
+
+    circulating_supply เป็นคอลัมน์เสริมจากข้อมูลดิบที่ไม่อยู่ใน Fact Table (ไม่อยู่ใน MarketRecord จึงไม่ถูกเขียนลง
+    ฐานข้อมูล) มีไว้ให้กฎ DQ ที่ต้องใช้ เช่น market_cap_consistency ค่าที่ไม่มีเป็น None
+    """
+
+    __slots__ = MarketRecord._fields + ('circulating_supply', '_columns')
+
+    def __init__(self, records: Iterable[Sequence[Any]] = ()):
+        for field in MarketRecord._fields:
+            setattr(self, field, array('d') if field in _NUMERIC_FIELDS else [])
+        self.circulating_supply = array('d')
+        # แคชของ columns() ถูกล้างทุกครั้งที่เพิ่มแถว
+        self._columns: Optional[Dict[str, List[Any]]] = None
+        self.extend(records)
+
+    @classmethod
+    def from_columns(cls, **columns: Iterable[Any]) -> 'MarketBatch':
+        """
+        สร้างจากคอลัมน์ที่มีอยู่แล้ว (เช่น ผลลัพธ์ของ Engine แบบ Columnar) โดยไม่ผ่าน Object ทีละแถว
+        (circulating_supply ไม่บังคับ หากไม่ส่งมาทุกแถวเป็น None)
+        """
+        batch = cls()
+        for field in MarketRecord._fields:
+            values = columns[field]
+            if field in _NUMERIC_FIELDS:
+                getattr(batch, field).extend(math.nan if value is None else value for value in values)
+            else:
+                getattr(batch, field).extend(values)
+        supply = columns.get('circulating_supply')
+        if supply is None:
+            batch.circulating_supply.extend(math.nan for _ in range(len(batch)))
+        else:
+            batch.circulating_supply.extend(math.nan if value is None else value for value in supply)
+        return batch
+
+    def append(self, record: Sequence[Any], circulating_supply: Optional[float] = None):
+        for field, value in zip(MarketRecord._fields, record):
+            if field in _NUMERIC_FIELDS and value is None:
+                value = math.nan
+            getattr(self, field).append(value)
+        self.circulating_supply.append(math.nan if circulating_supply is None else circulating_supply)
+        self._columns = None
+
+    def extend(self, records: Iterable[Sequence[Any]]):
+        for record in records:
+            self.append(record)
+
+    def __len__(self) -> int:
+        return len(self.coin_id)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[MarketRecord, 'MarketBatch']:
+        if isinstance(index, slice):
+            # Slice คืน MarketBatch ใหม่ที่ตัดแต่ละคอลัมน์ (array('d') / List) ตรงๆ เหมือน List
+            batch = MarketBatch()
+            for field in MarketRecord._fields + ('circulating_supply',):
+                setattr(batch, field, getattr(self, field)[index])
+            return batch
+        return MarketRecord(*(
+            _none_if_nan(getattr(self, field)[index]) if field in _NUMERIC_FIELDS else getattr(self, field)[index]
+            for field in MarketRecord._fields
+        ))
+
+    def __iter__(self) -> Iterator[MarketRecord]:
+        # วนบน List / array ที่เก็บไว้โดยตรง (ไม่สร้างคอลัมน์ชุดใหม่ทุกครั้งที่วนลูป)
+        return map(MarketRecord._make, zip(*(
+            map(_none_if_nan, getattr(self, field)) if field in _NUMERIC_FIELDS else getattr(self, field)
+            for field in MarketRecord._fields
+        )))
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (MarketBatch, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'MarketBatch({len(self)} records)'
+
+    def columns(self) -> Dict[str, List[Any]]:
+        """
+        คอลัมน์ในรูปแบบที่ DQ Rules ใช้ (ดู src/quality/rules.py) พร้อมแคชคอลัมน์ตัวเลขที่แปลงชนิดแล้ว
+        ทำให้กฎ numeric / positive / in_range ไม่ต้องแปลงค่าซ้ำ (รวมคอลัมน์เสริม circulating_supply)
+        สร้างครั้งเดียวต่อ Batch (DQ / Anomaly เรียกซ้ำได้) คอลัมน์ที่ไม่ใช่ตัวเลขเป็น List เดียวกับที่เก็บไว้ (ห้ามแก้ไข)
+        """
+        if self._columns is not None:
+            return self._columns
+        columns: Dict[str, List[Any]] = {}
+        for field in MarketRecord._fields + ('circulating_supply',):
+            values = getattr(self, field)
+            if field in _NUMERIC_FIELDS or field == 'circulating_supply':
+                values = [_none_if_nan(value) for value in values]
+                columns[f'__numeric__{field}'] = values
+            columns[field] = values
+        self._columns = columns
+        return columns
@@ -0,0 +1,184 @@
+import os
+import sqlite3
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, List, Set, Tuple
+from config.settings import settings
+from src.loaders.backends import FACT_COLUMNS, require_sqlite_backend
+from src.loaders.staging_archive import StagingArchive
+from src.transformers.crypto_transformer import CryptoTransformer
+from src.utils.database import get_database, resolve_db_path
+from src.utils.logger import logger
+
+# ตารางเงา (Shadow Table) ของ Full Rebuild: เขียนผลลัพธ์ใหม่ที่นี่ก่อน แล้วสลับเข้า Fact Table ใน Transaction เดียว
+SHADOW_TABLE = 'fct_crypto_prices_rebuild'
+
+
+def _transform_batch(db_path: str, batch_id: str, engine: str) -> Tuple[str, List[Tuple], List[Dict]]:
+    """
+    งานของ Worker แต่ละ Process: อ่านข้อมูลดิบของหนึ่ง Batch ผ่าน Connection แบบ Read-only ของตัวเอง
+    แล้วประมวลผลกฎทางธุรกิจ ส่งผลลัพธ์กลับไปให้ Writer กลาง (ไม่มีการเขียนฐานข้อมูลใน Worker)
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute(
+            'SELECT raw_data, vs_currency FROM v_stg_crypto_markets WHERE batch_id = ?', (batch_id,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    transformer = CryptoTransformer(db_path=db_path, engine=engine)
+    cleaned_data, data_issues = transformer.apply_rules(rows, batch_id)
+    return batch_id, cleaned_data, data_issues
+
+
+class StagingReprocessor:
+    """
+    ประมวลผลประวัติทั้งหมดใน Staging ใหม่แบบขนาน (Process Pool) เพื่อ Rebuild ตาราง fct_crypto_prices
+    แบ่งงานตาม batch_id ให้แต่ละ Process แปลงข้อมูลพร้อมกัน และมี Writer เดียวใน Process หลัก
+    ที่รวบรวมผลลัพธ์แล้วบันทึกเป็น Transaction ขนาดใหญ่ (SQLite รองรับ Writer ได้ครั้งละหนึ่งราย)
+    """
+
+    def __init__(self, db_path: str = None, workers: int = None, engine: str = None):
+        if db_path is None:
+            require_sqlite_backend('Staging reprocess')
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+        self.workers = workers or settings.REPROCESS_WORKERS or os.cpu_count() or 1
+        self.engine = engine or settings.TRANSFORM_ENGINE
+        if self.engine == 'sql':
+            # Engine แบบ SQL ประมวลผลทั้ง Staging ได้ในคำสั่งเดียวอยู่แล้ว จึงใช้ Engine แบบ Python ใน Worker แทน
+            self.engine = 'python'
+
+    def list_batches(self) -> List[str]:
+        """ รายการ batch_id ทั้งหมดใน Staging เรียงตามเวลา (ใช้ดัชนี idx_stg_batch_id) """
+        rows = self.db.connection().execute(
+            'SELECT DISTINCT batch_id FROM stg_crypto_markets ORDER BY batch_id'
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _create_shadow(self, conn):
+        """ สร้างตารางเงาว่างที่มี Schema (รวม Primary Key) เดียวกับ fct_crypto_prices ปัจจุบัน """
+        ddl = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'fct_crypto_prices'"
+        ).fetchone()[0]
+        with conn:
+            conn.execute(f'DROP TABLE IF EXISTS {SHADOW_TABLE}')
+            conn.execute(ddl.replace('fct_crypto_prices', SHADOW_TABLE, 1))
+
+    def _swap_shadow(self, conn, batch_ids: List[str], writer: CryptoTransformer):
+        """
+        แทนที่แถวของ Batch ที่ถูกประมวลผลใหม่ด้วยข้อมูลในตารางเงาใน Transaction เดียว
+        แถวของ Batch ที่ไม่ได้อยู่ใน Staging (เช่น Backfill หรือ Segment ที่ถูก Archive) ไม่ถูกแตะ
+        """
+        with conn:
+            conn.executemany('DELETE FROM fct_crypto_prices WHERE batch_id = ?', ((batch_id,) for batch_id in batch_ids))
+            conn.execute(
+                f'INSERT INTO fct_crypto_prices ({", ".join(FACT_COLUMNS)}) '
+                f'SELECT {", ".join(FACT_COLUMNS)} FROM {SHADOW_TABLE}'
+            )
+            conn.execute(f'DROP TABLE {SHADOW_TABLE}')
+            writer.rollups.rebuild(conn=conn)
+        logger.info("Fact table swapped in from %s for %s batches.", SHADOW_TABLE, len(batch_ids))
+        if writer.mirror is not None:
+            writer.mirror.export_committed()
+
+    def run(self, full_rebuild: bool = False, write_batch_rows: int = None) -> Tuple[int, int]:
+        """
+        Rebuild ตาราง Fact Table จาก Staging
+
+        Args:
+            full_rebuild (bool): แทนที่แถวเดิมของทุก Batch ใน Staging ด้วยผลลัพธ์ใหม่ (ใช้เมื่อกฎทางธุรกิจเปลี่ยน)
+                ผลลัพธ์ถูกเขียนลงตารางเงาก่อนแล้วสลับเข้า Fact Table ใน Transaction เดียว
+                หาก Worker ล้มเหลวระหว่างทาง Fact Table เดิมจึงยังอยู่ครบ
+            write_batch_rows (int, optional): จำนวนแถวขั้นต่ำต่อหนึ่ง Transaction ของ Writer
+
+        Returns:
+            Tuple[int, int]: จำนวนแถวที่บันทึกลง Fact Table และจำนวนแถวที่ถูกคัดออก
+        """
+        write_batch_rows = write_batch_rows or settings.REPROCESS_WRITE_ROWS
+        batch_ids = self.list_batches()
+        logger.info("Reprocessing %s staging batches with %s workers (Engine: %s)", len(batch_ids), self.workers, self.engine)
+
+        writer = CryptoTransformer(db_path=self.db_path, engine='python')
+        conn = self.db.connection()
+        if full_rebuild:
+            self._create_shadow(conn)
+
+        def flush(rows: List[Tuple]):
+            if not full_rebuild:
+                writer.save_to_core(rows)
+                return
+            with conn:
+                conn.executemany(
+                    f'INSERT OR IGNORE INTO {SHADOW_TABLE} ({", ".join(FACT_COLUMNS)}) '
+                    f'VALUES ({", ".join("?" * len(FACT_COLUMNS))})', rows
+                )
+
+        pending: List[Tuple] = []
+        loaded = 0
+        rejected = 0
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            queue = iter(batch_ids)
+            futures: Set[Future] = set()
+            try:
+                while True:
+                    # เติมงานเข้า Pool แบบหน้าต่างเลื่อน ผลลัพธ์ที่ค้างในหน่วยความจำจึงมีไม่เกิน workers * 2 Batch
+                    while len(futures) < self.workers * 2:
+                        batch_id = next(queue, None)
+                        if batch_id is None:
+                            break
+                        futures.add(pool.submit(_transform_batch, self.db_path, batch_id, self.engine))
+                    if not futures:
+                        break
+
+                    finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        batch_id, cleaned_data, data_issues = future.result()
+                        pending.extend(cleaned_data)
+                        rejected += len(data_issues)
+                        if data_issues:
+                            writer.save_rejects(data_issues, batch_id)
+
+                    # Writer เดียว: สะสมผลลัพธ์จากหลาย Batch แล้วบันทึกครั้งเดียวเมื่อครบขนาดที่กำหนด
+                    if len(pending) >= write_batch_rows:
+                        flush(pending)
+                        loaded += len(pending)
+                        pending = []
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        if pending:
+            flush(pending)
+            loaded += len(pending)
+        if full_rebuild:
+            self._swap_shadow(conn, batch_ids, writer)
+
+        logger.info("Reprocess complete: %s rows written, %s rejected across %s batches.", loaded, rejected, len(batch_ids))
+        return loaded, rejected
+
+    def run_archive(self, archive: StagingArchive = None, days: Iterable[str] = None,
+                    batch_ids: Iterable[str] = None) -> Tuple[int, int]:
+        """
+        ประมวลผล Batch ที่ถูกย้ายไปเก็บใน Segment แล้วใหม่ (อ่านแบบ Stream ทีละ Batch ผ่าน StagingArchive.iter_batches)
+
+        Returns:
+            Tuple[int, int]: จำนวนแถวที่บันทึกลง Fact Table และจำนวนแถวที่ถูกคัดออก
+        """
+        archive = archive or StagingArchive(self.db_path)
+        transformer = CryptoTransformer(db_path=self.db_path, engine=self.engine)
+        loaded = 0
+        rejected = 0
+        batches = 0
+        for batch_id, rows in archive.iter_batches(days=days, batch_ids=batch_ids):
+            cleaned_data, data_issues = transformer.apply_rules(rows, batch_id)
+            if data_issues:
+                transformer.save_rejects(data_issues, batch_id)
+            transformer.save_to_core(cleaned_data)
+            loaded += len(cleaned_data)
+            rejected += len(data_issues)
+            batches += 1
+
+        logger.info("Archive reprocess complete: %s rows written, %s rejected across %s batches.", loaded, rejected, batches)
+        return loaded, rejected
@@ -0,0 +1,160 @@
+from typing import Any, Callable, List, Optional, Tuple
+from config.settings import settings
+from src.loaders.backends import CommitHook
+from src.loaders.parquet_mirror import ParquetMirror
+from src.loaders.rollups import MarketRollups
+from src.transformers.crypto_transformer import REJECT_REASON_ZERO_PRICE_OR_VOLUME, REJECT_RULE_ZERO_PRICE_OR_VOLUME
+from src.transformers.records import MarketBatch, coerce_number
+from src.utils.database import get_database, resolve_db_path
+from src.utils.logger import logger
+
+
+def _number(path: str) -> str:
+    """
+    นิพจน์ SQL ที่แปลงค่าตัวเลขจาก JSON ตามกฎเดียวกับ coerce_number ของ Python Engine:
+    คีย์ที่หายไป = 0, integer / real = ค่านั้น, String = แปลงผ่านฟังก์ชัน to_number (เฉพาะแถวที่เป็น String)
+    และค่าอื่น (null / true / false / Object / Array) = NULL
+    """
+    return f'''CASE COALESCE(json_type(raw_data, '{path}'), 'missing')
+            WHEN 'missing' THEN 0
+            WHEN 'integer' THEN json_extract(raw_data, '{path}')
+            WHEN 'real' THEN json_extract(raw_data, '{path}')
+            WHEN 'text' THEN to_number(json_extract(raw_data, '{path}'))
+        END'''
+
+
+# แปลง JSON ใน Staging เป็นคอลัมน์ด้วย json_extract โดยเลียนแบบพฤติกรรมของ CryptoTransformer.transform_logic:
+# - ฟิลด์ตัวเลขถูกแปลงชนิดด้วยกฎเดียวกับ coerce_number (ดู _number)
+# - ราคาที่แปลงไม่ได้ (NULL) ถือว่าเสียหายและถูกข้ามไปด้วย is_corrupt
+# - การเปรียบเทียบเป็นแบบ Short-circuit: ถ้าราคา <= 0 จะไม่ตรวจชนิดของวอลลุ่ม
+_SOURCE_CTE = '''
+WITH parsed AS (
+    SELECT
+        batch_id,
+        vs_currency,
+        json_extract(raw_data, '$.id') AS coin_id,
+        json_extract(raw_data, '$.symbol') AS symbol,
+        json_extract(raw_data, '$.name') AS name,
+        ''' + _number('$.current_price') + ''' AS price,
+        ''' + _number('$.market_cap') + ''' AS market_cap,
+        ''' + _number('$.total_volume') + ''' AS total_volume,
+        json_extract(raw_data, '$.last_updated') AS last_updated_at
+    FROM v_stg_crypto_markets
+    WHERE {batch_filter} json_valid(raw_data) AND json_type(raw_data) = 'object'
+),
+classified AS (
+    SELECT *,
+        CASE
+            WHEN price IS NULL THEN 1
+            WHEN price > 0 AND total_volume IS NULL THEN 1
+            ELSE 0
+        END AS is_corrupt
+    FROM parsed
+)
+'''
+
+# หมายเหตุ: วาง CTE หลัง INSERT เพื่อให้ sqlite3 เปิด Transaction ให้อัตโนมัติ (คำสั่งต้องขึ้นต้นด้วย INSERT)
+_INSERT_CLEAN = '''
+INSERT OR IGNORE INTO fct_crypto_prices
+(batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, vs_currency)
+{source}
+SELECT batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, vs_currency
+FROM classified
+WHERE is_corrupt = 0 AND price > 0 AND total_volume > 0
+'''
+
+_INSERT_REJECTS = '''
+INSERT OR IGNORE INTO rej_crypto_markets
+(batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, vs_currency, reason, rule_id)
+{source}
+SELECT batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, vs_currency, ?, ?
+FROM classified
+WHERE is_corrupt = 0 AND NOT (price > 0 AND total_volume > 0)
+'''
+
+# แถวของ Batch ใน Fact Table พร้อม circulating_supply จาก stg_coin_meta (ไม่ได้เก็บใน Fact Table แต่กฎ DQ
+# market_cap_consistency ต้องใช้) ค่าที่ไม่ใช่ตัวเลขเป็น NULL ตามกฎเดียวกับ coerce_number
+_SELECT_BATCH = '''
+SELECT f.batch_id, f.coin_id, f.symbol, f.name, f.price, f.market_cap, f.total_volume, f.last_updated_at, f.vs_currency,
+    CASE json_type(m.raw_data, '$.circulating_supply')
+        WHEN 'integer' THEN json_extract(m.raw_data, '$.circulating_supply')
+        WHEN 'real' THEN json_extract(m.raw_data, '$.circulating_supply')
+        WHEN 'text' THEN to_number(json_extract(m.raw_data, '$.circulating_supply'))
+    END AS circulating_supply
+FROM fct_crypto_prices f
+LEFT JOIN stg_coin_meta m ON m.batch_id = f.batch_id AND m.coin_id = f.coin_id
+WHERE f.batch_id = ?
+'''
+
+
+class SQLTransformEngine:
+    """
+    Transform Engine แบบ In-database (ELT ตัวจริง): ประมวลผลกฎทางธุรกิจชุดเดียวกับ CryptoTransformer
+    ด้วยคำสั่ง SQL แบบ Set-based ภายใน SQLite โดยตรงจากข้อมูลดิบใน Staging (ผ่าน View v_stg_crypto_markets)
+    ข้อมูลไม่ต้องถูกดึงออกมาเป็น Object ใน Python และการ Backfill ทั้งก้อนเป็นเพียงคำสั่ง INSERT ... SELECT เดียว
+
+    หมายเหตุ: เงื่อนไข price > 0 และ volume > 0 ใน WHERE คัดแถวเสียออกก่อน ส่วนกฎ DQ / การตรวจเชิงสถิติ
+    ระดับ Batch ทำผ่าน validate ของ run() บนแถวที่ได้ ก่อน Commit
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or resolve_db_path()
+        self.db = get_database(self.db_path)
+        self.rollups = MarketRollups(self.db_path)
+        self.mirror = ParquetMirror() if settings.PARQUET_MIRROR_ENABLED else None
+
+    def run(self, batch_id: str = None, validate: Optional[Callable[[List[Tuple[Any, ...]]], None]] = None,
+            on_commit: CommitHook = None) -> Tuple[int, int]:
+        """
+        แปลงข้อมูลใน Staging และบันทึกลง Fact Table / Rejects Table ภายใน Transaction เดียว
+
+        Args:
+            batch_id (str, optional): รหัสชุดข้อมูลที่ต้องการประมวลผล หากไม่ระบุจะประมวลผลทั้ง Staging
+            (ใช้ batch_id ของแต่ละแถวใน Staging เป็นกุญแจของ Fact Table)
+            validate (callable, optional): ตรวจแถวของ Batch ที่ได้ (DQ / Anomaly) ก่อน Commit
+                หาก Raise ทั้ง Transaction ถูก Rollback (ใช้ได้เมื่อระบุ batch_id เท่านั้น)
+            on_commit (callable, optional): งานที่ต้อง Commit พร้อมข้อมูล เช่น สถานะ 'loaded' ใน Ledger
+
+        Returns:
+            Tuple[int, int]: จำนวนแถวที่บันทึกลง Fact Table และจำนวนแถวที่ถูกคัดออก
+        """
+        batch_filter = 'batch_id = ? AND' if batch_id else ''
+        params = (batch_id,) if batch_id else ()
+        source = _SOURCE_CTE.format(batch_filter=batch_filter)
+
+        try:
+            logger.info("Running in-database transformation (Batch: %s)", batch_id)
+            conn = self.db.connection()
+            # String ตัวเลข (เช่น "50000") แปลงด้วยฟังก์ชันเดียวกับ Python Engine เพื่อให้ผลลัพธ์ตรงกันทุกกรณี
+            conn.create_function('to_number', 1, coerce_number, deterministic=True)
+            with conn:
+                loaded = conn.execute(_INSERT_CLEAN.format(source=source), params).rowcount
+                rejected = conn.execute(
+                    _INSERT_REJECTS.format(source=source), params + (REJECT_REASON_ZERO_PRICE_OR_VOLUME, REJECT_RULE_ZERO_PRICE_OR_VOLUME)
+                ).rowcount
+                loaded_rows = MarketBatch()
+                if batch_id:
+                    # ตารางสรุปอัปเดตใน Transaction เดียวกับ Fact Table (อ่านกลับผ่าน Primary Key ที่ขึ้นต้นด้วย batch_id)
+                    for row in conn.execute(_SELECT_BATCH, params):
+                        loaded_rows.append(row[:-1], row[-1])
+                    if validate is not None:
+                        validate(loaded_rows)
+                    self.rollups.apply(loaded_rows, conn=conn)
+                else:
+                    # ทั้ง Staging: สร้างตารางสรุปใหม่จาก Fact Table ของไฟล์นี้ใน Transaction เดียวกัน
+                    self.rollups.rebuild(conn=conn)
+                if on_commit is not None:
+                    on_commit(conn)
+            # หลัง Commit: Mirror ที่ล้มเหลวถูก Log เท่านั้น (สร้างใหม่ได้ด้วย export-parquet)
+            if self.mirror is not None:
+                if batch_id:
+                    self.mirror.write_committed(loaded_rows)
+                else:
+                    self.mirror.export_committed(db_path=self.db_path)
+
+            logger.info("In-database transformation complete: %s loaded, %s rejected.", loaded, rejected)
+            return loaded, rejected
+
+        except Exception as e:
+            logger.error("In-database transformation failed: %s", e)
+            raise
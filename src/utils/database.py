@@ -0,0 +1,492 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, List
+from config.settings import settings
+from src.utils.logger import logger
+
+# Schema ทั้งหมดของคลังข้อมูล จัดเป็นลำดับ Migration (เรียงตาม PRAGMA user_version)
+# การเพิ่มตาราง/ดัชนีใหม่ให้ต่อท้ายรายการนี้เสมอ ห้ามแก้ Migration เดิมที่ถูกใช้งานไปแล้ว
+SCHEMA_MIGRATIONS: List[List[str]] = [
+    # 1: ตารางหลัก (Staging / Fact / Rejects) พร้อมดัชนีสำหรับการค้นหาตาม Batch และ Time-series รายเหรียญ
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS stg_crypto_markets(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            coin_id TEXT,               -- รหัสอ้างอิงของเหรียญ (เช่น 'bitcoin')
+            raw_data TEXT,              -- ข้อมูล JSON ทั้งก้อนที่ได้รับจาก API เก็บในรูปแบบ String
+            extracted_at TIMESTAMP,     -- วันเวลาที่ดึงข้อมูลออกมา
+            batch_id TEXT               -- รหัสชุดข้อมูลเพื่อใช้ระบุรอบการรันของ Pipeline
+        )
+        ''',
+        # ใช้ (batch_id, coin_id) เป็น Primary Key เพื่อป้องกันข้อมูลซ้ำซ้อนในรอบการรันเดียวกัน
+        '''
+        CREATE TABLE IF NOT EXISTS fct_crypto_prices(
+            batch_id TEXT,
+            coin_id TEXT,
+            symbol TEXT,
+            name TEXT,
+            price REAL,
+            market_cap REAL,
+            total_volume REAL,
+            last_updated_at TIMESTAMP,
+            PRIMARY KEY (batch_id, coin_id)
+        )
+        ''',
+        # ตารางเก็บข้อมูลที่ถูกคัดออก (Rejects): ใช้ UNIQUE เพื่อให้รันซ้ำได้โดยไม่เกิดข้อมูลซ้ำ
+        '''
+        CREATE TABLE IF NOT EXISTS rej_crypto_markets(
+            batch_id TEXT,
+            coin_id TEXT,
+            symbol TEXT,
+            name TEXT,
+            price REAL,
+            market_cap REAL,
+            total_volume REAL,
+            last_updated_at TIMESTAMP,
+            reason TEXT,
+            rule_id TEXT,
+            rejected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (batch_id, coin_id, rule_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_stg_batch_id ON stg_crypto_markets(batch_id)',
+        'CREATE INDEX IF NOT EXISTS idx_fct_coin_updated ON fct_crypto_prices(coin_id, last_updated_at)',
+    ],
+    # 2: Ledger ของแต่ละ Batch สำหรับโหมด Incremental และการทำต่อจากขั้นที่ล้มเหลว (ดู src/loaders/batch_ledger.py)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS pipeline_runs(
+            batch_id TEXT PRIMARY KEY,
+            stage TEXT,                 -- ขั้นล่าสุด: extracted, staged, transformed, validated, loaded
+            status TEXT,                -- success หรือ failed
+            row_count INTEGER,
+            error TEXT,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_pipeline_runs_stage ON pipeline_runs(stage, status)',
+    ],
+    # 3: สถิติสะสมรายเหรียญ (Welford) สำหรับการตรวจจับค่าผิดปกติข้าม Batch (ดู src/quality/anomaly.py)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS dq_coin_stats(
+            coin_id TEXT PRIMARY KEY,
+            n INTEGER,                  -- จำนวนตัวอย่างที่สะสมแล้ว
+            price_mean REAL,
+            price_m2 REAL,              -- ผลรวมกำลังสองของส่วนเบี่ยงเบน (ใช้คำนวณความแปรปรวน)
+            volume_mean REAL,
+            volume_m2 REAL,
+            last_price REAL,
+            last_volume REAL,
+            last_batch_id TEXT,
+            updated_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_dq_coin_stats_batch ON dq_coin_stats(last_batch_id)',
+    ],
+    # 4: ตัวชี้วัดประสิทธิภาพรายขั้นตอน/ราย Batch (ดู src/utils/metrics.py)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS pipeline_metrics(
+            run_id TEXT,
+            stage TEXT,
+            batch_id TEXT,
+            started_at TIMESTAMP,
+            wall_seconds REAL,
+            cpu_seconds REAL,
+            rows_in INTEGER,
+            rows_out INTEGER,
+            rows_per_second REAL,
+            bytes_fetched INTEGER,
+            peak_memory_bytes INTEGER,
+            max_rss_bytes INTEGER,
+            retries INTEGER
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_pipeline_metrics_stage ON pipeline_metrics(stage, started_at)',
+    ],
+    # 5: ตารางพักข้อมูลที่ Transform แล้ว ระหว่างขั้น transform -> validate -> load ของ DAG แบบแยกขั้นตอน
+    # (ดู src/pipeline/stages.py) ทำให้แต่ละขั้น Retry ได้เองโดยไม่ต้องประมวลผลขั้นก่อนหน้าซ้ำ
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS int_crypto_prices(
+            batch_id TEXT,
+            coin_id TEXT,
+            symbol TEXT,
+            name TEXT,
+            price REAL,
+            market_cap REAL,
+            total_volume REAL,
+            last_updated_at TIMESTAMP,
+            PRIMARY KEY (batch_id, coin_id)
+        )
+        ''',
+    ],
+    # 6: หลายสกุลเงินต่อหนึ่ง Batch
+    # - Staging เก็บเฉพาะฟิลด์ที่ขึ้นกับสกุลเงินต่อแถว (coin, currency) และเก็บฟิลด์ที่ไม่ขึ้นกับสกุลเงิน
+    #   (name, symbol, image, supply) เพียงครั้งเดียวต่อเหรียญต่อ Batch ใน stg_coin_meta
+    # - View v_stg_crypto_markets ประกอบ JSON กลับเป็นก้อนเดียวให้ Transform Engine อ่านแบบเดิม
+    # - Fact / Rejects / ตารางพัก / สถิติสะสม เพิ่มมิติ vs_currency เข้าไปใน Key (แถวเดิมทั้งหมดเป็น 'usd')
+    [
+        "ALTER TABLE stg_crypto_markets ADD COLUMN vs_currency TEXT NOT NULL DEFAULT 'usd'",
+        '''
+        CREATE TABLE IF NOT EXISTS stg_coin_meta(
+            batch_id TEXT,
+            coin_id TEXT,
+            raw_data TEXT,              -- JSON ของฟิลด์ที่ไม่ขึ้นกับสกุลเงิน
+            PRIMARY KEY (batch_id, coin_id)
+        )
+        ''',
+        # ฟิลด์ของสองฝั่งไม่ซ้ำกัน จึงต่อ JSON Object เป็น String ได้ตรงๆ (เร็วกว่า json_patch และคงค่า null ไว้)
+        '''
+        CREATE VIEW IF NOT EXISTS v_stg_crypto_markets AS
+        SELECT
+            s.id,
+            s.batch_id,
+            s.coin_id,
+            s.vs_currency,
+            s.extracted_at,
+            CASE
+                WHEN m.raw_data IS NULL OR m.raw_data = '{}' THEN s.raw_data
+                WHEN s.raw_data = '{}' THEN m.raw_data
+                ELSE substr(m.raw_data, 1, length(m.raw_data) - 1) || ', ' || substr(s.raw_data, 2)
+            END AS raw_data
+        FROM stg_crypto_markets s
+        LEFT JOIN stg_coin_meta m ON m.batch_id = s.batch_id AND m.coin_id = s.coin_id
+        ''',
+        '''
+        CREATE TABLE fct_crypto_prices_v6(
+            batch_id TEXT,
+            coin_id TEXT,
+            symbol TEXT,
+            name TEXT,
+            price REAL,
+            market_cap REAL,
+            total_volume REAL,
+            last_updated_at TIMESTAMP,
+            vs_currency TEXT NOT NULL DEFAULT 'usd',
+            PRIMARY KEY (batch_id, coin_id, vs_currency)
+        )
+        ''',
+        '''
+        INSERT INTO fct_crypto_prices_v6
+        (batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, vs_currency)
+        SELECT batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, 'usd'
+        FROM fct_crypto_prices
+        ''',
+        'DROP TABLE fct_crypto_prices',
+        'ALTER TABLE fct_crypto_prices_v6 RENAME TO fct_crypto_prices',
+        'CREATE INDEX IF NOT EXISTS idx_fct_coin_updated ON fct_crypto_prices(coin_id, vs_currency, last_updated_at)',
+        '''
+        CREATE TABLE rej_crypto_markets_v6(
+            batch_id TEXT,
+            coin_id TEXT,
+            symbol TEXT,
+            name TEXT,
+            price REAL,
+            market_cap REAL,
+            total_volume REAL,
+            last_updated_at TIMESTAMP,
+            reason TEXT,
+            rule_id TEXT,
+            rejected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            vs_currency TEXT NOT NULL DEFAULT 'usd',
+            UNIQUE (batch_id, coin_id, vs_currency, rule_id)
+        )
+        ''',
+        '''
+        INSERT INTO rej_crypto_markets_v6
+        (batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, reason, rule_id,
+         rejected_at, vs_currency)
+        SELECT batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, reason, rule_id,
+               rejected_at, 'usd'
+        FROM rej_crypto_markets
+        ''',
+        'DROP TABLE rej_crypto_markets',
+        'ALTER TABLE rej_crypto_markets_v6 RENAME TO rej_crypto_markets',
+        '''
+        CREATE TABLE int_crypto_prices_v6(
+            batch_id TEXT,
+            coin_id TEXT,
+            symbol TEXT,
+            name TEXT,
+            price REAL,
+            market_cap REAL,
+            total_volume REAL,
+            last_updated_at TIMESTAMP,
+            vs_currency TEXT NOT NULL DEFAULT 'usd',
+            PRIMARY KEY (batch_id, coin_id, vs_currency)
+        )
+        ''',
+        '''
+        INSERT INTO int_crypto_prices_v6
+        (batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, vs_currency)
+        SELECT batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, 'usd'
+        FROM int_crypto_prices
+        ''',
+        'DROP TABLE int_crypto_prices',
+        'ALTER TABLE int_crypto_prices_v6 RENAME TO int_crypto_prices',
+        '''
+        CREATE TABLE dq_coin_stats_v6(
+            coin_id TEXT,
+            vs_currency TEXT NOT NULL DEFAULT 'usd',
+            n INTEGER,
+            price_mean REAL,
+            price_m2 REAL,
+            volume_mean REAL,
+            volume_m2 REAL,
+            last_price REAL,
+            last_volume REAL,
+            last_batch_id TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (coin_id, vs_currency)
+        )
+        ''',
+        '''
+        INSERT INTO dq_coin_stats_v6
+        (coin_id, vs_currency, n, price_mean, price_m2, volume_mean, volume_m2, last_price, last_volume,
+         last_batch_id, updated_at)
+        SELECT coin_id, 'usd', n, price_mean, price_m2, volume_mean, volume_m2, last_price, last_volume,
+               last_batch_id, updated_at
+        FROM dq_coin_stats
+        ''',
+        'DROP TABLE dq_coin_stats',
+        'ALTER TABLE dq_coin_stats_v6 RENAME TO dq_coin_stats',
+        'CREATE INDEX IF NOT EXISTS idx_dq_coin_stats_batch ON dq_coin_stats(last_batch_id)',
+    ],
+    # 7: ดัชนีของ rej_crypto_markets สำหรับการค้นหาเพื่อทำ RCA ตามเหรียญ / เหตุผล / ช่วงเวลา (ดู src/loaders/rejects_store.py)
+    [
+        'CREATE INDEX IF NOT EXISTS idx_rej_coin_time ON rej_crypto_markets(coin_id, rejected_at)',
+        'CREATE INDEX IF NOT EXISTS idx_rej_reason_time ON rej_crypto_markets(reason, rejected_at)',
+        'CREATE INDEX IF NOT EXISTS idx_rej_time ON rej_crypto_markets(rejected_at)',
+    ],
+    # 8: Change Data Capture (ดู src/loaders/change_tracker.py)
+    # - cdc_coin_fingerprints: ลายนิ้วมือของเวอร์ชันล่าสุดที่ถูกบันทึกจริงต่อ (เหรียญ, สกุลเงิน)
+    # - cdc_unchanged_refs: เหรียญที่ไม่เปลี่ยนใน Batch ใด ชี้ไปยัง Batch ที่เก็บเวอร์ชันนั้นไว้
+    # - v_fct_crypto_prices_snapshot: ภาพรวมครบทุกเหรียญต่อ Batch (แถวจริง + แถวที่อ้างอิงจาก Batch ก่อนหน้า)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS cdc_coin_fingerprints(
+            coin_id TEXT,
+            vs_currency TEXT,
+            fingerprint TEXT,
+            last_updated TEXT,
+            batch_id TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (coin_id, vs_currency)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS cdc_unchanged_refs(
+            batch_id TEXT,
+            coin_id TEXT,
+            vs_currency TEXT,
+            ref_batch_id TEXT,
+            PRIMARY KEY (batch_id, coin_id, vs_currency)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE VIEW IF NOT EXISTS v_fct_crypto_prices_snapshot AS
+        SELECT batch_id, coin_id, symbol, name, price, market_cap, total_volume, last_updated_at, vs_currency,
+               batch_id AS source_batch_id
+        FROM fct_crypto_prices
+        UNION ALL
+        SELECT r.batch_id, f.coin_id, f.symbol, f.name, f.price, f.market_cap, f.total_volume, f.last_updated_at,
+               f.vs_currency, f.batch_id AS source_batch_id
+        FROM cdc_unchanged_refs r
+        JOIN fct_crypto_prices f
+          ON f.batch_id = r.ref_batch_id AND f.coin_id = r.coin_id AND f.vs_currency = r.vs_currency
+        ''',
+    ],
+    # 9: Checkpoint ของการดึงข้อมูลย้อนหลัง ต่อ (เหรียญ, สกุลเงิน, ช่วงเวลา) (ดู src/pipeline/backfill.py)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS backfill_progress(
+            coin_id TEXT,
+            vs_currency TEXT,
+            range_start INTEGER,        -- UNIX Timestamp (วินาที)
+            range_end INTEGER,
+            status TEXT,                -- 'done' | 'failed'
+            row_count INTEGER,
+            error TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (coin_id, vs_currency, range_start, range_end)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 10: ตารางสรุปที่อัปเดตแบบ Incremental ทุกครั้งที่โหลด Fact Table (ดู src/loaders/rollups.py)
+    # - dim_coin_latest: ข้อมูลล่าสุดต่อ (เหรียญ, สกุลเงิน)
+    # - agg_crypto_ohlc_hourly / agg_crypto_ohlc_daily: ราคาเปิด / สูงสุด / ต่ำสุด / ปิด ต่อช่วงเวลา
+    #   (Primary Key เริ่มด้วยเหรียญ การค้นหาช่วงเวลาของเหรียญหนึ่งจึงอ่านเฉพาะช่วงที่ต้องการ)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS dim_coin_latest(
+            coin_id TEXT,
+            vs_currency TEXT,
+            symbol TEXT,
+            name TEXT,
+            price REAL,
+            market_cap REAL,
+            total_volume REAL,
+            last_updated_at TIMESTAMP,
+            observed_at TEXT,           -- เวลาของข้อมูลแบบ 'YYYY-MM-DDTHH:MM:SS' (ใช้เรียงลำดับเวอร์ชัน)
+            batch_id TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (coin_id, vs_currency)
+        ) WITHOUT ROWID
+        ''',
+    ] + [
+        f'''
+        CREATE TABLE IF NOT EXISTS agg_crypto_ohlc_{interval}(
+            coin_id TEXT,
+            vs_currency TEXT,
+            bucket TEXT,                -- เวลาเริ่มของช่วง ('YYYY-MM-DDTHH:00:00' หรือ 'YYYY-MM-DD')
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            market_cap REAL,            -- ค่า ณ ราคาปิด
+            total_volume REAL,          -- วอลลุ่ม 24 ชั่วโมง ณ ราคาปิด
+            open_at TEXT,
+            open_batch_id TEXT,
+            close_at TEXT,
+            close_batch_id TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (coin_id, vs_currency, bucket)
+        ) WITHOUT ROWID
+        '''
+        for interval in ('hourly', 'daily')
+    ],
+    # 11: ลายนิ้วมือของ CDC ที่รอการโหลด: เขียนตอน Staging และย้ายเข้า cdc_coin_fingerprints เมื่อ Batch ถูกบันทึกว่า
+    # 'loaded' เท่านั้น (Batch ที่ไม่ผ่าน DQ หรือยังไม่โหลดจึงไม่ถูกใช้เป็นเวอร์ชันอ้างอิงของ Batch ถัดไป)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS cdc_pending_fingerprints(
+            batch_id TEXT,
+            coin_id TEXT,
+            vs_currency TEXT,
+            fingerprint TEXT,
+            last_updated TEXT,
+            PRIMARY KEY (batch_id, coin_id, vs_currency)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 12: จำนวนครั้งที่ Batch ล้มเหลว: เมื่อครบ settings.BATCH_MAX_ATTEMPTS สถานะเปลี่ยนเป็น 'rejected' (สถานะสิ้นสุด)
+    # และโหมด Incremental จะไม่หยิบ Batch นั้นมาประมวลผลซ้ำอีก
+    [
+        'ALTER TABLE pipeline_runs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0',
+    ],
+    # 13: circulating_supply ของแถวที่พักไว้ระหว่างขั้น transform กับ validate ของ DAG (ไม่อยู่ใน Fact Table)
+    # เพื่อให้กฎ DQ market_cap_consistency ตรวจได้ในเส้นทางแบบแยกขั้นตอนเช่นเดียวกับการรันแบบรวด
+    [
+        'ALTER TABLE int_crypto_prices ADD COLUMN circulating_supply REAL',
+    ],
+]
+
+
+def resolve_db_path(database_url: str = None) -> str:
+    """
+    ดึงที่อยู่ไฟล์ฐานข้อมูลโดยการตัด prefix 'sqlite:///' ออก
+    หาก DATABASE_URL เป็น Backend อื่น (เช่น PostgreSQL ซึ่งเก็บเฉพาะ Staging / Fact ดู src/loaders/backends.py)
+    ตารางสถานะของ Pipeline จะอยู่ในไฟล์ SQLite ตาม settings.STATE_DB_PATH
+    """
+    database_url = database_url or settings.DATABASE_URL
+    if not database_url.startswith('sqlite:'):
+        return settings.STATE_DB_PATH
+    return database_url.replace('sqlite:///', '').strip()
+
+
+class Database:
+    """
+    ตัวจัดการการเชื่อมต่อ SQLite ที่ใช้ร่วมกันทั้ง Pipeline (Loader / Transformer / Engine อื่นๆ)
+    - เปิด Connection หนึ่งเส้นต่อ Thread และใช้ซ้ำตลอดอายุ Process (Prepared Statement ถูกแคชต่อ Connection)
+    - ตั้งค่า PRAGMA สำหรับงาน ELT: WAL, synchronous=NORMAL, Page Cache และ Memory-mapped I/O
+    - สร้างและ Migrate Schema/ดัชนีเพียงครั้งเดียวต่อไฟล์ฐานข้อมูล แทนการสั่ง CREATE TABLE ทุกครั้งที่โหลด
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        คืนค่า Connection ของ Thread ปัจจุบัน (สร้างใหม่หากยังไม่มี หรือหาก Process ถูก Fork มา)
+        ใช้ร่วมกับ `with conn:` เพื่อให้ Commit/Rollback อัตโนมัติ
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=settings.SQLITE_BUSY_TIMEOUT_SECONDS,
+            cached_statements=256
+        )
+        # ต้องตั้งก่อนสร้างตารางแรกจึงมีผลกับไฟล์ใหม่ (ไฟล์เดิมถูกเปลี่ยนโหมดโดย StagingArchive ตอน Compaction ครั้งแรก)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}')
+        conn.execute(f'PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE_MB) * 1024 * 1024}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        self._ensure_schema(conn)
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection):
+        """
+        ใช้ Migration ที่ยังไม่เคยถูกใช้กับไฟล์นี้ (ตรวจจาก PRAGMA user_version)
+
+        แต่ละ Migration รันใน BEGIN IMMEDIATE ของตัวเอง (ถือ Write Lock ของไฟล์ตั้งแต่ต้น) และอ่าน user_version ซ้ำ
+        ภายใน Transaction: หลาย Process ที่เปิดไฟล์พร้อมกันจึงไม่ใช้ Migration เดียวกันซ้ำ และ DDL กับ user_version
+        ถูก Commit หรือ Rollback พร้อมกันทั้งก้อน (sqlite3 ไม่เปิด Transaction ให้คำสั่ง DDL เอง)
+        """
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            while conn.execute('PRAGMA user_version').fetchone()[0] < len(SCHEMA_MIGRATIONS):
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    version = conn.execute('PRAGMA user_version').fetchone()[0]
+                    if version < len(SCHEMA_MIGRATIONS):
+                        for statement in SCHEMA_MIGRATIONS[version]:
+                            conn.execute(statement)
+                        conn.execute(f'PRAGMA user_version = {version + 1}')
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                if version < len(SCHEMA_MIGRATIONS):
+                    logger.info("Applied schema migration %s to %s", version + 1, self.db_path)
+            self._schema_ready = True
+
+    def close(self):
+        """ ปิด Connection ของ Thread ปัจจุบัน """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_databases: Dict[str, Database] = {}
+_registry_lock = threading.Lock()
+
+
+def get_database(db_path: str = None) -> Database:
+    """
+    คืนค่า Database ที่ใช้ร่วมกันสำหรับไฟล์ฐานข้อมูลหนึ่งไฟล์ (หนึ่ง Instance ต่อ Path ภายใน Process)
+    """
+    db_path = db_path or resolve_db_path()
+    with _registry_lock:
+        if db_path not in _databases:
+            _databases[db_path] = Database(db_path)
+        return _databases[db_path]
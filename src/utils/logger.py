@@ -1,22 +1,243 @@
+import atexit
+import json
 import logging
+import os
+import queue
 import sys
-from pathlib import Path 
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+from config.settings import settings
+
+# บริบทของ Log ใน Context ปัจจุบัน (เช่น batch_id / stage) จะถูกแนบไปกับทุก Record โดยอัตโนมัติ
+_log_context = ContextVar('log_context', default={})
+
+# ฟิลด์มาตรฐานของ LogRecord ที่ไม่ต้องส่งออกซ้ำในฟิลด์ Context ของ JSON
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """
+    ผูกบริบท (เช่น batch_id='20260101_050000', stage='transform') ให้กับทุก Log ภายในบล็อกนี้
+    บริบทซ้อนกันได้ และแยกกันตาม Thread / Task โดยอัตโนมัติ (ContextVar)
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """ แนบบริบทจาก log_context() ลงใน Record (ทำงานใน Thread ของผู้เรียก ก่อนเข้าคิว) """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    จำกัดจำนวน Log ที่มีแม่แบบข้อความ (msg ก่อนแทนค่า) เดียวกันไม่ให้เกิน max_per_window ต่อช่วงเวลา
+    ข้อความที่เกินจะถูกทิ้งและนับไว้ แล้วรายงานเป็นฟิลด์ suppressed ใน Log ถัดไปของแม่แบบนั้น
+    ป้องกันไม่ให้ Batch ที่ข้อมูลเสียทั้งก้อนทำให้ Pipeline ช้าลงเพราะการเขียน Log
+    Log ระดับ ERROR ขึ้นไปผ่านเสมอ (ไม่ถูกจำกัด) เพื่อไม่ให้ความล้มเหลวจริงหายไปจาก Log
+    """
+
+    def __init__(self, max_per_window: int, window_seconds: float = 60.0):
+        super().__init__()
+        self.max_per_window = max_per_window
+        self.window_seconds = window_seconds
+        self._windows: Dict[Tuple[str, int, Any], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.max_per_window <= 0 or record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.window_seconds:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.max_per_window:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class JsonFormatter(logging.Formatter):
+    """ จัดรูปแบบ Log เป็น JSON หนึ่งบรรทัดต่อหนึ่ง Record (JSON Lines) พร้อมฟิลด์บริบท """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exc_info'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class ContextTextFormatter(logging.Formatter):
+    """ รูปแบบข้อความเดิมสำหรับหน้าจอ พร้อมต่อท้ายด้วยฟิลด์บริบท (ถ้ามี) """
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        extras = {key: value for key, value in vars(record).items()
+                  if key not in _RECORD_ATTRS and not key.startswith('_')}
+        if extras:
+            message += ' [' + ' '.join(f'{key}={value}' for key, value in extras.items()) + ']'
+        return message
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler ที่ไม่แทนค่าข้อความใน Thread ของผู้เรียก: การ Format (%-style) และ I/O
+    ทั้งหมดเกิดขึ้นใน Thread ของ QueueListener ผู้เรียกจ่ายเพียงค่าสร้าง Record และใส่คิว
+    (ข้อกำหนด: args ที่ส่งให้ logger ต้องไม่ถูกแก้ไขหลังเรียก ซึ่งเป็นจริงสำหรับค่าตัวเลข/String ที่ใช้ในโปรเจกต์)
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Traceback ต้องถูกแปลงเป็นข้อความก่อนเข้าคิว เพื่อไม่ให้ Frame ของผู้เรียกค้างอยู่ในหน่วยความจำ
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogAggregator:
+    """
+    รวม Log ที่เกิดซ้ำทีละแถวใน Hot Loop: ส่งออกจริงเพียง sample รายการแรก ที่เหลือนับไว้
+    แล้วสรุปเป็น Log บรรทัดเดียวตอนจบ (ใช้ผ่าน aggregate_log())
+    """
+
+    def __init__(self, target: logging.Logger, level: int, msg: str, sample: int):
+        self.target = target
+        self.level = level
+        self.msg = msg
+        self.sample = sample
+        self.count = 0
+
+    def add(self, *args: Any):
+        self.count += 1
+        if self.count <= self.sample:
+            self.target.log(self.level, self.msg, *args)
+
+    def flush(self):
+        if self.count > self.sample:
+            self.target.log(self.level, '%s: %d more occurrences suppressed (%d total)',
+                            self.msg.split('%')[0].rstrip(' :-'), self.count - self.sample, self.count)
+
+
+@contextmanager
+def aggregate_log(msg: str, level: int = logging.ERROR, sample: int = 3,
+                  target: logging.Logger = None) -> Iterator[LogAggregator]:
+    """
+    ใช้ใน Loop ที่อาจ Log ซ้ำทุกแถว:
+        with aggregate_log('Data corruption detected - JSON Parsing Error: %s') as corrupt:
+            for row in rows:
+                ...
+                corrupt.add(e)
+    """
+    aggregator = LogAggregator(target or logger, level, msg, sample)
+    try:
+        yield aggregator
+    finally:
+        aggregator.flush()
+
+
+def setup_logger() -> logging.Logger:
+    """ ตั้งค่า Logger ของ Pipeline (สร้างโฟลเดอร์ logs, เปิดไฟล์ และเริ่ม Thread ของ Listener) """
+    pipeline_logger = logging.getLogger('cryptoPipeline')
+    pipeline_logger.setLevel(settings.LOG_LEVEL)
+    # Filter ระดับ Logger ทำงานใน Thread ของผู้เรียก และมีผลไม่ว่า Log จะถูกส่งต่อไปยัง Handler ใด
+    pipeline_logger.addFilter(ContextFilter())
+    pipeline_logger.addFilter(RateLimitFilter(settings.LOG_RATE_LIMIT_PER_MINUTE, window_seconds=60.0))
+
+    # ติดตั้งที่ Root Logger เหมือน basicConfig เดิม: หากมี Handler อยู่แล้ว (เช่น รันภายใต้ Airflow)
+    # จะไม่ติดตั้งซ้ำ และปล่อยให้ Log ไหลไปยัง Handler ของระบบนั้นตามปกติ
+    root = logging.getLogger()
+    if root.handlers:
+        return pipeline_logger
 
-def setup_logger():
     #  สร้าง Folder logs ถ้ายังไม่มี
     log_dir = Path('logs')
     log_dir.mkdir(exist_ok= True)
 
-    #ตั้งค่ารูปแบบของ Log (เวลา | ระดับความรุนแรง | ข้อความ)
-    log_format = "%(asctime)s - %(name)s = %(levelname)s - %(message)s"
-
-    logging.basicConfig(
-        level=logging.INFO,
-        format=log_format,
-        handlers=[
-            logging.FileHandler('logs/pipeline.log'), #บันทึกลงไฟล์
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    return logging.getLogger('cryptoPipeline')
-logger = setup_logger()
\ No newline at end of file
+    # Handler ที่ทำ I/O จริงทำงานใน Thread ของ QueueListener: ไฟล์เป็น JSON Lines, หน้าจอเป็นข้อความ
+    # (เวลา | ระดับความรุนแรง | ข้อความ [บริบท])
+    file_handler = logging.FileHandler('logs/pipeline.log')
+    file_handler.setFormatter(JsonFormatter())
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(ContextTextFormatter("%(asctime)s - %(name)s = %(levelname)s - %(message)s"))
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    # ส่ง Log ที่ค้างในคิวให้หมดก่อนโปรแกรมจบ
+    atexit.register(listener.stop)
+
+    queue_handler = DeferredQueueHandler(log_queue)
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+
+    # Process ลูกที่ถูก Fork (เช่น Worker ของ reprocess) ไม่มี Thread ของ Listener ติดมาด้วย
+    # จึงให้ Process ลูกเขียนผ่าน Handler โดยตรงแทนคิว
+    def _use_direct_handlers():
+        root.removeHandler(queue_handler)
+        root.addHandler(file_handler)
+        root.addHandler(stream_handler)
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_use_direct_handlers)
+    return pipeline_logger
+
+
+class LazyLogger:
+    """
+    ตัวแทน (Proxy) ของ Logger ที่เรียก setup_logger() เมื่อมีการใช้งานครั้งแรกเท่านั้น
+    การ import โมดูลจึงไม่สร้างโฟลเดอร์ ไม่เปิดไฟล์ และไม่เริ่ม Thread (เช่น ตอน Airflow Parse DAG)
+    """
+
+    def __init__(self):
+        self._logger = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> logging.Logger:
+        if self._logger is None:
+            with self._lock:
+                if self._logger is None:
+                    self._logger = setup_logger()
+        return self._logger
+
+    @property
+    def loaded(self) -> bool:
+        return self._logger is not None
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+
+logger = LazyLogger()
@@ -0,0 +1,200 @@
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from src.utils.logger import log_context
+
+try:
+    import resource
+except ImportError:  # resource ไม่มีบน Windows: ข้ามการวัด RSS
+    resource = None
+
+# PipelineMetrics ที่กำลังทำงานอยู่ใน Context ปัจจุบัน (None = ไม่ได้เปิดการวัดผล ทุก Hook จะไม่ทำอะไร)
+_active_metrics = ContextVar('active_metrics', default=None)
+
+_METRIC_FIELDS = ('wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out', 'rows_per_second',
+                  'bytes_fetched', 'peak_memory_bytes', 'max_rss_bytes', 'retries')
+
+
+class StageMetrics:
+    """ ตัวชี้วัดประสิทธิภาพของหนึ่งขั้นตอนในหนึ่ง Batch """
+
+    def __init__(self, stage: str, batch_id: str = None):
+        self.stage = stage
+        self.batch_id = batch_id
+        self.started_at = datetime.now().isoformat()
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.rows_in: Optional[int] = None
+        self.rows_out: Optional[int] = None
+        self.bytes_fetched = 0
+        self.peak_memory_bytes: Optional[int] = None
+        self.max_rss_bytes: Optional[int] = None
+        self.retries = 0
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        if rows is None or self.wall_seconds <= 0:
+            return None
+        return rows / self.wall_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {'stage': self.stage, 'batch_id': self.batch_id, 'started_at': self.started_at}
+        result.update({field: getattr(self, field) for field in _METRIC_FIELDS})
+        return result
+
+
+class PipelineMetrics:
+    """
+    ชั้นการวัดผลในตัว (Instrumentation) ของ Pipeline: บันทึกเวลา Wall/CPU, จำนวนแถวเข้า/ออก, อัตราแถวต่อวินาที,
+    ปริมาณข้อมูลที่ดึงจาก API, หน่วยความจำสูงสุด และจำนวน Retry แยกตามขั้นตอนและ Batch
+    ผลลัพธ์บันทึกลงตาราง pipeline_metrics และ Export เป็น JSON / Prometheus Textfile เพื่อใช้ทำกราฟ Regression
+
+    ใช้งาน:
+        with PipelineMetrics() as metrics:
+            ...  # ทุก Component ที่เรียก track_stage() จะบันทึกผลเข้ามาที่นี่โดยอัตโนมัติ
+        metrics.save()
+    """
+
+    def __init__(self, run_id: str = None, trace_memory: bool = False):
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d_%H%M%S')
+        # tracemalloc ให้ค่าหน่วยความจำที่แม่นยำต่อขั้นตอน แต่ทำให้การจองหน่วยความจำช้าลง จึงปิดไว้เป็นค่าเริ่มต้น
+        self.trace_memory = trace_memory
+        self.stages: List[StageMetrics] = []
+        self._token = None
+        self._started_tracing = False
+
+    def __enter__(self) -> 'PipelineMetrics':
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._token = _active_metrics.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active_metrics.reset(self._token)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    @contextmanager
+    def stage(self, name: str, batch_id: str = None) -> Iterator[StageMetrics]:
+        """ วัดผลหนึ่งขั้นตอน: ผู้เรียกกำหนด rows_in / rows_out / bytes_fetched / retries ให้ Object ที่ได้รับได้ """
+        metrics = StageMetrics(name, batch_id)
+        tracing = tracemalloc.is_tracing()
+        if tracing and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield metrics
+        finally:
+            metrics.wall_seconds = time.perf_counter() - wall_start
+            metrics.cpu_seconds = time.process_time() - cpu_start
+            if tracing:
+                metrics.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+            if resource is not None:
+                # ru_maxrss บน Linux มีหน่วยเป็น KB
+                metrics.max_rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            self.stages.append(metrics)
+
+    def save(self, db_path: str = None):
+        """ บันทึกตัวชี้วัดทุกขั้นตอนลงตาราง pipeline_metrics """
+        from src.utils.database import get_database
+
+        conn = get_database(db_path).connection()
+        with conn:
+            conn.executemany(
+                f'''
+                INSERT INTO pipeline_metrics (run_id, stage, batch_id, started_at, {", ".join(_METRIC_FIELDS)})
+                VALUES (?, ?, ?, ?, {", ".join("?" * len(_METRIC_FIELDS))})
+                ''',
+                [
+                    (self.run_id, s.stage, s.batch_id, s.started_at, *(getattr(s, f) for f in _METRIC_FIELDS))
+                    for s in self.stages
+                ]
+            )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'run_id': self.run_id, 'stages': [s.to_dict() for s in self.stages]}
+
+    def export_json(self, path: str):
+        _atomic_write(path, json.dumps(self.to_dict(), ensure_ascii=False, indent=2))
+
+    def export_prometheus(self, path: str):
+        """
+        เขียนไฟล์รูปแบบ Prometheus Textfile (สำหรับ node_exporter textfile collector)
+        Label มีเฉพาะ stage: batch_id เปลี่ยนทุกรอบจึงไม่ใส่เป็น Label (ทำให้ Cardinality ของ Series โตไม่สิ้นสุด)
+        หากขั้นเดียวกันถูกวัดหลายครั้งในรอบเดียว ใช้ค่าล่าสุด
+        """
+        lines = []
+        for field in _METRIC_FIELDS:
+            metric = f'crypto_pipeline_stage_{field}'
+            lines.append(f'# TYPE {metric} gauge')
+            values = {}
+            for s in self.stages:
+                value = getattr(s, field)
+                if value is not None:
+                    values[s.stage] = value
+            lines.extend(f'{metric}{{stage="{stage}"}} {value}' for stage, value in values.items())
+        _atomic_write(path, '\n'.join(lines) + '\n')
+
+    def export(self, directory: str):
+        """ Export ทั้ง JSON (รายรอบ) และ Prometheus Textfile (ไฟล์ล่าสุดไฟล์เดียว) """
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.export_json(os.path.join(directory, f'metrics_{self.run_id}.json'))
+        self.export_prometheus(os.path.join(directory, 'crypto_pipeline.prom'))
+
+
+def _atomic_write(path: str, content: str):
+    # เขียนลงไฟล์ชั่วคราว (ชื่อไม่ซ้ำ ในโฟลเดอร์เดียวกัน) แล้วเปลี่ยนชื่อ เพื่อไม่ให้ผู้อ่าน (เช่น node_exporter)
+    # เห็นไฟล์ที่เขียนไม่เสร็จ และหลาย Process ที่ Export พร้อมกันไม่เขียนทับไฟล์ชั่วคราวของกันและกัน
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(path) or '.',
+                                     prefix=f'.{os.path.basename(path)}.', suffix='.tmp', delete=False) as f:
+        f.write(content)
+    try:
+        # NamedTemporaryFile สร้างไฟล์แบบ 0600: เปิดสิทธิ์อ่านให้ Collector ที่รันด้วยผู้ใช้อื่น
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, path)
+    except OSError:
+        os.unlink(f.name)
+        raise
+
+
+@contextmanager
+def track_stage(name: str, batch_id: str = None) -> Iterator[StageMetrics]:
+    """
+    Hook สำหรับ Component ต่างๆ: วัดผลเข้า PipelineMetrics ที่กำลังทำงานอยู่ และผูกบริบท stage / batch_id
+    ให้กับทุก Log ภายในขั้นตอนนี้ หากไม่มีการเปิดวัดผล จะคืน Object เปล่าที่ไม่ถูกบันทึก (ค่าใช้จ่ายแทบเป็นศูนย์)
+    """
+    context = {'stage': name, 'batch_id': batch_id} if batch_id else {'stage': name}
+    with log_context(**context):
+        metrics = _active_metrics.get()
+        if metrics is None:
+            yield StageMetrics(name, batch_id)
+            return
+        with metrics.stage(name, batch_id) as stage:
+            yield stage
+
+
+def record_stage(name: str, batch_id: str = None, wall_seconds: float = 0.0, cpu_seconds: float = 0.0,
+                 **values) -> Optional[StageMetrics]:
+    """ บันทึกขั้นตอนที่วัดเวลาเองแล้ว (เช่น เวลารวมเฉพาะช่วงเขียน Staging ที่สลับกับการดึง API แบบ Stream) """
+    metrics = _active_metrics.get()
+    if metrics is None:
+        return None
+    stage = StageMetrics(name, batch_id)
+    stage.wall_seconds = wall_seconds
+    stage.cpu_seconds = cpu_seconds
+    for key, value in values.items():
+        setattr(stage, key, value)
+    metrics.stages.append(stage)
+    return stage
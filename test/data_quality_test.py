@@ -1,6 +1,7 @@
 import pytest
 from src.quality.data_quality import DataqualityValidator
 
+
 def test_validator_datects_negative_price():
     validator = DataqualityValidator()
 
@@ -12,6 +13,7 @@ def test_validator_datects_negative_price():
     # ผลลัพธ์ที่คาดหวัง: Validator ต้องส่งกลับมาเป็น False (ไม่ผ่าน)
     assert validator.validate_market_data(bad_data) is False
 
+
 def test_validator_passes_good_data():
     validator = DataqualityValidator()
 
@@ -21,4 +23,85 @@ def test_validator_passes_good_data():
     ]
 
     #ผลลัพธ์ที่คาดหวัง: ต้องผ่าน (True)
-    assert validator.validate_market_data(good_data) is True
\ No newline at end of file
+    assert validator.validate_market_data(good_data) is True
+
+
+def test_validator_reports_violation_counts_and_samples():
+    validator = DataqualityValidator()
+
+    #ข้อมูลที่มีปัญหาหลายแบบ: ราคาเป็น 0, วอลลุ่มไม่ใช่ตัวเลข และ coin_id ซ้ำ
+    data = [
+        ("b1", "bitcoin", "btc", "Bitcoin", 50000.0, 1000000.0, 5000.0, None),
+        ("b1", "dead", "dd", "Dead", 0.0, 0.0, 10.0, None),
+        ("b1", "broken", "br", "Broken", 1.0, 1.0, "n/a", None),
+        ("b1", "bitcoin", "btc", "Bitcoin", 50000.0, 1000000.0, 5000.0, None),
+    ]
+
+    report = validator.evaluate(data)
+
+    assert report.violations['price_positive'] == 1
+    assert report.violations['total_volume_numeric'] == 1
+    assert report.violations['coin_id_unique'] == 1
+    assert report.samples['price_positive'] == ['dead']
+    assert report.failed_rows == 3
+    assert report.passed is False
+
+
+def test_validator_failure_threshold_allows_small_error_rate():
+    #ยอมให้มีแถวที่มีปัญหาได้ไม่เกิน 30% ของ Batch
+    validator = DataqualityValidator(failure_threshold=0.3)
+    data = [("b1", f"coin-{i}", "c", "Coin", 1.0, 1.0, 1.0, None) for i in range(9)]
+    data.append(("b1", "dead", "dd", "Dead", -1.0, 1.0, 1.0, None))
+
+    assert validator.validate_market_data(data) is True
+
+
+def test_market_cap_consistency_rule_uses_supply_column():
+    validator = DataqualityValidator()
+    columns = {
+        'coin_id': ['ok', 'off'],
+        'price': [2.0, 2.0],
+        'market_cap': [200.0, 500.0],
+        'total_volume': [1.0, 1.0],
+        'circulating_supply': [100.0, 100.0],
+    }
+
+    report = validator.evaluate(columns)
+
+    #กฎความสอดคล้องเป็นระดับ warning: รายงานแต่ไม่ทำให้ Batch ตก
+    assert report.violations['market_cap_consistency'] == 1
+    assert report.samples['market_cap_consistency'] == ['off']
+    assert report.passed is True
+
+
+def test_anomaly_detector_flags_price_spike_and_dropped_coin(tmp_path):
+    from src.quality.anomaly import AnomalyDetector
+
+    detector = AnomalyDetector(db_path=str(tmp_path / 'stats.db'), min_samples=3)
+
+    #สร้างสถิติสะสมจากหลาย Batch ที่ราคาแกว่งเล็กน้อย
+    for i, price in enumerate([100.0, 101.0, 99.0, 100.5, 100.2]):
+        detector.update([
+            ("b%d" % i, "bitcoin", "btc", "Bitcoin", price, 1.0, 5000.0 + i, None),
+            ("b%d" % i, "tail", "tl", "Tail", 1.0, 1.0, 10.0, None),
+        ], batch_id="b%d" % i)
+
+    #Batch ใหม่: ราคา bitcoin กระโดด 1000 เท่า และเหรียญ tail หายไป
+    report = detector.check([("b5", "bitcoin", "btc", "Bitcoin", 100000.0, 1.0, 5003.0, None)], batch_id="b5")
+
+    assert [(a.coin_id, a.metric) for a in report.anomalies] == [("bitcoin", "price")]
+    assert report.dropped_coins == ["tail"]
+
+
+def test_anomaly_stats_update_is_idempotent_per_batch(tmp_path):
+    from src.quality.anomaly import AnomalyDetector
+
+    detector = AnomalyDetector(db_path=str(tmp_path / 'stats.db'))
+    rows = [("b0", "bitcoin", "btc", "Bitcoin", 100.0, 1.0, 5000.0, None)]
+
+    #โหลด Batch เดิมซ้ำ (เช่น Retry หลังล้มเหลว) ต้องไม่นับค่าเดิมสองครั้ง
+    detector.update(rows, batch_id="b0")
+    detector.update(rows, batch_id="b0")
+
+    n = detector.db.connection().execute("SELECT n FROM dq_coin_stats WHERE coin_id = 'bitcoin'").fetchone()[0]
+    assert n == 1
@@ -0,0 +1,34 @@
+from tenacity import wait_none
+from benchmarks.api_stub import CoingeckoStub
+from benchmarks.payloads import generate_market_payload, market_page
+from src.extractors.coingecko import CoingeckoClient
+from src.extractors.rate_limiter import TokenBucket
+
+def test_payload_generator_is_deterministic_and_includes_dirty_rows():
+    """
+    ทดสอบว่าข้อมูลจำลองต้องเหมือนเดิมทุกครั้งที่สร้าง และมีแถวสกปรกปนอยู่ตามสัดส่วนที่กำหนด
+    """
+    payload = generate_market_payload(1000, dirty_ratio=0.2)
+
+    assert payload == generate_market_payload(1000, dirty_ratio=0.2)
+    assert len(payload) == 1000
+    assert len({item['id'] for item in payload}) == 1000
+    dirty = [item for item in payload if not isinstance(item.get('current_price'), float) or not item.get('total_volume')
+             or item.get('market_cap') is None]
+    assert 100 < len(dirty) < 300
+    assert market_page(5, 250, 1000) == []
+
+def test_api_stub_serves_pages_and_injects_rate_limits(mocker):
+    """
+    ทดสอบว่า Stub ต้องแบ่งหน้าเหมือน API จริง และคำขอที่โดน 429 ต้องถูก Retry จนได้ข้อมูลครบ
+    """
+    mocker.patch.object(CoingeckoClient._fetch_page.retry, 'wait', wait_none())
+    client = CoingeckoClient(rate_limiter=TokenBucket(rate_per_minute=60000, burst=100))
+
+    with CoingeckoStub(total_coins=520, throttle_every=2) as stub:
+        client.base_url = stub.base_url
+        pages = list(client.iter_market_pages(per_page=250, max_workers=2))
+
+    assert [len(page) for page in pages] == [250, 250, 20]
+    assert stub.throttled_count >= 1
+    assert client.retry_count == stub.throttled_count
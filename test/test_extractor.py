@@ -1,6 +1,9 @@
 import pytest
+import json
 from src.extractors.coingecko import CoingeckoClient
+from src.extractors.response_cache import ResponseCache
 import requests
+from config.settings import settings
 
 def test_extract_success(mocker):
     """
@@ -14,9 +17,9 @@ def test_extract_success(mocker):
    "total_volume": 20154184933,"last_updated": "2024-04-07T16:49:31.736Z",}
     ]
 
-    #2.ทำการ 'สวมรวม' (Mock) ฟังก์ชั่น request.get ใน CoingeckoClient
+    #2.ทำการ 'สวมรวม' (Mock) ฟังก์ชั่น Session.get ใน CoingeckoClient
     # เราบอกว่า 'ไม่ต้องไปเรียกเน็ตจริงนะ ให้ส่งค่า mock_respone_data กลับมาเลย
-    mock_get =  mocker.patch('src.extractors.coingecko.requests.get')
+    mock_get =  mocker.patch('src.extractors.coingecko.requests.Session.get')
     mock_get.return_value.status_code = 200
     mock_get.return_value.json.return_value = mock_respone_data
 
@@ -37,9 +40,9 @@ def test_extract_api_error(mocker):
     """
     client = CoingeckoClient()
 
-    # เราจะ Mock ที่ requests.get เหมือนเดิม
+    # เราจะ Mock ที่ Session.get เหมือนเดิม
     # แต่เราจะบังคับให้มันคืนค่า Response ทีมี status_code = 500
-    mock_get = mocker.patch('src.extractors.coingecko.requests.get')
+    mock_get = mocker.patch('src.extractors.coingecko.requests.Session.get')
 
     # สร้าง Mock Respone ปลอมๆ ขึ้นมา
     mock_respone = mocker.Mock()
@@ -53,4 +56,141 @@ def test_extract_api_error(mocker):
 
     # ตรวจสอบผลลัพธ์: ต้องได้ []
     assert result == []
-    
\ No newline at end of file
+    
+def _http_error(mocker, status, headers=None):
+    # HTTPError ที่มี Response แนบมาเหมือนที่ raise_for_status() สร้างจริง (ใช้ตัดสินว่าควร Retry หรือไม่)
+    response = mocker.Mock(status_code=status, headers=headers or {})
+    return requests.exceptions.HTTPError(f'{status} Error', response=response)
+
+def _market_page(start, size):
+    return [{"id": f"coin-{i}", "symbol": f"c{i}", "name": f"Coin {i}", "current_price": 1.0,
+             "total_volume": 1.0} for i in range(start, start + size)]
+
+def test_get_coin_market_retries_transient_errors(mocker):
+    """
+    ทดสอบว่า get_coin_market ต้อง Retry เมื่อเจอ 5xx แล้วคืนข้อมูลของความพยายามครั้งถัดไป (ไม่คืน [] ตั้งแต่ครั้งแรก)
+    """
+    mocker.patch.object(CoingeckoClient._fetch_page.retry, 'sleep')
+    client = CoingeckoClient()
+    failed = mocker.Mock()
+    failed.raise_for_status.side_effect = _http_error(mocker, 503)
+    succeeded = mocker.MagicMock()
+    succeeded.json.return_value = [{"id": "bitcoin"}]
+    mock_get = mocker.patch('src.extractors.coingecko.requests.Session.get', side_effect=[failed, succeeded])
+
+    assert client.get_coin_market() == [{"id": "bitcoin"}]
+    assert mock_get.call_count == 2
+    assert client.retry_count == 1
+
+def test_iter_market_pages_stops_at_last_page(mocker):
+    """
+    ทดสอบว่าการดึงแบบหลายหน้าพร้อมกันต้องคืนข้อมูลตามลำดับหน้า และหยุดเมื่อเจอหน้าที่ข้อมูลไม่เต็ม
+    """
+    client = CoingeckoClient()
+    pages = {1: _market_page(0, 2), 2: _market_page(2, 2), 3: _market_page(4, 1)}
+    mocker.patch.object(client, '_fetch_page', side_effect=lambda cur, page, per_page: pages.get(page, []))
+
+    result = list(client.iter_market_pages(per_page=2, max_workers=3))
+
+    assert [len(page) for page in result] == [2, 2, 1]
+    assert result[0][0]['id'] == 'coin-0'
+    assert result[2][0]['id'] == 'coin-4'
+
+def test_rate_limited_page_retries_alone(mocker):
+    """
+    ทดสอบว่าถ้าหน้าใดโดน 429 ระบบจะลองใหม่เฉพาะหน้านั้น ไม่เริ่มดึงทุกหน้าใหม่ทั้งหมด
+    """
+    from tenacity import wait_none
+    mocker.patch.object(CoingeckoClient._fetch_page.retry, 'wait', wait_none())
+    mocker.patch.object(settings, 'MARKET_PAGE_SIZE', 2)
+    client = CoingeckoClient()
+    calls = []
+
+    def fake_get(url, params, timeout):
+        page = params['page']
+        calls.append(page)
+        response = mocker.MagicMock()
+        if page == 2 and calls.count(2) == 1:
+            response.raise_for_status.side_effect = _http_error(mocker, 429)
+        else:
+            response.raise_for_status.return_value = None
+            response.json.return_value = _market_page(page * 10, 2 if page < 3 else 0)
+        return response
+
+    mocker.patch('src.extractors.coingecko.requests.Session.get', side_effect=fake_get)
+
+    result = client.get_all_coin_markets(max_pages=3)
+
+    assert len(result) == 4
+    assert calls.count(1) == 1
+    assert calls.count(2) == 2
+
+def test_retry_count_is_read_when_called(mocker):
+    """
+    ทดสอบว่าจำนวนครั้งของการ Retry ต้องอ่านจาก settings ตอนเรียกใช้งาน ไม่ถูกตรึงไว้ตั้งแต่ตอน import
+    """
+    from tenacity import wait_none
+    mocker.patch.object(CoingeckoClient._fetch_page.retry, 'wait', wait_none())
+    mocker.patch.object(settings, 'RETRY_COUNT', 2)
+    client = CoingeckoClient()
+    mock_get = mocker.patch('src.extractors.coingecko.requests.Session.get')
+    mock_get.return_value.raise_for_status.side_effect = _http_error(mocker, 503)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        client._fetch_page('usd', 1, 10)
+
+    assert mock_get.call_count == 2
+
+def test_only_transient_errors_are_retried_and_retry_after_is_honoured(mocker):
+    """
+    ทดสอบว่า 4xx ที่ไม่ใช่ 429 ต้องไม่ถูก Retry และ 429 ต้องรอตามเวลาใน Header Retry-After ก่อนลองใหม่
+    """
+    sleep = mocker.patch.object(CoingeckoClient._fetch_page.retry, 'sleep')
+    client = CoingeckoClient()
+    mock_get = mocker.patch('src.extractors.coingecko.requests.Session.get')
+
+    mock_get.return_value.raise_for_status.side_effect = _http_error(mocker, 404)
+    with pytest.raises(requests.exceptions.HTTPError):
+        client._fetch_page('usd', 1, 10)
+    assert mock_get.call_count == 1
+    sleep.assert_not_called()
+
+    throttled = mocker.Mock()
+    throttled.raise_for_status.side_effect = _http_error(mocker, 429, {'Retry-After': '7'})
+    ok = mocker.Mock(content=b'[]')
+    ok.json.return_value = []
+    mock_get.reset_mock(return_value=True)
+    mock_get.side_effect = [throttled, ok]
+
+    assert client._fetch_page('usd', 1, 10) == []
+    sleep.assert_called_once_with(7.0)
+    assert client.retry_count == 1
+
+def test_response_cache_serves_repeat_calls(mocker, tmp_path):
+    """
+    ทดสอบว่าเมื่อเปิดใช้แคช การเรียกซ้ำด้วย Parameters เดิมต้องได้ข้อมูลจากแคช ไม่ยิง API ใหม่
+    """
+    cache = ResponseCache(str(tmp_path / 'cache.db'), ttl_seconds=60)
+    client = CoingeckoClient(cache=cache)
+
+    mock_get = mocker.patch('src.extractors.coingecko.requests.Session.get')
+    mock_get.return_value.text = json.dumps([{"id": "bitcoin"}])
+    mock_get.return_value.json.return_value = [{"id": "bitcoin"}]
+
+    first = client.get_coin_market()
+    second = client.get_coin_market()
+
+    assert first == second == [{"id": "bitcoin"}]
+    mock_get.assert_called_once()
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    """
+    ทดสอบว่าแคชต้องลบรายการที่ไม่ได้ใช้นานที่สุดออกเมื่อขนาดรวมเกินกำหนด
+    """
+    cache = ResponseCache(str(tmp_path / 'cache.db'), ttl_seconds=None, max_bytes=40)
+    cache.set('/coins/markets', {'page': 1}, json.dumps(['a' * 10]))
+    cache.set('/coins/markets', {'page': 2}, json.dumps(['b' * 10]))
+    cache.set('/coins/markets', {'page': 3}, json.dumps(['c' * 10]))
+
+    assert cache.get('/coins/markets', {'page': 1}) is None
+    assert cache.get('/coins/markets', {'page': 3}) == ['c' * 10]
@@ -0,0 +1,62 @@
+import json
+import logging
+from src.utils.logger import JsonFormatter, RateLimitFilter, aggregate_log, log_context, logger
+
+def test_aggregate_log_emits_samples_and_one_summary(caplog):
+    """
+    ทดสอบว่า Log ที่เกิดซ้ำทุกแถวต้องถูกส่งออกเพียงตัวอย่างแรกๆ และสรุปจำนวนที่เหลือเป็นบรรทัดเดียว
+    """
+    with caplog.at_level(logging.ERROR, logger='cryptoPipeline'):
+        with aggregate_log('Data corruption detected - JSON Parsing Error: %s', sample=2) as corrupt_rows:
+            for i in range(50):
+                corrupt_rows.add(f'row {i}')
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages == [
+        'Data corruption detected - JSON Parsing Error: row 0',
+        'Data corruption detected - JSON Parsing Error: row 1',
+        'Data corruption detected - JSON Parsing Error: 48 more occurrences suppressed (50 total)',
+    ]
+
+def test_rate_limit_filter_drops_repeats_and_reports_suppressed_count():
+    """
+    ทดสอบว่าข้อความแม่แบบเดียวกันที่เกินโควตาต้องถูกทิ้ง และจำนวนที่ถูกทิ้งต้องถูกรายงานในหน้าต่างถัดไป
+    """
+    limiter = RateLimitFilter(max_per_window=3, window_seconds=0.5)
+    record = lambda i, level=logging.WARNING: logging.makeLogRecord({'name': 'cryptoPipeline', 'levelno': level,
+                                                                     'msg': 'Bad row %s', 'args': (i,)})
+
+    passed = [limiter.filter(record(i)) for i in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    # ERROR ขึ้นไปต้องผ่านเสมอแม้แม่แบบเดียวกันจะเกินโควตา
+    assert all(limiter.filter(record(i, logging.ERROR)) for i in range(10))
+
+    import time
+    time.sleep(0.6)
+    next_record = record(10)
+    assert limiter.filter(next_record)
+    assert next_record.suppressed == 7
+
+def test_json_formatter_carries_context_fields():
+    """
+    ทดสอบว่า Log รูปแบบ JSON ต้องมีบริบท batch_id / stage จาก log_context()
+    """
+    captured = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            captured.append(JsonFormatter().format(record))
+
+    handler = Capture()
+    logger.addHandler(handler)
+    try:
+        with log_context(batch_id='20260101_050000', stage='transform'):
+            logger.info('Transformation complete: %s valid, %s rejected.', 10, 2)
+    finally:
+        logger.removeHandler(handler)
+
+    payload = json.loads(captured[-1])
+    assert payload['message'] == 'Transformation complete: 10 valid, 2 rejected.'
+    assert payload['batch_id'] == '20260101_050000'
+    assert payload['stage'] == 'transform'
+    assert payload['level'] == 'INFO'
@@ -0,0 +1,480 @@
+import pytest
+import json
+from config.settings import settings
+from src.loaders.sqlite_loader import SQLiteLoader
+from src.loaders.batch_ledger import BatchLedger
+import main
+
+@pytest.fixture
+def db_path(mocker, tmp_path):
+    # ใช้ฐานข้อมูลชั่วคราวแยกต่อการทดสอบ เพื่อไม่ให้ปนกับฐานข้อมูลจริง
+    path = str(tmp_path / 'pipeline.db')
+    mocker.patch.object(settings, 'DATABASE_URL', f'sqlite:///{path}')
+    return path
+
+def _stage_batch(loader, batch_id, price=1.0):
+    with loader.db.connection() as conn:
+        conn.execute(
+            'INSERT INTO stg_crypto_markets (coin_id, raw_data, extracted_at, batch_id) VALUES (?, ?, ?, ?)',
+            ('bitcoin', json.dumps({"id": "bitcoin", "current_price": price, "total_volume": 1.0}), '', batch_id)
+        )
+        loader.ledger.mark(batch_id, 'staged', row_count=1, conn=conn)
+
+def test_incremental_run_only_touches_batches_after_watermark(db_path, mocker):
+    """
+    ทดสอบว่าโหมด Incremental ต้องประมวลผลเฉพาะ Batch ใหม่กว่า Watermark และ Batch ที่ค้างอยู่เท่านั้น
+    """
+    loader = SQLiteLoader()
+    ledger = loader.ledger
+    _stage_batch(loader, '20260101_050000')
+    ledger.mark('20260101_050000', 'loaded', row_count=1)
+    _stage_batch(loader, '20260101_170000')
+    _stage_batch(loader, '20260102_050000')
+
+    processed = []
+    mocker.patch.object(main, 'process_batch', side_effect=lambda batch_id, ledger=None: processed.append(batch_id))
+
+    main.run_incremental()
+
+    assert processed == ['20260101_170000', '20260102_050000']
+
+def test_failed_batch_resumes_from_staging(db_path, mocker):
+    """
+    ทดสอบว่า Batch ที่ล้มเหลวในขั้น DQ ต้องถูกบันทึกใน Ledger และทำต่อได้จาก Staging โดยไม่ต้องดึง API ใหม่
+    """
+    loader = SQLiteLoader()
+    ledger = BatchLedger()
+    _stage_batch(loader, '20260101_050000')
+
+    mocker.patch.object(main.DataqualityValidator, 'validate_market_data', return_value=False)
+    assert main.process_batch('20260101_050000') is False
+    assert ledger.get('20260101_050000')['stage'] == 'validated'
+    assert ledger.get('20260101_050000')['status'] == 'failed'
+    assert ledger.pending_batches() == ['20260101_050000']
+
+    mocker.stopall()
+    mocker.patch.object(settings, 'DATABASE_URL', f'sqlite:///{db_path}')
+    api = mocker.patch('src.extractors.coingecko.requests.Session.get')
+    main.run_incremental()
+
+    api.assert_not_called()
+    assert ledger.get('20260101_050000')['stage'] == 'loaded'
+    assert ledger.watermark() == '20260101_050000'
+    assert ledger.pending_batches() == []
+
+def test_batch_is_rejected_after_max_failed_attempts(db_path, mocker):
+    """
+    ทดสอบว่า Batch ที่ไม่ผ่าน DQ ครบ BATCH_MAX_ATTEMPTS ครั้งต้องถูกบันทึกเป็น 'rejected' และไม่ถูก Retry อีก
+    และ Batch ใน Staging ถูกค้นหาผ่าน StorageBackend (ไม่ใช่ตาราง Staging ในไฟล์ SQLite โดยตรง)
+    """
+    mocker.patch.object(settings, 'BATCH_MAX_ATTEMPTS', 2)
+    loader = SQLiteLoader()
+    ledger = BatchLedger()
+    _stage_batch(loader, '20260101_050000')
+
+    mocker.patch.object(main.DataqualityValidator, 'validate_market_data', return_value=False)
+    assert main.process_batch('20260101_050000') is False
+    assert ledger.pending_batches() == ['20260101_050000']
+    assert main.process_batch('20260101_050000') is False
+    assert (ledger.get('20260101_050000')['status'], ledger.get('20260101_050000')['attempts']) == ('rejected', 2)
+    assert ledger.pending_batches() == []
+
+    backend = mocker.MagicMock()
+    backend.staged_batches.return_value = ['20260101_050000', '20260102_050000']
+    assert BatchLedger(backend=backend).pending_batches() == ['20260102_050000']
+    backend.staged_batches.assert_called_once_with('')
+
+def test_parquet_mirror_failure_does_not_fail_a_loaded_batch(db_path, mocker, tmp_path):
+    """
+    ทดสอบว่าหาก Parquet Mirror เขียนไม่สำเร็จหลัง Commit แล้ว Batch ต้องยังคงสถานะ 'loaded' (Mirror สร้างใหม่ได้ภายหลัง)
+    """
+    pytest.importorskip('pyarrow')
+    from src.loaders.parquet_mirror import ParquetMirror
+    mocker.patch.object(settings, 'PARQUET_MIRROR_ENABLED', True)
+    mocker.patch.object(settings, 'PARQUET_MIRROR_DIR', str(tmp_path / 'lake'))
+    mocker.patch.object(settings, 'ANOMALY_DETECTION_ENABLED', False)
+    mocker.patch.object(ParquetMirror, 'write', side_effect=OSError('No space left on device'))
+    loader = SQLiteLoader()
+    _stage_batch(loader, '20260101_050000')
+
+    assert main.process_batch('20260101_050000') is True
+    assert (BatchLedger().get('20260101_050000')['stage'], BatchLedger().get('20260101_050000')['status']) == \
+        ('loaded', 'success')
+
+@pytest.mark.parametrize('engine', ['python', 'columnar', 'sql', 'stages'])
+def test_market_cap_consistency_rule_runs_in_the_pipeline(db_path, mocker, engine):
+    """
+    ทดสอบว่ากฎ market_cap ≈ price × circulating_supply ถูกประเมินจริงระหว่างการรัน Pipeline ทุก Engine
+    (รวมเส้นทางแบบแยกขั้นตอนของ DAG) ไม่ถูกข้ามเพราะไม่มีคอลัมน์ Supply
+    """
+    from src.pipeline import stages
+    from src.quality.data_quality import DataqualityValidator
+    if engine == 'columnar':
+        pytest.importorskip('numpy')
+    mocker.patch.object(settings, 'TRANSFORM_ENGINE', 'python' if engine == 'stages' else engine)
+    mocker.patch.object(settings, 'ANOMALY_DETECTION_ENABLED', False)
+    evaluate = mocker.spy(DataqualityValidator, 'evaluate')
+    page = [
+        {"id": "good", "current_price": 10.0, "market_cap": 1000.0, "circulating_supply": 100.0, "total_volume": 1.0},
+        {"id": "off", "current_price": 10.0, "market_cap": 5000.0, "circulating_supply": "100", "total_volume": 1.0},
+        {"id": "no-supply", "current_price": 10.0, "market_cap": 5000.0, "total_volume": 1.0},
+    ]
+    SQLiteLoader().load_pages_to_staging([page], batch_id='20260101_050000')
+
+    if engine == 'stages':
+        stages.transform_batch('20260101_050000')
+        assert stages.validate_batch('20260101_050000') == 3
+    else:
+        assert main.process_batch('20260101_050000') is True
+
+    report = evaluate.spy_return
+    assert 'market_cap_consistency' not in report.skipped_rules
+    assert report.violations['market_cap_consistency'] == 1
+    assert report.samples['market_cap_consistency'] == ['off']
+    assert report.passed is True
+
+def test_sql_engine_applies_dq_gate_before_commit(db_path, mocker):
+    """
+    ทดสอบว่า Engine แบบ SQL ต้องผ่าน DQ Gate ชุดเดียวกับ Engine แบบ Python และ Rollback ทั้ง Batch เมื่อไม่ผ่าน
+    """
+    import sqlite3
+    mocker.patch.object(settings, 'TRANSFORM_ENGINE', 'sql')
+    loader = SQLiteLoader()
+    ledger = BatchLedger()
+    _stage_batch(loader, '20260101_050000')
+
+    mocker.patch.object(main.DataqualityValidator, 'validate_market_data', return_value=False)
+    assert main.process_batch('20260101_050000') is False
+    assert (ledger.get('20260101_050000')['stage'], ledger.get('20260101_050000')['status']) == ('validated', 'failed')
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM fct_crypto_prices').fetchone()[0] == 0
+
+    mocker.patch.object(main.DataqualityValidator, 'validate_market_data', return_value=True)
+    assert main.process_batch('20260101_050000') is True
+    assert ledger.get('20260101_050000')['stage'] == 'loaded'
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute('SELECT n FROM dq_coin_stats WHERE coin_id = ?', ('bitcoin',)).fetchone()[0] == 1
+
+def test_run_pipeline_records_stage_metrics(db_path, mocker, tmp_path):
+    """
+    ทดสอบว่าการรัน Pipeline ต้องบันทึกตัวชี้วัดรายขั้นตอนลงตาราง pipeline_metrics และ Export เป็น JSON / Prometheus
+    """
+    export_dir = tmp_path / 'metrics'
+    mocker.patch.object(settings, 'METRICS_EXPORT_DIR', str(export_dir))
+    mocker.patch.object(settings, 'ANOMALY_DETECTION_ENABLED', False)
+    mocker.patch.object(settings, 'VS_CURRENCIES', ['usd'])
+    response = mocker.MagicMock()
+    response.json.return_value = [
+        {"id": "bitcoin", "symbol": "btc", "name": "Bitcoin", "current_price": 1.0, "total_volume": 2.0},
+        {"id": "ethereum", "symbol": "eth", "name": "Ethereum", "current_price": 3.0, "total_volume": 4.0},
+    ]
+    response.content = b'x' * 128
+    mocker.patch('src.extractors.coingecko.requests.Session.get', return_value=response)
+
+    main.run_pipeline()
+
+    rows = SQLiteLoader().db.connection().execute(
+        'SELECT stage, rows_out, bytes_fetched FROM pipeline_metrics ORDER BY rowid'
+    ).fetchall()
+    stages = {stage: (rows_out, fetched) for stage, rows_out, fetched in rows}
+    assert list(stages) == ['stage', 'extract', 'transform', 'dq', 'load_core']
+    assert stages['extract'] == (2, 128)
+    assert stages['load_core'][0] == 2
+
+    prom = (export_dir / 'crypto_pipeline.prom').read_text()
+    assert 'crypto_pipeline_stage_wall_seconds{stage="transform"}' in prom
+    assert 'batch_id' not in prom
+    assert not list(export_dir.glob('*.tmp'))
+    assert len(list(export_dir.glob('metrics_*.json'))) == 1
+
+def test_importing_pipeline_has_no_side_effects(tmp_path):
+    """
+    ทดสอบว่าการ import main (และไฟล์ DAG) ต้องไม่อ่าน Settings ไม่สร้างโฟลเดอร์ logs และไม่เริ่ม Logger
+    เพื่อให้ Airflow Scheduler Parse DAG ได้เร็ว
+    """
+    import os
+    import subprocess
+    import sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = (
+        'import sys; sys.path.insert(0, %r)\n'
+        'import main\n'
+        'from config.settings import settings\n'
+        'from src.utils.logger import logger\n'
+        'print(settings.loaded, logger.loaded)\n'
+    ) % root
+    env = {key: value for key, value in os.environ.items() if key not in ('COINGECKO_API_KEY', 'DATABASE_URL')}
+
+    result = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ['False', 'False']
+    assert not (tmp_path / 'logs').exists()
+
+def test_staged_dag_callables_run_shards_and_retry_stages_alone(db_path, mocker, tmp_path):
+    """
+    ทดสอบ Callable ของ DAG แบบแยกขั้นตอน: Shard แบ่งหน้ากันดึงโดยไม่ซ้ำ, ส่งต่อกันด้วย batch_id เท่านั้น
+    และขั้น validate ที่ล้มเหลวต้อง Retry ได้เองโดยไม่ต้องดึงข้อมูลจาก API ใหม่
+    """
+    from src.pipeline import stages
+    from src.extractors.coingecko import CoingeckoClient
+    mocker.patch.object(settings, 'LANDING_DIR', str(tmp_path / 'landing'))
+    mocker.patch.object(settings, 'FULL_MARKET_EXTRACT', True)
+    mocker.patch.object(settings, 'EXTRACT_SHARDS', 2)
+    mocker.patch.object(settings, 'MARKET_PAGE_SIZE', 2)
+    mocker.patch.object(settings, 'ANOMALY_DETECTION_ENABLED', False)
+    mocker.patch.object(settings, 'VS_CURRENCIES', ['usd'])
+
+    def fake_page(self, vs_currency, page, per_page):
+        size = {1: 2, 2: 2, 3: 1}.get(page, 0)
+        return [{"id": f"coin-{page}-{i}", "symbol": "c", "name": "Coin", "current_price": 1.0, "total_volume": 1.0}
+                for i in range(size)]
+    fetch = mocker.patch.object(CoingeckoClient, '_fetch_page', autospec=True, side_effect=fake_page)
+
+    batch_id = '20260101_050000'
+    shards = stages.plan_shards()
+    assert shards == [{'vs_currency': 'usd', 'shard_index': 0, 'shard_count': 2},
+                      {'vs_currency': 'usd', 'shard_index': 1, 'shard_count': 2}]
+    assert [stages.extract_shard(batch_id, **shard) for shard in shards] == [3, 2]
+    assert sorted(call.args[2] for call in fetch.call_args_list) == [1, 2, 3, 4]
+
+    assert stages.stage_batch(batch_id) == 5
+    assert stages.stage_batch(batch_id) == 5    # Retry ขั้น stage ต้องไม่ทำให้แถวซ้ำ
+    assert stages.transform_batch(batch_id) == 5
+
+    mocker.patch.object(stages.DataqualityValidator, 'validate_market_data', return_value=False)
+    with pytest.raises(stages.DataQualityError):
+        stages.validate_batch(batch_id)
+    assert BatchLedger().get(batch_id)['status'] == 'failed'
+
+    fetch.reset_mock()
+    stages.DataqualityValidator.validate_market_data.return_value = True
+    assert stages.validate_batch(batch_id) == 5
+    assert stages.load_batch(batch_id) == 5
+
+    fetch.assert_not_called()
+    conn = SQLiteLoader().db.connection()
+    assert conn.execute('SELECT COUNT(*) FROM fct_crypto_prices').fetchone()[0] == 5
+    assert conn.execute('SELECT COUNT(*) FROM int_crypto_prices').fetchone()[0] == 0
+    assert BatchLedger().get(batch_id)['stage'] == 'loaded'
+    assert not (tmp_path / 'landing' / batch_id).exists()
+
+def test_run_pipeline_loads_every_currency_into_one_batch(db_path, mocker):
+    """
+    ทดสอบว่าการรันหนึ่งรอบต้องดึงทุกสกุลเงินเข้า Batch เดียวกัน โดย Fact Table มีหนึ่งแถวต่อ (เหรียญ, สกุลเงิน)
+    และฟิลด์ที่ไม่ขึ้นกับสกุลเงิน (name, symbol) ถูกเก็บใน Staging เพียงครั้งเดียวต่อเหรียญ
+    """
+    mocker.patch.object(settings, 'METRICS_ENABLED', False)
+    mocker.patch.object(settings, 'ANOMALY_DETECTION_ENABLED', False)
+    mocker.patch.object(settings, 'VS_CURRENCIES', ['usd', 'thb'])
+    rates = {'usd': 1.0, 'thb': 35.0}
+
+    def fake_get(self, endpoint, params=None, timeout=None):
+        rate = rates[params['vs_currency']]
+        response = mocker.MagicMock()
+        response.content = b'{}'
+        response.json.return_value = [
+            {"id": "bitcoin", "symbol": "btc", "name": "Bitcoin", "current_price": 100.0 * rate,
+             "total_volume": 5.0 * rate, "circulating_supply": 19000000.0},
+        ]
+        return response
+    mocker.patch('src.extractors.coingecko.requests.Session.get', autospec=True, side_effect=fake_get)
+
+    main.run_pipeline()
+
+    conn = SQLiteLoader().db.connection()
+    assert sorted(conn.execute('SELECT vs_currency, name, price FROM fct_crypto_prices').fetchall()) == [
+        ('thb', 'Bitcoin', 3500.0), ('usd', 'Bitcoin', 100.0)
+    ]
+    assert conn.execute('SELECT COUNT(DISTINCT batch_id) FROM fct_crypto_prices').fetchone()[0] == 1
+    assert conn.execute('SELECT COUNT(*) FROM stg_coin_meta').fetchone()[0] == 1
+    assert conn.execute("""SELECT COUNT(*) FROM stg_crypto_markets WHERE instr(raw_data, '"name"')""").fetchone()[0] == 0
+
+def test_cdc_writes_only_changed_coins_and_references_the_rest(db_path, mocker):
+    """
+    ทดสอบโหมด CDC: รอบที่สองต้องเขียนลง Staging / Fact Table เฉพาะเหรียญที่เปลี่ยน
+    ส่วนเหรียญที่ไม่เปลี่ยนถูกอ้างอิงไปยัง Batch ก่อนหน้า และภาพรวมของ Batch ยังครบทุกเหรียญ
+    """
+    mocker.patch.object(settings, 'CDC_ENABLED', True)
+    mocker.patch.object(settings, 'ANOMALY_DETECTION_ENABLED', False)
+
+    def page(btc_price):
+        return [
+            {"id": "bitcoin", "name": "Bitcoin", "current_price": btc_price, "total_volume": 1.0, "last_updated": "t1"},
+            {"id": "dogecoin", "name": "Dogecoin", "current_price": 0.1, "total_volume": 1.0, "last_updated": "t0"},
+        ]
+
+    loader = SQLiteLoader()
+    for batch_id, btc_price in (('20260101_050000', 100.0), ('20260101_170000', 100.0), ('20260102_050000', 101.0)):
+        loader.load_pages_to_staging([page(btc_price)], batch_id=batch_id)
+        assert main.process_batch(batch_id) is True
+
+    conn = loader.db.connection()
+    assert conn.execute('SELECT batch_id, COUNT(*) FROM stg_crypto_markets GROUP BY batch_id').fetchall() == [
+        ('20260101_050000', 2), ('20260102_050000', 1)
+    ]
+    assert conn.execute('SELECT COUNT(*) FROM fct_crypto_prices').fetchone()[0] == 3
+    assert sorted(conn.execute(
+        "SELECT coin_id, price, source_batch_id FROM v_fct_crypto_prices_snapshot WHERE batch_id = '20260102_050000'"
+    ).fetchall()) == [('bitcoin', 101.0, '20260102_050000'), ('dogecoin', 0.1, '20260101_050000')]
+    assert BatchLedger().get('20260101_170000')['stage'] == 'loaded'
+
+def test_cdc_never_references_a_batch_that_was_not_loaded(db_path, mocker):
+    """
+    ทดสอบว่าลายนิ้วมือของ Batch ที่ยังไม่โหลด (เช่น ไม่ผ่าน DQ) ไม่ถูกใช้เป็นเวอร์ชันอ้างอิง
+    Batch ถัดไปต้องเขียนเหรียญเต็มแถวและโหลดเข้า Fact Table ได้
+    """
+    mocker.patch.object(settings, 'CDC_ENABLED', True)
+    mocker.patch.object(settings, 'ANOMALY_DETECTION_ENABLED', False)
+    page = [{"id": "bitcoin", "current_price": 100.0, "total_volume": 1.0, "last_updated": "t1"}]
+
+    loader = SQLiteLoader()
+    loader.load_pages_to_staging([page], batch_id='20260101_000000')      # ไม่ถูกโหลด
+    loader.load_pages_to_staging([page], batch_id='20260101_010000')
+    assert main.process_batch('20260101_010000') is True
+
+    conn = loader.db.connection()
+    assert conn.execute('SELECT COUNT(*) FROM cdc_unchanged_refs').fetchone()[0] == 0
+    assert conn.execute(
+        "SELECT coin_id, source_batch_id FROM v_fct_crypto_prices_snapshot WHERE batch_id = '20260101_010000'"
+    ).fetchall() == [('bitcoin', '20260101_010000')]
+    assert conn.execute('SELECT batch_id FROM cdc_coin_fingerprints').fetchall() == [('20260101_010000',)]
+
+    # Batch เก่าที่ถูกทำต่อภายหลังไม่ย้อนเวอร์ชันอ้างอิงกลับไป
+    assert main.process_batch('20260101_000000') is True
+    assert conn.execute('SELECT batch_id FROM cdc_coin_fingerprints').fetchall() == [('20260101_010000',)]
+    assert conn.execute('SELECT COUNT(*) FROM cdc_pending_fingerprints').fetchone()[0] == 0
+
+def test_unchanged_batch_checks_staging_through_the_storage_backend(db_path):
+    """
+    ทดสอบว่า is_unchanged_batch ตรวจ Staging ผ่าน StorageBackend (เช่น PostgreSQL) ไม่ใช่ไฟล์ SQLite ของตารางสถานะ
+    Batch ที่มีเหรียญเปลี่ยนใน Staging ของ Backend ต้องไม่ถูกนับว่าไม่เปลี่ยน
+    """
+    from src.loaders.backends import StorageBackend
+    from src.loaders.change_tracker import ChangeTracker
+
+    class RemoteStaging(StorageBackend):
+        name = 'postgres'
+
+        def has_staging(self, batch_id):
+            return batch_id == '20260101_010000'
+
+    tracker = ChangeTracker(backend=RemoteStaging())
+    with tracker.db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO cdc_unchanged_refs VALUES (?, 'dogecoin', 'usd', '20260101_000000')",
+            [('20260101_010000',), ('20260101_020000',)]
+        )
+
+    assert tracker.is_unchanged_batch('20260101_010000') is False
+    assert tracker.is_unchanged_batch('20260101_020000') is True
+
+def test_backfill_checkpoints_windows_and_resumes_only_unfinished_work(db_path, mocker):
+    """
+    ทดสอบโหมด Backfill: ทุกหน้าต่างถูกบันทึกลง Fact Table พร้อม Checkpoint หน้าต่างที่ล้มเหลวไม่หยุดงานอื่น
+    และการรันซ้ำดึงเฉพาะหน้าต่างที่ยังไม่เสร็จเท่านั้น
+    """
+    mocker.patch.object(settings, 'BACKFILL_WINDOW_DAYS', 1)
+    mocker.patch.object(settings, 'METRICS_ENABLED', False)
+    failures = {('dogecoin', 1767312000)}
+
+    def fake_range(self, coin_id, vs_currency, start_ts, end_ts):
+        if (coin_id, start_ts) in failures:
+            failures.discard((coin_id, start_ts))
+            raise ValueError('boom')
+        ms = start_ts * 1000
+        return {
+            'prices': [[ms, 2.0], [ms + 3600000, 0.0]],
+            'market_caps': [[ms, 20.0], [ms + 3600000, 20.0]],
+            'total_volumes': [[ms, 5.0], [ms + 3600000, 5.0]],
+        }
+    fetch = mocker.patch('src.extractors.coingecko.CoingeckoClient.get_market_chart_range',
+                         autospec=True, side_effect=fake_range)
+
+    first = main.run_backfill('2026-01-01', '2026-01-03', coin_ids=['bitcoin', 'dogecoin'], vs_currencies=['usd'])
+    assert first == {'tasks': 4, 'skipped': 0, 'succeeded': 3, 'failed': 1, 'rows': 3}
+
+    second = main.run_backfill('2026-01-01', '2026-01-03', coin_ids=['bitcoin', 'dogecoin'], vs_currencies=['usd'])
+    assert second == {'tasks': 4, 'skipped': 3, 'succeeded': 1, 'failed': 0, 'rows': 1}
+    assert fetch.call_count == 5
+
+    conn = SQLiteLoader().db.connection()
+    assert conn.execute(
+        "SELECT batch_id, coin_id, price, market_cap, total_volume, vs_currency FROM fct_crypto_prices "
+        "WHERE coin_id = 'dogecoin' ORDER BY batch_id"
+    ).fetchall() == [
+        ('20260101_000000', 'dogecoin', 2.0, 20.0, 5.0, 'usd'), ('20260102_000000', 'dogecoin', 2.0, 20.0, 5.0, 'usd')
+    ]
+    assert conn.execute("SELECT COUNT(*) FROM backfill_progress WHERE status = 'done'").fetchone()[0] == 4
+
+def test_backfill_of_default_coins_takes_names_from_the_market_page(db_path, mocker):
+    """
+    ทดสอบว่า Backfill บนระบบที่เพิ่งติดตั้ง (Fact Table ว่าง) ใช้ symbol / name จากหน้า /coins/markets
+    """
+    mocker.patch.object(settings, 'METRICS_ENABLED', False)
+    mocker.patch('src.extractors.coingecko.CoingeckoClient.iter_market_pages',
+                 return_value=iter([[{'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'}]]))
+    mocker.patch('src.extractors.coingecko.CoingeckoClient.get_market_chart_range', return_value={
+        'prices': [[1767225600000, 2.0]], 'total_volumes': [[1767225600000, 5.0]],
+    })
+
+    main.run_backfill('2026-01-01', '2026-01-02', vs_currencies=['usd'])
+
+    conn = SQLiteLoader().db.connection()
+    assert conn.execute('SELECT coin_id, symbol, name FROM fct_crypto_prices').fetchall() == [('bitcoin', 'btc', 'Bitcoin')]
+
+def test_daemon_loads_only_changed_coins_and_coalesces_when_writer_is_behind(db_path, mocker):
+    """
+    ทดสอบโหมด Daemon: แต่ละ Micro-batch โหลดเฉพาะเหรียญที่เปลี่ยนจากรอบก่อน พร้อมบันทึก Ledger
+    และเมื่อคิวเต็ม การเปลี่ยนแปลงถูกรวมเข้ากับรอบถัดไปโดยเก็บเวอร์ชันล่าสุดของแต่ละเหรียญ
+    """
+    from src.pipeline.daemon import PollingDaemon
+    mocker.patch.object(settings, 'VS_CURRENCIES', ['usd'])
+    mocker.patch.object(settings, 'FULL_MARKET_EXTRACT', False)
+    mocker.patch.object(settings, 'ANOMALY_DETECTION_ENABLED', False)
+    polls = [
+        {'bitcoin': 100.0, 'dogecoin': 0.1},
+        {'bitcoin': 101.0, 'dogecoin': 0.1},
+        {'bitcoin': 101.0, 'dogecoin': 0.2},
+    ]
+
+    def fake_pages(self, currencies=None, per_page=None, max_pages=None):
+        prices = polls.pop(0)
+        return iter([('usd', [
+            {'id': coin_id, 'symbol': coin_id[:3], 'name': coin_id, 'current_price': price,
+             'market_cap': 10.0, 'total_volume': 5.0, 'last_updated': '2026-01-01T00:00:00Z'}
+            for coin_id, price in prices.items()
+        ])])
+    mocker.patch('src.extractors.coingecko.CoingeckoClient.iter_currency_pages', autospec=True, side_effect=fake_pages)
+    mocker.patch('src.pipeline.daemon.new_batch_id',
+                 side_effect=iter(['20260101_000001', '20260101_000002', '20260101_000003']))
+
+    stats = PollingDaemon(interval=0).run(max_polls=3)
+
+    assert stats['changed'] == 4 and stats['micro_batches'] == 3 and stats['rows_loaded'] == 4
+    conn = SQLiteLoader().db.connection()
+    assert conn.execute(
+        'SELECT batch_id, coin_id, price FROM fct_crypto_prices ORDER BY batch_id, coin_id'
+    ).fetchall() == [
+        ('20260101_000001', 'bitcoin', 100.0), ('20260101_000001', 'dogecoin', 0.1),
+        ('20260101_000002', 'bitcoin', 101.0), ('20260101_000003', 'dogecoin', 0.2),
+    ]
+    assert BatchLedger().get('20260101_000003')['stage'] == 'loaded'
+    # เหรียญที่ไม่เปลี่ยนถูกอ้างอิง: ทุก Micro-batch มีภาพรวมครบทุกเหรียญ
+    assert conn.execute(
+        "SELECT coin_id, price, source_batch_id FROM v_fct_crypto_prices_snapshot "
+        "WHERE batch_id = '20260101_000002' ORDER BY coin_id"
+    ).fetchall() == [('bitcoin', 101.0, '20260101_000002'), ('dogecoin', 0.1, '20260101_000001')]
+
+    # Daemon ใหม่เริ่มจากลายนิ้วมือที่บันทึกไว้: รอบที่ไม่มีอะไรเปลี่ยนไม่ส่งงานให้ Writer
+    polls.extend([{'bitcoin': 101.0, 'dogecoin': 0.2}, {'bitcoin': 102.0, 'dogecoin': 0.2},
+                  {'bitcoin': 103.0, 'dogecoin': 0.3}])
+    daemon = PollingDaemon(interval=0, queue_size=1)
+    assert daemon.poll_once() == 0 and daemon.queue.empty()
+    daemon.poll_once()
+    daemon.poll_once()
+    assert daemon.stats['coalesced'] == 1 and daemon.queue.qsize() == 1
+    assert {key: item['current_price'] for key, (_, item) in daemon._pending.items()} == {
+        ('bitcoin', 'usd'): 103.0, ('dogecoin', 'usd'): 0.3
+    }
+    assert daemon.latest_state('bitcoin')['current_price'] == 103.0
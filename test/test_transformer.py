@@ -2,6 +2,7 @@ import pytest
 import json
 from src.transformers.crypto_transformer import CryptoTransformer
 
+
 def test_filtering_logic():
     """
     ทดสอบว่าระบบต้องกรองเหรียญที่ราคาหรือ volume เป็น 0 ออก
@@ -39,4 +40,239 @@ def test_filtering_logic():
         cleaned_data = transformer.transform_logic(mock_dirty_data,batch_id=batch_test_id)
 
         #ผลลัพธ์: ควรจะจัดการได้โดยไม่พ่น Exception ออกมา (แต่อาจจะถูกกรองออกถ้าค่าเป็น 0)
-        assert isinstance(cleaned_data, list)
\ No newline at end of file
+        assert isinstance(cleaned_data, list)
+
+
+def test_sql_engine_matches_python_engine(mocker, tmp_path):
+    """
+    ทดสอบว่า Transform Engine แบบ SQL ต้องให้ผลลัพธ์ใน Fact Table ตรงกับ Engine แบบ Python ทุกประการ
+    """
+    import sqlite3
+    from config.settings import settings
+    from src.loaders.sqlite_loader import SQLiteLoader
+    from src.transformers.sql_transformer import SQLTransformEngine
+
+    raw_items = [
+        {"id": "bitcoin", "symbol": "btc", "name": "Bitcoin", "current_price": 50000, "market_cap": 1e12,
+         "total_volume": 1000, "last_updated": "2026-02-17T00:00:00Z"},
+        {"id": "zero-price", "symbol": "zp", "name": "Zero Price", "current_price": 0, "total_volume": 1000},
+        {"id": "zero-vol", "symbol": "zv", "name": "Zero Vol", "current_price": 1.5, "total_volume": 0},
+        {"id": "null-price", "symbol": "np", "current_price": None, "total_volume": 1000},
+        {"id": "string-price", "symbol": "sp", "current_price": "50000", "total_volume": 1000},
+        {"id": "missing-data", "symbol": "md"},
+        {"id": "null-cap", "symbol": "nc", "current_price": 2.5, "market_cap": None, "total_volume": 7.0},
+        {"id": "bool-price", "symbol": "bp", "current_price": True, "total_volume": 1000},
+    ]
+
+    def load_with(engine_name):
+        mocker.patch.object(settings, 'DATABASE_URL', f"sqlite:///{tmp_path / (engine_name + '.db')}")
+        batch_id = SQLiteLoader().load_to_staging(raw_items)
+        if engine_name == 'sql':
+            SQLTransformEngine().run(batch_id)
+        else:
+            transformer = CryptoTransformer()
+            transformer.save_to_core(transformer.get_cleaned_data(batch_id=batch_id))
+        with sqlite3.connect(tmp_path / (engine_name + '.db')) as conn:
+            return sorted(conn.execute(
+                'SELECT coin_id, symbol, name, price, market_cap, total_volume, last_updated_at FROM fct_crypto_prices'
+            ).fetchall())
+
+    python_rows = load_with('python')
+    sql_rows = load_with('sql')
+
+    # String ตัวเลข ("50000") ถูกแปลงชนิดตอน Parse จึงผ่านกฎเหมือนค่าตัวเลขปกติ
+    assert [row[0] for row in sql_rows] == ['bitcoin', 'null-cap', 'string-price']
+    assert sql_rows == python_rows
+
+    with sqlite3.connect(tmp_path / 'sql.db') as conn:
+        rejected = sorted(row[0] for row in conn.execute('SELECT coin_id FROM rej_crypto_markets'))
+    assert rejected == ['missing-data', 'zero-price', 'zero-vol']
+
+
+def test_columnar_engine_matches_python_engine():
+    """
+    ทดสอบว่า Engine แบบ Columnar ต้องให้แถวที่ผ่านและแถวที่ถูกคัดออกตรงกับ Engine แบบ Python
+    """
+    pytest.importorskip('numpy')
+    from src.transformers.columnar_transformer import ColumnarTransformer
+
+    mock_raw_data = [
+        (json.dumps({"id": "bitcoin", "current_price": 50000, "total_volume": 1000, "symbol": "btc", "name": "Bitcoin"}),),
+        (json.dumps({"id": "zero-price", "current_price": 0, "total_volume": None, "symbol": "zp"}),),
+        (json.dumps({"id": "zero-vol", "current_price": 1.5, "total_volume": 0, "symbol": "zv"}),),
+        (json.dumps({"id": "string-price", "current_price": "50000", "total_volume": 1000}),),
+        (json.dumps({"id": "null-vol", "current_price": 3.0, "total_volume": None}),),
+        (json.dumps({"id": "missing-data", "symbol": "md"}),),
+        ('{not valid json',),
+        # แถวที่ไม่ใช่ Object และแถวที่มีหลายค่า ต้องถูกข้ามโดยไม่ทำให้สกุลเงินของแถวอื่นเลื่อน
+        ('[1, 2]',),
+        ('{"id": "a", "current_price": 1, "total_volume": 1}, '
+         '{"id": "b", "current_price": 1, "total_volume": 1}', 'eur'),
+        (json.dumps({"id": "last", "current_price": 2.0, "total_volume": 2.0}), 'thb'),
+    ]
+
+    transformer = CryptoTransformer()
+    issues = []
+    transformer.save_rejects = lambda data, batch_id=None: issues.extend(data)
+    python_rows = transformer.transform_logic(mock_raw_data, batch_id="b1")
+    columnar_rows, columnar_issues = ColumnarTransformer().transform(mock_raw_data, batch_id="b1")
+
+    assert columnar_rows == python_rows
+    assert columnar_issues == issues
+    assert [(row.coin_id, row.vs_currency) for row in columnar_rows][-1] == ('last', 'thb')
+
+
+def test_reprocess_rebuilds_fact_table_from_all_batches(tmp_path):
+    """
+    ทดสอบว่าการ Reprocess แบบขนานต้อง Rebuild Fact Table จากทุก Batch ใน Staging ได้ครบถ้วน
+    """
+    import sqlite3
+    from src.loaders.sqlite_loader import SQLiteLoader
+    from src.transformers.reprocess import StagingReprocessor
+
+    db_path = str(tmp_path / 'reprocess.db')
+    loader = SQLiteLoader(db_path=db_path)
+    with loader.db.connection() as conn:
+        for batch_id in ('20260101_050000', '20260101_170000'):
+            conn.executemany(
+                'INSERT INTO stg_crypto_markets (coin_id, raw_data, extracted_at, batch_id) VALUES (?, ?, ?, ?)',
+                [
+                    ('bitcoin', json.dumps({"id": "bitcoin", "current_price": 1.0, "total_volume": 1.0}), '', batch_id),
+                    ('dead', json.dumps({"id": "dead", "current_price": 0, "total_volume": 1.0}), '', batch_id),
+                ]
+            )
+        # แถวเก่าของ Batch ใน Staging (ต้องถูกแทนที่) และแถวจาก Backfill ที่ไม่มีใน Staging (ต้องคงอยู่)
+        conn.executemany(
+            'INSERT INTO fct_crypto_prices (batch_id, coin_id, price, vs_currency) VALUES (?, ?, ?, ?)',
+            [('20260101_050000', 'dead', 9.0, 'usd'), ('20251231_000000', 'bitcoin', 0.5, 'usd')]
+        )
+
+    loaded, rejected = StagingReprocessor(db_path=db_path, workers=2).run(full_rebuild=True, write_batch_rows=1)
+
+    with sqlite3.connect(db_path) as conn:
+        rows = sorted(conn.execute('SELECT batch_id, coin_id FROM fct_crypto_prices').fetchall())
+        shadow = conn.execute("SELECT name FROM sqlite_master WHERE name = 'fct_crypto_prices_rebuild'").fetchall()
+    assert (loaded, rejected) == (2, 2)
+    assert rows == [('20251231_000000', 'bitcoin'), ('20260101_050000', 'bitcoin'), ('20260101_170000', 'bitcoin')]
+    assert shadow == []
+
+
+def test_rejects_are_bulk_written_and_queryable(tmp_path):
+    """
+    ทดสอบว่ารายการที่ถูกคัดออกต้องถูกบันทึกลง rej_crypto_markets พร้อมเหตุผลและรหัสกฎ
+    และค้นหาได้ตามเหรียญ เหตุผล และช่วงเวลา
+    """
+    from datetime import datetime, timedelta, timezone
+    from src.loaders.rejects_store import RejectsStore
+    from src.transformers.crypto_transformer import REJECT_REASON_ZERO_PRICE_OR_VOLUME
+
+    db_path = str(tmp_path / 'rejects.db')
+    transformer = CryptoTransformer(db_path=db_path)
+    rows = [
+        (json.dumps({"id": "bitcoin", "current_price": 1.0, "total_volume": 1.0}), 'usd'),
+        (json.dumps({"id": "dead", "current_price": 0, "total_volume": 1.0}), 'usd'),
+        (json.dumps({"id": "dead", "current_price": 0, "total_volume": 1.0}), 'eur'),
+        (json.dumps({"id": "flat", "current_price": 2.0, "total_volume": 0}), 'usd'),
+    ]
+    transformer.transform_logic(rows, batch_id='b1')
+    transformer.transform_logic(rows, batch_id='b1')    # รันซ้ำต้องไม่เกิดรายการซ้ำ
+
+    store = RejectsStore(db_path)
+    dead = store.query(coin_id='dead')
+    assert sorted(r['vs_currency'] for r in dead) == ['eur', 'usd']
+    assert {(r['reason'], r['rule_id']) for r in dead} == {(REJECT_REASON_ZERO_PRICE_OR_VOLUME, 'zero_price_or_volume')}
+    assert len(store.query(reason=REJECT_REASON_ZERO_PRICE_OR_VOLUME, since=datetime.now(timezone.utc) - timedelta(hours=1))) == 3
+    assert store.query(until=datetime.now(timezone.utc) - timedelta(hours=1)) == []
+    assert store.summary()[0]['count'] == 3
+
+
+def test_transform_returns_typed_columnar_batch_shared_by_dq():
+    """
+    ทดสอบว่าผลลัพธ์ของการ Transform เป็น MarketBatch ที่แปลงชนิดตัวเลขแล้วครั้งเดียว
+    อ่านด้วยชื่อฟิลด์ได้ และขั้น DQ ใช้คอลัมน์ของมันได้โดยตรง
+    """
+    from src.quality.data_quality import DataqualityValidator
+    from src.quality.rules import to_columns
+    from src.transformers.records import MarketBatch, MarketRecord, coerce_number
+
+    assert [coerce_number(v) for v in (5, 1.5, True, '50000', ' 2e3 ', None, 'N/A', {})] == \
+        [5.0, 1.5, None, 50000.0, 2000.0, None, None, None]
+
+    transformer = CryptoTransformer()
+    transformer.save_rejects = lambda data, batch_id=None: None
+    batch = transformer.transform_logic([
+        (json.dumps({"id": "bitcoin", "symbol": "btc", "name": "Bitcoin", "current_price": "50000",
+                     "market_cap": None, "total_volume": 1000}), 'thb'),
+        (json.dumps({"id": "null-price", "current_price": None, "total_volume": 1000}), 'thb'),
+    ], batch_id='b1')
+
+    assert isinstance(batch, MarketBatch) and len(batch) == 1
+    record = batch[0]
+    assert isinstance(record, MarketRecord)
+    assert (record.coin_id, record.price, record.market_cap, record.total_volume, record.vs_currency) == \
+        ('bitcoin', 50000.0, None, 1000.0, 'thb')
+    assert list(batch) == [('b1', 'bitcoin', 'btc', 'Bitcoin', 50000.0, None, 1000.0, None, 'thb')]
+
+    columns = to_columns(batch)
+    assert columns['__numeric__price'] == [50000.0]
+    assert to_columns(batch) is columns
+    assert batch[:1] == list(batch) and batch[1:] == [] and isinstance(batch[:1], MarketBatch)
+    assert DataqualityValidator().validate_market_data(batch) is True
+
+
+def test_save_to_core_maintains_latest_and_ohlc_rollups(tmp_path):
+    """
+    ทดสอบว่า save_to_core อัปเดตตารางสรุปแบบ Incremental: ราคาล่าสุดไม่ถูกเขียนทับด้วยข้อมูลย้อนหลัง
+    แท่ง OHLC ถูกต้องไม่ว่าลำดับการโหลดเป็นอย่างไร การโหลดซ้ำไม่เปลี่ยนผล และ rebuild() ให้ผลเดียวกัน
+    """
+    from src.loaders.rollups import MarketRollups
+
+    db_path = str(tmp_path / 'rollups.db')
+    transformer = CryptoTransformer(db_path=db_path)
+
+    def row(batch_id, updated, price, coin_id='bitcoin'):
+        return (batch_id, coin_id, coin_id[:3], coin_id.title(), price, price * 10, 5.0, updated, 'usd')
+
+    transformer.save_to_core([row('20260101_100000', '2026-01-01T10:05:00.000Z', 100.0),
+                              row('20260101_100000', '2026-01-01T10:05:00.000Z', 0.1, 'dogecoin')])
+    transformer.save_to_core([row('20260101_113000', '2026-01-01T11:30:00.000Z', 90.0)])
+    # ข้อมูลย้อนหลัง (Backfill) มาทีหลัง: เป็นราคาเปิดของวัน แต่ไม่ใช่ราคาล่าสุด
+    transformer.save_to_core([row('20260101_100000', None, 80.0, 'ethereum'),
+                              row('20260101_090000', '2026-01-01T09:00:00+00:00', 120.0)])
+    transformer.save_to_core([row('20260101_113000', '2026-01-01T11:30:00.000Z', 90.0)])   # โหลดซ้ำ
+
+    rollups = MarketRollups(db_path)
+    assert rollups.latest_price('bitcoin') == 90.0
+    assert [r['coin_id'] for r in rollups.latest()] == ['bitcoin', 'ethereum', 'dogecoin']
+    assert rollups.latest(['ethereum'])[0]['batch_id'] == '20260101_100000'
+    assert rollups.ohlc('bitcoin', interval='daily') == [{
+        'bucket': '2026-01-01', 'open': 120.0, 'high': 120.0, 'low': 90.0, 'close': 90.0,
+        'market_cap': 900.0, 'total_volume': 5.0
+    }]
+    assert [(b['bucket'], b['close']) for b in rollups.ohlc('bitcoin', interval='hourly', since='2026-01-01T10:00:00')] \
+        == [('2026-01-01T10:00:00', 100.0), ('2026-01-01T11:00:00', 90.0)]
+    assert rollups.price_range('bitcoin', until='2026-01-01T11:00:00') == {
+        'coin_id': 'bitcoin', 'vs_currency': 'usd', 'from_bucket': '2026-01-01T09:00:00',
+        'to_bucket': '2026-01-01T10:00:00', 'open': 120.0, 'high': 120.0, 'low': 100.0, 'close': 100.0
+    }
+
+    before = rollups.ohlc('bitcoin', interval='hourly'), rollups.latest()
+    assert rollups.rebuild() == 5
+    assert (rollups.ohlc('bitcoin', interval='hourly'), rollups.latest()) == before
+
+
+def test_rollup_rebuild_reads_facts_through_the_storage_backend(tmp_path):
+    """
+    ทดสอบว่า rebuild() อ่าน Fact Table ผ่าน StorageBackend (เช่น PostgreSQL) ไม่ใช่ไฟล์ SQLite ของตารางสถานะ
+    """
+    from src.loaders.backends import StorageBackend
+    from src.loaders.rollups import MarketRollups
+
+    class RemoteFacts(StorageBackend):
+        def iter_facts(self, chunk_size=50000):
+            yield [('20260101_100000', 'bitcoin', 'btc', 'Bitcoin', 100.0, 1.0, 5.0, '2026-01-01T10:00:00Z', 'usd')]
+
+    rollups = MarketRollups(db_path=str(tmp_path / 'state.db'), backend=RemoteFacts())
+
+    assert rollups.rebuild() == 1
+    assert rollups.latest_price('bitcoin') == 100.0